@@ -0,0 +1,73 @@
+"""
+Benchmark the per-fit lookup of `ExperimentAccess.add_fit`.
+
+Times the existence check that `add_fit` runs for every fit, first as an ORM
+query built and compiled on each call and then as the cached compiled
+statement, and prints the hit rate of the statement cache.
+
+Run from the repository root:
+
+    $ python -m benchmarks.fit_lookup 10000
+
+"""
+
+import dataclasses
+import os
+import sys
+import time
+
+import dacite
+from sqlalchemy import and_
+
+from coimbra_chamber.access.experiment.contracts import FitSpec
+from coimbra_chamber.access.experiment.models import Fit
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+import coimbra_chamber.ifx.statements as statements
+
+
+def orm_lookup(session, fit_spec):
+    """Look up a fit with a query built for this call."""
+    return session.query(Fit.idx).filter(
+        and_(
+            Fit.idx == fit_spec.idx,
+            Fit.experiment_id == fit_spec.exp_id,
+            Fit.run_id == fit_spec.run_id,
+            )
+        ).first()
+
+
+def compiled_lookup(session, fit_spec):
+    """Look up a fit with the cached compiled statement."""
+    return ExperimentAccess._execute(
+        session, 'fit_exists', experiment_id=fit_spec.exp_id,
+        run_id=fit_spec.run_id, idx=fit_spec.idx).first()
+
+
+def main(count=10000):
+    """Print lookups per second with and without the statement cache."""
+    os.environ['database_type'] = 'memory'
+    access = ExperimentAccess()
+    fit = dacite.from_dict(
+        FitSpec,
+        {field.name: field.type(1) for field in dataclasses.fields(FitSpec)})
+    fit_specs = [dataclasses.replace(fit, idx=idx) for idx in range(count)]
+    try:
+        access.add_fits(fit_specs, 1)
+        statements.clear()
+        session = access.Session()
+        try:
+            for lookup in [orm_lookup, compiled_lookup]:
+                start = time.perf_counter()
+                for fit_spec in fit_specs:
+                    lookup(session, fit_spec)
+                elapsed = time.perf_counter() - start
+                print(f'{lookup.__name__:>15}: {count / elapsed:,.0f} fits/s')
+        finally:
+            session.close()
+        print(f'statement cache: {statements.get_stats()}')
+    finally:
+        access._teardown()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
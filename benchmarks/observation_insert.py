@@ -0,0 +1,125 @@
+"""
+Benchmark observation inserts on SQLite.
+
+Compares the legacy ORM path (one `Observation` and one `Temperature` object
+per row passed to `session.bulk_save_objects`) with the core executemany path
+used by `ExperimentAccess._add_observations`.
+
+Run from the repository root:
+
+    $ python -m benchmarks.observation_insert 100000
+
+"""
+
+import os
+import sys
+import time
+from decimal import Decimal
+
+import dacite
+
+from coimbra_chamber.access.experiment.contracts import (
+    ObservationSpec,
+    TemperatureSpec)
+from coimbra_chamber.access.experiment.models import Observation, Temperature
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+
+THERMOCOUPLES = range(4, 14)
+
+
+def make_observations(count):
+    """Return `count` synthetic observations with ten thermocouples each."""
+    observations = []
+    for idx in range(count):
+        temperatures = [
+            dacite.from_dict(
+                TemperatureSpec,
+                dict(
+                    thermocouple_num=tc,
+                    temperature=Decimal('290.00') + Decimal(tc) / 100,
+                    idx=idx))
+            for tc in THERMOCOUPLES
+            ]
+        data = dict(
+            cap_man_ok=True,
+            dew_point=Decimal('284.30'),
+            idx=idx,
+            mass=Decimal('0.0129682'),
+            optidew_ok=True,
+            pow_out=Decimal('-0.0011'),
+            pow_ref=Decimal('-0.0015'),
+            pressure=99749,
+            temperatures=temperatures,
+            surface_temp=Decimal('291.30'),
+            ic_temp=Decimal('294.86'))
+        observations.append(dacite.from_dict(ObservationSpec, data))
+    return observations
+
+
+def legacy_insert(access, observations, experiment_id):
+    """Insert observations the way `_add_observations` used to."""
+    session = access.Session()
+    try:
+        objects = []
+        for observation in observations:
+            objects.append(
+                Observation(
+                    cap_man_ok=observation.cap_man_ok,
+                    dew_point=observation.dew_point,
+                    idx=observation.idx,
+                    mass=observation.mass,
+                    optidew_ok=observation.optidew_ok,
+                    pow_out=observation.pow_out,
+                    pow_ref=observation.pow_ref,
+                    pressure=observation.pressure,
+                    experiment_id=experiment_id,
+                    surface_temp=observation.surface_temp,
+                    ic_temp=observation.ic_temp))
+            for temperature in observation.temperatures:
+                objects.append(
+                    Temperature(
+                        thermocouple_num=temperature.thermocouple_num,
+                        temperature=temperature.temperature,
+                        idx=temperature.idx,
+                        experiment_id=experiment_id))
+        session.bulk_save_objects(objects)
+        session.commit()
+    finally:
+        session.close()
+
+
+def executemany_insert(access, observations, experiment_id):
+    """Insert observations through the core executemany path."""
+    access._add_observations(observations, experiment_id)
+
+
+def run(insert, observations):
+    """Time `insert` against a fresh database and return rows per second."""
+    access = ExperimentAccess()
+    try:
+        rows = sum(1 + len(obs.temperatures) for obs in observations)
+        start = time.perf_counter()
+        insert(access, observations, experiment_id=1)
+        elapsed = time.perf_counter() - start
+    finally:
+        access._teardown()
+    return rows, elapsed, rows / elapsed
+
+
+def main(count=100000):
+    """Print rows per second for both insert paths."""
+    os.environ.setdefault('database_type', 'memory')
+    print(f'Generating {count} observations...')
+    observations = make_observations(count)
+    for name, insert in [
+            ('bulk_save_objects', legacy_insert),
+            ('executemany', executemany_insert)]:
+        rows, elapsed, rate = run(insert, observations)
+        print(
+            f'{name:>20}: {rows} rows in {elapsed:.2f} s '
+            f'({rate:,.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
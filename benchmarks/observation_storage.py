@@ -0,0 +1,92 @@
+"""
+Benchmark the observation storage backends.
+
+Compares the `sql` backend on a SQLite database file with the `columnar`
+backend (compressed column files) for insert throughput, full-column scans,
+idx-range reads and size on disk. The synthetic observations repeat the same
+values, so the column files compress far better than they would with real
+data.
+
+Run from the repository root:
+
+    $ python -m benchmarks.observation_storage 100000
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.observation_insert import make_observations
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+
+def size_of(path):
+    """Total size in bytes of a file or of the files under a directory."""
+    if path.is_file():
+        return path.stat().st_size
+    return sum(child.stat().st_size for child in path.rglob('*') if child.is_file())
+
+
+def timed(function, *args, **kwargs):
+    """Return the result of a call and the seconds it took."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(observation_storage, observations, directory):
+    """Time inserts and reads for one backend in a fresh database file."""
+    database_path = Path(directory) / f'{observation_storage}.db'
+    columnar_path = Path(directory) / 'columnar'
+    os.environ['database_type'] = 'sqlite'
+    os.environ['database_path'] = str(database_path)
+    os.environ['observation_storage'] = observation_storage
+    os.environ['observation_store_directory'] = str(columnar_path)
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        _, insert_time = timed(access._add_observations, observations, 1)
+        _, scan_time = timed(
+            access.get_observation_arrays, 1, columns=['mass', 'pressure'])
+        arrays, temperature_time = timed(
+            access.get_observation_arrays, 1, columns=['temperatures'])
+        middle = len(observations) // 2
+        _, range_time = timed(
+            access.get_observation_arrays, 1, idx_range=(middle, middle + 999),
+            columns=['mass'])
+
+        # Fold the WAL back into the database file before measuring it
+        access._engine.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        if observation_storage == 'columnar':
+            size = size_of(columnar_path)
+        else:
+            size = size_of(database_path)
+    finally:
+        access._teardown()
+    return dict(
+        insert=insert_time, scan=scan_time, temperatures=temperature_time,
+        range=range_time, readings=arrays['temperatures'].size, size=size)
+
+
+def main(count=100000):
+    """Print insert and read throughput and size for both backends."""
+    print(f'Generating {count} observations...')
+    observations = make_observations(count)
+    with tempfile.TemporaryDirectory() as directory:
+        for observation_storage in ['sql', 'columnar']:
+            result = run(observation_storage, observations, directory)
+            print(
+                f'{observation_storage:>8}: '
+                f'insert {count / result["insert"]:,.0f} obs/s, '
+                f'scan 2 columns {count / result["scan"]:,.0f} obs/s, '
+                f'temperatures {result["readings"] / result["temperatures"]:,.0f} '
+                f'readings/s, '
+                f'1000-idx range {1e3 * result["range"]:.1f} ms, '
+                f'{result["size"] / 2**10:,.0f} KiB')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,127 @@
+"""
+Show query plans and timings for the access patterns of `ExperimentAccess`.
+
+Builds a SQLite database file with several experiments, then runs each
+per-experiment query the service uses with the experiment-leading indexes
+and again after dropping them.
+
+Run from the repository root:
+
+    $ python -m benchmarks.query_plans 20 5000
+
+"""
+
+import dataclasses
+import datetime
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import dacite
+
+from benchmarks.observation_insert import make_observations
+from coimbra_chamber.access.experiment.contracts import ExperimentSpec, FitSpec
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+
+INDEXES = [
+    'ix_Experiments_datetime',
+    'ix_Observations_experiment_id_idx',
+    'ix_Temperatures_experiment_id_idx',
+    'ix_PackedTemperatures_experiment_id_idx',
+    'ix_Fits_experiment_id_idx',
+    ]
+
+QUERIES = dict(
+    observation_count=(
+        'SELECT count(experiment_id) FROM "Observations" '
+        'WHERE experiment_id = :experiment_id'),
+    temperature_count=(
+        'SELECT count(experiment_id) FROM "Temperatures" '
+        'WHERE experiment_id = :experiment_id'),
+    observation_arrays=(
+        'SELECT idx, mass, pressure FROM "Observations" '
+        'WHERE experiment_id = :experiment_id ORDER BY idx'),
+    temperature_arrays=(
+        'SELECT idx, thermocouple_num, temperature FROM "Temperatures" '
+        'WHERE experiment_id = :experiment_id ORDER BY idx'),
+    existing_fits=(
+        'SELECT idx FROM "Fits" '
+        'WHERE experiment_id = :experiment_id AND idx BETWEEN 0 AND 100000'),
+    experiment_by_datetime=(
+        'SELECT experiment_id FROM "Experiments" WHERE datetime = :datetime'),
+    )
+
+
+def populate(access, experiments, observations_per_experiment):
+    """Add experiments with observations and a fit every 100 idx."""
+    observations = make_observations(observations_per_experiment)
+    fit = dacite.from_dict(
+        FitSpec,
+        {field.name: field.type(1) for field in dataclasses.fields(FitSpec)})
+    for number in range(experiments):
+        experiment = dacite.from_dict(
+            ExperimentSpec,
+            dict(
+                author='RHI',
+                datetime=datetime.datetime(2019, 1, 1) + datetime.timedelta(
+                    days=number),
+                description='Benchmark experiment.',
+                tube_id=1))
+        experiment_id = access._add_experiment(experiment, setting_id=1)
+        access._add_observations(observations, experiment_id)
+        fits = [
+            dataclasses.replace(fit, idx=idx)
+            for idx in range(0, observations_per_experiment, 100)
+            ]
+        access.add_fits(fits, experiment_id)
+
+
+def measure(access, params, repeat=5):
+    """Print the plan and the mean time of every query."""
+    for name, sql in QUERIES.items():
+        plan = access._engine.execute(
+            f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            access._engine.execute(sql, params).fetchall()
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f'  {name:>22}: {1e3 * elapsed:8.2f} ms  '
+              f'{" | ".join(row[-1] for row in plan)}')
+
+
+def main(experiments=20, observations_per_experiment=5000):
+    """Print plans and timings with and without the indexes."""
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['database_type'] = 'sqlite'
+        os.environ['database_path'] = str(Path(directory) / 'plans.db')
+        access = ExperimentAccess()
+        access.setup_schema()
+        try:
+            print(
+                f'Adding {experiments} experiments with '
+                f'{observations_per_experiment} observations each...')
+            populate(access, experiments, observations_per_experiment)
+            access._engine.execute('ANALYZE;')
+            # Query the experiment in the middle of the table
+            params = dict(
+                experiment_id=experiments // 2 + 1,
+                datetime=datetime.datetime(2019, 1, 1) + datetime.timedelta(
+                    days=experiments // 2))
+
+            print('With experiment-leading indexes:')
+            measure(access, params)
+
+            for index in INDEXES:
+                access._engine.execute(f'DROP INDEX "{index}";')
+            access._engine.execute('ANALYZE;')
+            print('Without experiment-leading indexes:')
+            measure(access, params)
+        finally:
+            access._teardown()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
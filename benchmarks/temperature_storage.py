@@ -0,0 +1,67 @@
+"""
+Benchmark the thermocouple storage layouts on a SQLite database file.
+
+Compares the `rows` layout (one `Temperatures` row per reading) with the
+`packed` layout (one `PackedTemperatures` row per observation) for insert
+throughput, read throughput through `ExperimentAccess._get_temperature_arrays`
+and database size.
+
+Run from the repository root:
+
+    $ python -m benchmarks.temperature_storage 100000
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.observation_insert import make_observations
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+
+def run(temperature_storage, observations, directory):
+    """Time inserts and reads for one layout in a fresh database file."""
+    path = Path(directory) / f'{temperature_storage}.db'
+    os.environ['database_type'] = 'sqlite'
+    os.environ['database_path'] = str(path)
+    os.environ['temperature_storage'] = temperature_storage
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        start = time.perf_counter()
+        access._add_observations(observations, experiment_id=1)
+        insert_time = time.perf_counter() - start
+
+        with access._engine.connect() as connection:
+            start = time.perf_counter()
+            _, _, temperatures = access._get_temperature_arrays(connection, 1)
+            read_time = time.perf_counter() - start
+
+        # Fold the WAL back into the database file before measuring it
+        access._engine.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        size = path.stat().st_size
+    finally:
+        access._teardown()
+    return temperatures.size, insert_time, read_time, size
+
+
+def main(count=100000):
+    """Print insert and read throughput and file size for both layouts."""
+    print(f'Generating {count} observations...')
+    observations = make_observations(count)
+    with tempfile.TemporaryDirectory() as directory:
+        for temperature_storage in ['rows', 'packed']:
+            readings, insert_time, read_time, size = run(
+                temperature_storage, observations, directory)
+            print(
+                f'{temperature_storage:>7}: '
+                f'insert {count / insert_time:,.0f} obs/s, '
+                f'read {readings / read_time:,.0f} readings/s, '
+                f'{size / 2**20:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -1,3 +1,4 @@
 """Chamber module."""
 
 from coimbra_chamber.manager.data.service import DataManager
+from coimbra_chamber.manager.worker.service import AnalysisWorker
@@ -0,0 +1,389 @@
+"""Parquet archives of the experiment database."""
+
+from decimal import Decimal
+from pathlib import Path
+
+from sqlalchemy import (
+    Boolean, DateTime, Float, Integer, LargeBinary, Numeric, and_, select,
+    type_coerce)
+
+from coimbra_chamber.access.experiment.models import (
+    AnalysisRun,
+    Experiment,
+    ExperimentSummary,
+    Fit,
+    FitSummary,
+    Observation,
+    PackedTemperature,
+    Setting,
+    Temperature,
+    Tube)
+from coimbra_chamber.access.experiment.service import (
+    _EXPERIMENT_KEYS,
+    _SETTING_KEYS,
+    _TUBE_KEYS,
+    ExperimentAccess)
+import coimbra_chamber.ifx.expressions as expressions
+
+
+# Tables in the order they are loaded, parents first
+_TABLES = [
+    Tube.__table__,
+    Setting.__table__,
+    Experiment.__table__,
+    AnalysisRun.__table__,
+    Observation.__table__,
+    Temperature.__table__,
+    PackedTemperature.__table__,
+    Fit.__table__,
+    ExperimentSummary.__table__,
+    FitSummary.__table__,
+    ]
+
+# Tables written with one directory per experiment
+_PARTITIONED_TABLES = _TABLES[4:]
+
+
+def _import_pyarrow():
+    # pyarrow is an optional dependency; only archives need it.
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as err:  # pragma: no cover
+        raise ImportError(
+            'Parquet archives need pyarrow: '
+            '`pip install coimbra_chamber[parquet]`.') from err
+    return pyarrow, pyarrow.parquet
+
+
+class ParquetArchive(object):
+    """
+    Parquet export and import of the experiment database.
+
+    Every table is written to its own directory of Parquet files. Tables
+    with experiment data are partitioned into one directory per experiment
+    (`Observations/experiment_1/part-0.parquet`). Rows are streamed in
+    record batches both ways and loaded with executemany, so no orm objects
+    are created.
+
+    Observations held by the columnar observation storage are not part of
+    the database and are not archived.
+
+    Examples
+    --------
+    >>> archive = ParquetArchive()
+    >>> archive.export('campaign')
+    {'Tubes': 1, 'Settings': 4, 'Experiments': 12, ...}
+
+    And on another machine:
+    >>> ParquetArchive().load('campaign')
+    {'Tubes': 1, 'Settings': 4, 'Experiments': 12, ...}
+
+    """
+
+    # ------------------------------------------------------------------------
+    # Constructors
+
+    def __init__(self, exp_acc=None):
+        """
+        Create an archive for a database.
+
+        Parameters
+        ----------
+        exp_acc : coimbra_chamber.access.experiment.service.ExperimentAccess
+            Access service for the database. Defaults to a new instance.
+
+        """
+        self._exp_acc = exp_acc or ExperimentAccess()
+
+    # ------------------------------------------------------------------------
+    # Public methods: included in the API
+
+    def export(self, directory, experiment_ids=None):
+        """
+        Export the database to Parquet files.
+
+        Parameters
+        ----------
+        directory : str or pathlib.Path
+            Directory to write the archive to.
+        experiment_ids : list of int, optional
+            Experiments to export. Defaults to every experiment. Tubes and
+            settings are always exported in full.
+
+        Returns
+        -------
+        dict of {str: int}
+            Rows written per table.
+
+        """
+        pyarrow, parquet = _import_pyarrow()
+        directory = Path(directory)
+        counts = {}
+        for table in _TABLES:
+            schema = self._get_schema(pyarrow, table)
+            # Numeric columns are exported as floats rather than Decimals.
+            columns = [
+                type_coerce(column, Float()).label(column.name)
+                if isinstance(column.type, Numeric)
+                and not isinstance(column.type, Float)
+                else column
+                for column in table.columns
+                ]
+            statement = select(columns)
+            if experiment_ids is not None and 'experiment_id' in table.c:
+                statement = statement.where(
+                    table.c.experiment_id.in_(experiment_ids))
+            if table in _PARTITIONED_TABLES:
+                statement = statement.order_by(table.c.experiment_id)
+                connectables = self._exp_acc._get_experiment_engines()
+            else:
+                connectables = [self._exp_acc._engine]
+
+            counts[table.name] = 0
+            for engine in connectables:
+                with engine.connect() as connection:
+                    result = connection.execution_options(
+                        stream_results=True).execute(statement)
+                    counts[table.name] += self._write(
+                        pyarrow, parquet, result, table, schema,
+                        directory / table.name)
+        return counts
+
+    def load(self, directory):
+        """
+        Load a Parquet archive into the database.
+
+        Tubes and settings are matched to existing rows by value and
+        experiments by datetime, analysis runs by experiment and parameter
+        hash; unmatched rows are added with new ids, and the ids of every
+        loaded row are rewritten to match. Observations, temperatures and
+        fits already stored are skipped, so loading an archive twice, or
+        into a database that holds part of it, is safe. Summaries are rebuilt
+        from the loaded rows rather than copied.
+
+        Tubes, settings, experiments and runs are loaded in one transaction,
+        then each file of experiment data in its own.
+
+        Parameters
+        ----------
+        directory : str or pathlib.Path
+            Directory written by `export`.
+
+        Returns
+        -------
+        dict of {str: int}
+            Rows read per table.
+
+        Raises
+        ------
+        ValueError
+            If an archived experiment has the datetime of a stored experiment
+            that differs from it.
+
+        """
+        _, parquet = _import_pyarrow()
+        directory = Path(directory)
+        counts = {table.name: 0 for table in _TABLES}
+        # Archived ids to the ids they are loaded as; fits added outside of
+        # a run belong to run 0 everywhere.
+        ids = dict(tube_id={}, setting_id={}, experiment_id={}, run_id={0: 0})
+        try:
+            session = self._exp_acc.Session()
+            try:
+                for table in _TABLES[:len(_TABLES) - len(_PARTITIONED_TABLES)]:
+                    for path in sorted((directory / table.name).glob('*.parquet')):
+                        for row in self._read(parquet, path):
+                            self._load_parent(session, table, row, ids)
+                            counts[table.name] += 1
+                session.commit()
+            except:  # pragma: no cover
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+            loaded = set()
+            for table in _PARTITIONED_TABLES:
+                statement = expressions.insert_or_ignore(table)
+                paths = sorted((directory / table.name).glob('**/*.parquet'))
+                for path in paths:
+                    archived_id = int(path.parent.name.split('_')[-1])
+                    experiment_id = ids['experiment_id'][archived_id]
+                    loaded.add(experiment_id)
+                    if table in (
+                            ExperimentSummary.__table__, FitSummary.__table__):
+                        counts[table.name] += (
+                            parquet.ParquetFile(path).metadata.num_rows)
+                        continue
+                    session = self._exp_acc._get_session(experiment_id)
+                    try:
+                        rows = []
+                        for row in self._read(parquet, path):
+                            row['experiment_id'] = experiment_id
+                            if 'run_id' in row:
+                                row['run_id'] = ids['run_id'][row['run_id']]
+                            rows.append(row)
+                            if len(rows) == self._exp_acc._batch_size:
+                                session.execute(statement, rows)
+                                counts[table.name] += len(rows)
+                                rows = []
+                        if rows:
+                            session.execute(statement, rows)
+                            counts[table.name] += len(rows)
+                        session.commit()
+                    except:  # pragma: no cover
+                        session.rollback()
+                        raise
+                    finally:
+                        session.close()
+
+            for experiment_id in sorted(loaded):
+                self._exp_acc.rebuild_experiment_summary(experiment_id)
+        finally:
+            # Tube and setting ids may have changed.
+            self._exp_acc._clear_dimension_ids()
+        return counts
+
+    # ------------------------------------------------------------------------
+    # Internal methods: not included in the API
+
+    def _read(self, parquet, path):
+        # Rows of a Parquet file as dictionaries, streamed in record batches
+        for batch in parquet.ParquetFile(path).iter_batches(
+                batch_size=self._exp_acc._batch_size):
+            columns = batch.to_pydict()
+            for values in zip(*columns.values()):
+                yield dict(zip(columns, values))
+
+    @staticmethod
+    def _get_decimals(row, keys):
+        # Numeric columns are archived as floats; their shortest repr is the
+        # stored decimal, so they compare equal to stored rows again.
+        return {
+            key: Decimal(repr(row[key])) if isinstance(row[key], float)
+            else row[key]
+            for key in keys}
+
+    def _load_parent(self, session, table, row, ids):
+        # Match a tube, setting, experiment or run to a stored one, adding it
+        # if there is none, and record the id it is loaded as.
+        exp_acc = self._exp_acc
+        if table is Tube.__table__:
+            params = self._get_decimals(row, _TUBE_KEYS)
+            tube_id = exp_acc._execute(session, 'tube_id', **params).scalar()
+            if tube_id is None:
+                exp_acc._execute(session, 'add_tube', **params)
+                tube_id = exp_acc._execute(
+                    session, 'tube_id', **params).scalar()
+            ids['tube_id'][row['tube_id']] = tube_id
+        elif table is Setting.__table__:
+            params = self._get_decimals(row, _SETTING_KEYS)
+            setting_id = exp_acc._execute(
+                session, 'setting_id', **params).scalar()
+            if setting_id is None:
+                exp_acc._execute(session, 'add_setting', **params)
+                setting_id = exp_acc._execute(
+                    session, 'setting_id', **params).scalar()
+            ids['setting_id'][row['setting_id']] = setting_id
+        elif table is Experiment.__table__:
+            params = {key: row[key] for key in _EXPERIMENT_KEYS}
+            params['tube_id'] = ids['tube_id'].get(row['tube_id'])
+            params['setting_id'] = ids['setting_id'].get(row['setting_id'])
+            experiment_id = exp_acc._execute(
+                session, 'experiment_id', datetime=row['datetime']).scalar()
+            if experiment_id is None:
+                experiment_id = exp_acc._execute(
+                    session, 'add_experiment', **params).inserted_primary_key[0]
+            else:
+                stored = session.execute(
+                    select([table.c[key] for key in _EXPERIMENT_KEYS]).where(
+                        table.c.experiment_id == experiment_id)).first()
+                if tuple(stored) != tuple(params.values()):
+                    err_msg = (
+                        f'Archived experiment `{row["experiment_id"]}` has the '
+                        f'datetime of experiment `{experiment_id}`, which '
+                        'differs from it.')
+                    raise ValueError(err_msg)
+            ids['experiment_id'][row['experiment_id']] = experiment_id
+        else:
+            params = dict(
+                row, experiment_id=ids['experiment_id'][row['experiment_id']])
+            del params['run_id']
+            where = and_(
+                table.c.experiment_id == params['experiment_id'],
+                table.c.param_hash == params['param_hash'])
+            run_id = session.execute(
+                select([table.c.run_id]).where(where)).scalar()
+            if run_id is None:
+                run_id = session.execute(
+                    table.insert(), params).inserted_primary_key[0]
+            ids['run_id'][row['run_id']] = run_id
+
+    def _write(self, pyarrow, parquet, result, table, schema, directory):
+        # Write streamed rows, starting a new file whenever the experiment
+        # changes for partitioned tables. An experiment can be spread over
+        # the catalog and its shard, so files are numbered per directory.
+        partitioned = table in _PARTITIONED_TABLES
+        if partitioned:
+            position = list(table.c.keys()).index('experiment_id')
+        writer, current, count = None, None, 0
+        try:
+            while True:
+                rows = result.fetchmany(self._exp_acc._batch_size)
+                if not rows:
+                    break
+                start = 0
+                while start < len(rows):
+                    stop = len(rows)
+                    if partitioned:
+                        experiment_id = rows[start][position]
+                        while (stop > start
+                               and rows[stop - 1][position] != experiment_id):
+                            stop -= 1
+                        if experiment_id != current:
+                            if writer:
+                                writer.close()
+                            writer = None
+                            current = experiment_id
+                    if writer is None:
+                        path = directory
+                        if partitioned:
+                            path = path / f'experiment_{current}'
+                        path.mkdir(parents=True, exist_ok=True)
+                        part = len(list(path.glob('part-*.parquet')))
+                        writer = parquet.ParquetWriter(
+                            str(path / f'part-{part}.parquet'), schema)
+                    columns = zip(*rows[start:stop])
+                    arrays = [
+                        pyarrow.array(values, type=field.type)
+                        for values, field in zip(columns, schema)
+                        ]
+                    writer.write_batch(
+                        pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+                    count += stop - start
+                    start = stop
+        finally:
+            result.close()
+            if writer:
+                writer.close()
+        return count
+
+    @staticmethod
+    def _get_schema(pyarrow, table):
+        fields = []
+        for column in table.columns:
+            if isinstance(column.type, Boolean):
+                type_ = pyarrow.bool_()
+            elif isinstance(column.type, Integer):
+                type_ = pyarrow.int64()
+            elif isinstance(column.type, Numeric):
+                type_ = pyarrow.float64()
+            elif isinstance(column.type, DateTime):
+                type_ = pyarrow.timestamp('us')
+            elif isinstance(column.type, LargeBinary):
+                type_ = pyarrow.binary()
+            else:
+                type_ = pyarrow.string()
+            fields.append(pyarrow.field(column.name, type_, column.nullable))
+        return pyarrow.schema(fields)
@@ -0,0 +1,181 @@
+"""Asynchronous experiment access service."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+import coimbra_chamber.ifx.configuration as config
+
+
+class AsyncExperimentAccess(object):
+    """
+    Asynchronous experiment access.
+
+    Each call runs the matching `ExperimentAccess` method on a thread pool
+    that is sized to the shared connection pool, so one event loop can keep
+    many inserts and queries in flight.
+
+    Examples
+    --------
+    >>> async def ingest(data_specs):
+    ...     async with AsyncExperimentAccess() as access:
+    ...         return await asyncio.gather(
+    ...             *(access.add_raw_data(spec) for spec in data_specs))
+
+    """
+
+    # ------------------------------------------------------------------------
+    # Constructors
+
+    def __init__(self, max_workers=None):
+        """
+        Create the thread pool that runs database calls.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Number of database calls in flight at once. Defaults to the
+            `pool_size` setting, or one for the in-memory database, which
+            only has a single connection.
+
+        """
+        self._exp_acc = ExperimentAccess()
+        if max_workers is None:
+            if self._exp_acc._conn_string == 'sqlite:///:memory:':
+                max_workers = 1
+            else:
+                max_workers = int(config.get_value('pool_size') or 5)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='ExperimentAccess')
+
+    async def __aenter__(self):  # noqa: D105
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):  # noqa: D105
+        await self.close()
+
+    # ------------------------------------------------------------------------
+    # Public methods: included in the API
+
+    async def add_raw_data(self, data_specs, progress=None, verify=False):
+        """
+        Add experimental data to the database.
+
+        See Also
+        --------
+        ExperimentAccess.add_raw_data
+
+        """
+        return await self._run(
+            self._exp_acc.add_raw_data, data_specs, progress=progress,
+            verify=verify)
+
+    async def add_fit(self, fit_spec, experiment_id):
+        """
+        Add fit to the database.
+
+        See Also
+        --------
+        ExperimentAccess.add_fit
+
+        """
+        return await self._run(self._exp_acc.add_fit, fit_spec, experiment_id)
+
+    async def add_fits(self, fit_specs, experiment_id):
+        """
+        Add all fits for an experiment to the database in one transaction.
+
+        See Also
+        --------
+        ExperimentAccess.add_fits
+
+        """
+        return await self._run(self._exp_acc.add_fits, fit_specs, experiment_id)
+
+    async def get_observation_arrays(
+            self, experiment_id, idx_range=None, columns=None):
+        """
+        Get the observations of an experiment as NumPy arrays.
+
+        See Also
+        --------
+        ExperimentAccess.get_observation_arrays
+
+        """
+        return await self._run(
+            self._exp_acc.get_observation_arrays, experiment_id,
+            idx_range=idx_range, columns=columns)
+
+    async def get_fits(self, columns=None, as_frame=True, **filters):
+        """
+        Get fits, with the settings and tube of their experiments.
+
+        See Also
+        --------
+        ExperimentAccess.get_fits
+
+        """
+        return await self._run(
+            self._exp_acc.get_fits, columns=columns, as_frame=as_frame,
+            **filters)
+
+    async def aggregate_fits(
+            self, values=None, by=None, as_frame=True, **filters):
+        """
+        Aggregate fits per setting, tube or any other fit query column.
+
+        See Also
+        --------
+        ExperimentAccess.aggregate_fits
+
+        """
+        return await self._run(
+            self._exp_acc.aggregate_fits, values=values, by=by,
+            as_frame=as_frame, **filters)
+
+    async def get_experiment_summary(self, experiment_id, run_id=None):
+        """
+        Get the aggregates of an experiment's observations and fits.
+
+        See Also
+        --------
+        ExperimentAccess.get_experiment_summary
+
+        """
+        return await self._run(
+            self._exp_acc.get_experiment_summary, experiment_id, run_id)
+
+    async def get_analysis_runs(self, experiment_id):
+        """
+        Get the analysis runs of an experiment.
+
+        See Also
+        --------
+        ExperimentAccess.get_analysis_runs
+
+        """
+        return await self._run(self._exp_acc.get_analysis_runs, experiment_id)
+
+    async def get_job_counts(self):
+        """
+        Get the number of jobs by status.
+
+        See Also
+        --------
+        ExperimentAccess.get_job_counts
+
+        """
+        return await self._run(self._exp_acc.get_job_counts)
+
+    async def close(self):
+        """Wait for calls in flight to finish and stop the thread pool."""
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True))
+
+    # ------------------------------------------------------------------------
+    # Internal methods: not included in the API
+
+    async def _run(self, method, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(method, *args, **kwargs))
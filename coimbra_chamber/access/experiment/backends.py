@@ -0,0 +1,396 @@
+"""Observation storage backends for experiment access."""
+
+import abc
+import os
+import shutil
+import struct
+import uuid
+import zlib
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import and_, event, func, select
+
+from coimbra_chamber.access.experiment.models import (
+    Observation,
+    ObservationChunk,
+    Temperature)
+
+
+# Session info key of the chunk files written in its transaction
+_PENDING = 'pending_observation_chunks'
+
+
+class ObservationStore(abc.ABC):
+    """
+    Storage for the observations and temperatures of experiments.
+
+    `ExperimentAccess` reads and writes observations only through this
+    interface; tubes, settings, experiments, fits and summaries always live
+    in the database. Methods that take a `session` are given the session of
+    the surrounding transaction, which backends outside the database may
+    ignore.
+    """
+
+    @abc.abstractmethod
+    def add(self, session, observations, experiment_id):
+        """
+        Add the observations that are not stored yet.
+
+        Parameters
+        ----------
+        session : sqlalchemy.orm.Session
+            Session of the surrounding transaction.
+        observations : list of coimbra_chamber.access.experiment.contracts.ObservationSpec
+            Observations, including their temperatures.
+        experiment_id : int
+            ExperimentId for all of the observations.
+
+        Returns
+        -------
+        list of coimbra_chamber.access.experiment.contracts.ObservationSpec
+            Observations that were added.
+
+        """
+
+    @abc.abstractmethod
+    def get_arrays(
+            self, experiment_id, idx_range=None, columns=None,
+            connection=None):
+        """
+        Get the observations of an experiment as NumPy arrays.
+
+        `connection` is the connection of the surrounding transaction, to
+        read rows it has not committed yet; defaults to a new connection.
+
+        See Also
+        --------
+        ExperimentAccess.get_observation_arrays
+
+        """
+
+    @abc.abstractmethod
+    def get_counts(self, session, experiment_id):
+        """Get the number of observations and temperatures stored."""
+
+    @abc.abstractmethod
+    def get_resume_idx(self, session, experiment_id):
+        """Get the largest idx stored, or None if there are none."""
+
+    def teardown(self):
+        """Delete everything the store holds outside the database."""
+
+
+class SQLObservationStore(ObservationStore):
+    """Observations stored in the `Observations` and temperature tables."""
+
+    def __init__(self, access):  # noqa: D107
+        self._access = access
+
+    def add(self, session, observations, experiment_id):  # noqa: D102
+        return self._access._insert_sql_observations(
+            session, observations, experiment_id)
+
+    def get_arrays(
+            self, experiment_id, idx_range=None, columns=None,
+            connection=None):  # noqa: D102
+        return self._access._get_sql_observation_arrays(
+            experiment_id, idx_range, columns, connection)
+
+    def get_counts(self, session, experiment_id):  # noqa: D102
+        return self._access._get_sql_observation_counts(session, experiment_id)
+
+    def get_resume_idx(self, session, experiment_id):  # noqa: D102
+        return self._access._get_sql_resume_idx(session, experiment_id)
+
+
+class ColumnarObservationStore(ObservationStore):
+    """
+    Observations stored in compressed chunk files.
+
+    Each experiment has a directory of chunk files of up to `chunk_size`
+    observations. A chunk file holds every column zlib-compressed behind an
+    index of their offsets, so reads only decompress the columns they need.
+    Temperatures are stored as a 2-D array per chunk, along with the
+    thermocouple numbers of its columns; missing readings are NaN.
+
+    A chunk is written to a temporary file and renamed into place, then
+    listed in `ObservationChunks` with its idx range and counts in the
+    transaction that adds it. Only listed chunks are read, so a crash never
+    exposes a partial chunk and a rolled back ingest leaves nothing behind;
+    the files of a transaction that does not commit are deleted. Writers of
+    an experiment hold a lock on its listing until their transaction ends,
+    so concurrent ingests never store an observation twice.
+    """
+
+    # Number of columns in a chunk file, then the name, offset and size of
+    # each compressed column
+    _count = struct.Struct('<I')
+    _section = struct.Struct('<32sQQ')
+
+    def __init__(self, access, directory, chunk_size=65536, compression_level=1):
+        """
+        Create a store under a directory.
+
+        Parameters
+        ----------
+        access : coimbra_chamber.access.experiment.service.ExperimentAccess
+            Access service whose database lists the chunks.
+        directory : str or pathlib.Path
+            Directory holding one subdirectory per experiment.
+        chunk_size : int, default 65536
+            Observations per chunk.
+        compression_level : int, default 1
+            zlib compression level.
+
+        """
+        self._access = access
+        self._directory = Path(directory)
+        self._dtypes = access._observation_dtypes
+        self._chunk_size = chunk_size
+        self._compression_level = compression_level
+
+    # ------------------------------------------------------------------------
+    # Public methods: included in the API
+
+    def add(self, session, observations, experiment_id):  # noqa: D102
+        if not observations:
+            return []
+        self._lock(session, experiment_id)
+        idx = [observation.idx for observation in observations]
+        chunks = self._get_chunks(
+            session.connection(), experiment_id, (min(idx), max(idx)))
+        existing_idxs = set(
+            self._read(experiment_id, chunks, ['idx'])['idx'].tolist())
+        observations = [
+            observation for observation in observations
+            if observation.idx not in existing_idxs
+            ]
+        directory = self._get_directory(experiment_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        rows = [
+            self._write_chunk(
+                session, directory, observations[start:start + self._chunk_size],
+                experiment_id)
+            for start in range(0, len(observations), self._chunk_size)
+            ]
+        if rows:
+            session.execute(ObservationChunk.__table__.insert(), rows)
+        return observations
+
+    def get_arrays(
+            self, experiment_id, idx_range=None, columns=None,
+            connection=None):  # noqa: D102
+        if columns is None:
+            columns = list(self._dtypes) + ['temperatures']
+        names = ['idx'] + [name for name in columns if name in self._dtypes]
+        if 'temperatures' in columns:
+            names += ['thermocouples', 'temperatures']
+
+        if connection is None:
+            engine = self._access._get_engine(experiment_id, create=False)
+            with engine.connect() as connection:
+                chunks = self._get_chunks(connection, experiment_id, idx_range)
+        else:
+            chunks = self._get_chunks(connection, experiment_id, idx_range)
+        arrays = self._read(experiment_id, chunks, names)
+
+        # Keep the requested idx, in order
+        keep = np.argsort(arrays['idx'], kind='stable')
+        if idx_range:
+            in_range = (
+                (arrays['idx'][keep] >= idx_range[0])
+                & (arrays['idx'][keep] <= idx_range[1]))
+            keep = keep[in_range]
+        for name in arrays:
+            if name != 'thermocouples':
+                arrays[name] = arrays[name][keep]
+        return arrays
+
+    def get_counts(self, session, experiment_id):  # noqa: D102
+        table = ObservationChunk.__table__
+        counts = session.execute(
+            select([
+                func.coalesce(func.sum(table.c.observation_count), 0),
+                func.coalesce(func.sum(table.c.temperature_count), 0),
+                ]).where(table.c.experiment_id == experiment_id)).first()
+        return dict(observations=int(counts[0]), temperatures=int(counts[1]))
+
+    def get_resume_idx(self, session, experiment_id):  # noqa: D102
+        table = ObservationChunk.__table__
+        return session.execute(
+            select([func.max(table.c.max_idx)]).where(
+                table.c.experiment_id == experiment_id)).scalar()
+
+    def teardown(self):  # noqa: D102
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    # ------------------------------------------------------------------------
+    # Internal methods: not included in the API
+
+    def _get_directory(self, experiment_id):
+        return self._directory / f'experiment_{experiment_id}'
+
+    @staticmethod
+    def _lock(session, experiment_id):
+        # Lock the listing of the experiment until the transaction ends.
+        # SQLite ignores FOR UPDATE, so a write that changes nothing takes
+        # its database write lock instead.
+        table = ObservationChunk.__table__
+        where = table.c.experiment_id == experiment_id
+        if session.get_bind().dialect.name == 'sqlite':
+            session.execute(
+                table.update().where(where).values(
+                    experiment_id=table.c.experiment_id))
+        else:  # pragma: no cover
+            session.execute(
+                select([table.c.min_idx]).where(where).with_for_update())
+
+    @staticmethod
+    def _get_chunks(connection, experiment_id, idx_range=None):
+        # Listed chunks of an experiment that overlap the idx range
+        table = ObservationChunk.__table__
+        where = table.c.experiment_id == experiment_id
+        if idx_range:
+            where = and_(
+                where, table.c.max_idx >= idx_range[0],
+                table.c.min_idx <= idx_range[1])
+        return connection.execute(
+            select([table.c.file_name, table.c.observation_count])
+            .where(where).order_by(table.c.min_idx)).fetchall()
+
+    def _write_chunk(self, session, directory, observations, experiment_id):
+        idx = np.array([obs.idx for obs in observations], dtype=np.int64)
+        columns = dict(idx=idx)
+        for name, dtype in self._dtypes.items():
+            values = np.array(
+                [getattr(obs, name) for obs in observations], dtype=dtype)
+            # Match the scale the database would store.
+            scale = getattr(Observation.__table__.c[name].type, 'scale', None)
+            if scale is not None:
+                values = np.round(values, scale)
+            columns[name] = values
+
+        thermocouples = sorted({
+            temp.thermocouple_num
+            for obs in observations for temp in obs.temperatures
+            })
+        positions = {num: position for position, num in enumerate(thermocouples)}
+        temperatures = np.full((len(observations), len(thermocouples)), np.nan)
+        for row, obs in enumerate(observations):
+            for temp in obs.temperatures:
+                temperatures[row, positions[temp.thermocouple_num]] = (
+                    temp.temperature)
+        columns['thermocouples'] = np.array(thermocouples, dtype=np.int64)
+        columns['temperatures'] = np.round(
+            temperatures, Temperature.__table__.c.temperature.type.scale)
+
+        # Index of the compressed columns, then the columns
+        payloads = [
+            (name, zlib.compress(values.tobytes(), self._compression_level))
+            for name, values in columns.items()
+            ]
+        offset = self._count.size + self._section.size * len(payloads)
+        parts = [self._count.pack(len(payloads))]
+        for name, payload in payloads:
+            parts.append(self._section.pack(name.encode(), offset, len(payload)))
+            offset += len(payload)
+        parts += [payload for _, payload in payloads]
+
+        file_name = f'chunk_{uuid.uuid4().hex}.chk'
+        path = directory / file_name
+        temporary_path = directory / f'{file_name}.tmp'
+        self._track(session, [temporary_path, path])
+        with open(temporary_path, 'wb') as stream:
+            stream.write(b''.join(parts))
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary_path, path)
+        return dict(
+            file_name=file_name,
+            observation_count=len(observations),
+            temperature_count=int(np.count_nonzero(~np.isnan(temperatures))),
+            min_idx=int(idx.min()),
+            max_idx=int(idx.max()),
+            experiment_id=experiment_id)
+
+    @classmethod
+    def _track(cls, session, paths):
+        # Files written in the transaction of a session are deleted unless
+        # it commits.
+        if _PENDING not in session.info:
+            session.info[_PENDING] = []
+            event.listen(session, 'after_commit', cls._keep_files)
+            event.listen(session, 'after_transaction_end', cls._discard_files)
+        session.info[_PENDING] += paths
+
+    @staticmethod
+    def _keep_files(session):
+        session.info[_PENDING].clear()
+
+    @staticmethod
+    def _discard_files(session, transaction):
+        if transaction.parent is not None:
+            return
+        for path in session.info[_PENDING]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        session.info[_PENDING].clear()
+
+    def _read(self, experiment_id, chunks, names):
+        # Columns of the chunks, with the temperatures of every chunk aligned
+        # to the thermocouples of all of them
+        directory = self._get_directory(experiment_id)
+        values = {name: [] for name in names}
+        for file_name, rows in chunks:
+            payloads = self._read_chunk(directory / file_name, names)
+            for name in names:
+                if name == 'temperatures':
+                    continue
+                values[name].append(
+                    np.frombuffer(payloads[name], dtype=self._get_dtype(name)))
+            if 'temperatures' in names:
+                values['temperatures'].append(
+                    np.frombuffer(payloads['temperatures'], dtype=np.float64)
+                    .reshape(rows, len(values['thermocouples'][-1])))
+
+        arrays = {}
+        for name in names:
+            if name == 'temperatures':
+                continue
+            arrays[name] = np.concatenate(
+                values[name] or [np.empty(0, dtype=self._get_dtype(name))])
+        if 'temperatures' in names:
+            thermocouples = np.unique(arrays['thermocouples'])
+            blocks = [np.empty((0, len(thermocouples)))]
+            for numbers, block in zip(
+                    values['thermocouples'], values['temperatures']):
+                aligned = np.full((len(block), len(thermocouples)), np.nan)
+                aligned[:, np.searchsorted(thermocouples, numbers)] = block
+                blocks.append(aligned)
+            arrays['thermocouples'] = thermocouples
+            arrays['temperatures'] = np.concatenate(blocks)
+        return arrays
+
+    def _read_chunk(self, path, names):
+        # Decompressed payloads of the named columns of a chunk file
+        payloads = {}
+        with open(path, 'rb') as stream:
+            count, = self._count.unpack(stream.read(self._count.size))
+            index = {}
+            for _ in range(count):
+                name, offset, size = self._section.unpack(
+                    stream.read(self._section.size))
+                index[name.rstrip(b'\0').decode()] = (offset, size)
+            for name in names:
+                offset, size = index[name]
+                stream.seek(offset)
+                payloads[name] = zlib.decompress(stream.read(size))
+        return payloads
+
+    def _get_dtype(self, name):
+        if name in ['idx', 'thermocouples']:
+            return np.int64
+        return self._dtypes[name]
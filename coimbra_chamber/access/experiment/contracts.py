@@ -171,3 +171,4 @@ class FitSpec:
     sig_GrR_primary: float
     Ts: float
     sig_Ts: float
+    run_id: int = 0
@@ -0,0 +1,547 @@
+"""
+Schema setup and migrations of the experiment database.
+
+The schema of a database file or server is created and upgraded once, by
+running this module, rather than every time `ExperimentAccess` connects:
+
+    $ python -m coimbra_chamber.access.experiment.migrations
+
+In-memory databases and shards are migrated when they are created.
+
+Each migration defines the tables it creates as they were when it was
+written, so what it does never changes with the models; the models describe
+the schema after the last migration.
+
+"""
+
+import datetime
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    LargeBinary,
+    MetaData,
+    Numeric,
+    String,
+    Table,
+    Text,
+    inspect)
+
+from coimbra_chamber.access.experiment.models import SchemaVersion
+
+
+# Frozen tables --------------------------------------------------------------
+
+
+# Value columns of `Fits`, in order; all are floats except `nu_chi`.
+_FIT_VALUES = [
+    'a', 'sig_a', 'b', 'sig_b', 'r2', 'q', 'chi2', 'nu_chi', 'mddp',
+    'sig_mddp', 'x1s', 'sig_x1s', 'x1e', 'sig_x1e', 'x1', 'sig_x1', 'm1s',
+    'sig_m1s', 'm1e', 'sig_m1e', 'm1', 'sig_m1', 'rhos', 'sig_rhos', 'rhoe',
+    'sig_rhoe', 'rho', 'sig_rho', 'Bm1', 'sig_Bm1', 'T', 'sig_T', 'D12',
+    'sig_D12', 'hfg', 'sig_hfg', 'hu', 'sig_hu', 'hs', 'sig_hs', 'cpv',
+    'sig_cpv', 'he', 'sig_he', 'cpl', 'sig_cpl', 'hT', 'sig_hT', 'qcu',
+    'sig_qcu', 'Ebe', 'sig_Ebe', 'Ebs', 'sig_Ebs', 'qrs', 'sig_qrs', 'kv',
+    'sig_kv', 'alpha', 'sig_alpha', 'Bh', 'sig_Bh', 'M', 'sig_M', 'gamma1',
+    'sig_gamma1', 'gamma2', 'sig_gamma2', 'beta', 'sig_beta', 'Delta_m',
+    'sig_Delta_m', 'Delta_T', 'sig_Delta_T', 'mu', 'sig_mu', 'nu', 'sig_nu',
+    'ShR', 'sig_ShR', 'NuR', 'sig_NuR', 'Le', 'sig_Le', 'GrR_binary',
+    'sig_GrR_binary', 'GrR_primary', 'sig_GrR_primary', 'Ts', 'sig_Ts',
+    ]
+
+
+def _get_version_1(
+        fits_run_id=False, fits_observation_key=True, summary_fits=True):
+    # Tables of schema version 1; `Fits` gains its `run_id` in version 3 and
+    # loses its foreign key to `Observations` in version 8, and
+    # `ExperimentSummaries` loses its fit columns in version 9.
+    metadata = MetaData()
+    Table(
+        'Tubes', metadata,
+        Column('tube_id', Integer, primary_key=True),
+        Column('inner_diameter', Numeric(4, 4), nullable=False),
+        Column('outer_diameter', Numeric(4, 4), nullable=False),
+        Column('height', Numeric(4, 4), nullable=False),
+        Column('material', String(50), nullable=False),
+        Column('mass', Numeric(7, 7), nullable=False))
+    Table(
+        'Settings', metadata,
+        Column('setting_id', Integer, primary_key=True),
+        Column('duty', Numeric(4, 1), nullable=False),
+        Column('pressure', Integer, nullable=False),
+        Column('temperature', Numeric(4, 1), nullable=False),
+        Column('time_step', Numeric(4, 2), nullable=False))
+    Table(
+        'Experiments', metadata,
+        Column('experiment_id', Integer, primary_key=True),
+        Column('author', String(10), nullable=False),
+        Column('datetime', DateTime, nullable=False),
+        Column('description', Text, nullable=False),
+        Column('tube_id', Integer, ForeignKey('Tubes.tube_id')),
+        Column('setting_id', Integer, ForeignKey('Settings.setting_id')),
+        Index('ix_Experiments_datetime', 'datetime', unique=True))
+    Table(
+        'Observations', metadata,
+        Column('cap_man_ok', Boolean, nullable=False),
+        Column('dew_point', Numeric(5, 2), nullable=False),
+        Column('idx', Integer, primary_key=True),
+        Column('mass', Numeric(7, 7), nullable=False),
+        Column('optidew_ok', Boolean, nullable=False),
+        Column('pow_out', Numeric(6, 4)),
+        Column('pow_ref', Numeric(6, 4)),
+        Column('pressure', Integer, nullable=False),
+        Column('surface_temp', Numeric(5, 2)),
+        Column('ic_temp', Numeric(5, 2)),
+        Column(
+            'experiment_id', Integer, ForeignKey('Experiments.experiment_id'),
+            primary_key=True),
+        Index('ix_Observations_experiment_id_idx', 'experiment_id', 'idx'))
+
+    def observation_key():
+        return ForeignKeyConstraint(
+            ['idx', 'experiment_id'],
+            ['Observations.idx', 'Observations.experiment_id'])
+
+    Table(
+        'Temperatures', metadata,
+        Column('thermocouple_num', Integer, primary_key=True),
+        Column('temperature', Numeric(5, 2)),
+        Column('idx', Integer, primary_key=True),
+        Column('experiment_id', Integer, primary_key=True),
+        observation_key(),
+        Index(
+            'ix_Temperatures_experiment_id_idx',
+            'experiment_id', 'idx', 'thermocouple_num'))
+    Table(
+        'PackedTemperatures', metadata,
+        Column('thermocouple_nums', LargeBinary, nullable=False),
+        Column('temperatures', LargeBinary, nullable=False),
+        Column('count', Integer, nullable=False),
+        Column('idx', Integer, primary_key=True),
+        Column('experiment_id', Integer, primary_key=True),
+        observation_key(),
+        Index('ix_PackedTemperatures_experiment_id_idx', 'experiment_id', 'idx'))
+    fit_columns = [
+        Column(name, Integer if name == 'nu_chi' else Float, nullable=False)
+        for name in _FIT_VALUES
+        ]
+    if fits_run_id:
+        fit_columns.append(Column(
+            'run_id', Integer, primary_key=True, autoincrement=False,
+            server_default='0'))
+    Table(
+        'Fits', metadata,
+        *fit_columns[:len(_FIT_VALUES)],
+        Column('idx', Integer, primary_key=True),
+        Column('experiment_id', Integer, primary_key=True),
+        *fit_columns[len(_FIT_VALUES):],
+        *([observation_key()] if fits_observation_key else []),
+        Index('ix_Fits_experiment_id_idx', 'experiment_id', 'idx'))
+    Table(
+        'ExperimentSummaries', metadata,
+        Column('observation_count', Integer, nullable=False),
+        Column('temperature_count', Integer, nullable=False),
+        Column('min_idx', Integer),
+        Column('max_idx', Integer),
+        *[
+            Column(f'{name}_{moment}', Float)
+            for name in ['pressure', 'temperature', 'surface_temp', 'dew_point']
+            for moment in ['mean', 'm2']
+            ],
+        *([
+            Column('fit_count', Integer, nullable=False),
+            Column('fit_sample_count', Integer, nullable=False),
+            Column('mddp_mean', Float),
+            ] if summary_fits else []),
+        Column(
+            'experiment_id', Integer, ForeignKey('Experiments.experiment_id'),
+            primary_key=True))
+    Table(
+        'SchemaVersions', metadata,
+        Column('version', Integer, primary_key=True, autoincrement=False),
+        Column('description', String(100), nullable=False),
+        Column('applied', DateTime, nullable=False))
+    return metadata
+
+
+def _rebuild_sqlite_table(connection, table, names, values=None):
+    # SQLite cannot change keys, so a table is rebuilt as `table` from a
+    # copy: the columns `names` are copied and the columns of `values` are
+    # set to the SQL expressions they map to.
+    values = values or {}
+    connection.execute(f'ALTER TABLE "{table.name}" RENAME TO "{table.name}_old"')
+    for index in table.indexes:
+        connection.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+    table.create(connection)
+    columns = ', '.join(f'"{name}"' for name in list(names) + list(values))
+    selected = ', '.join(
+        [f'"{name}"' for name in names] + list(values.values()))
+    connection.execute(
+        f'INSERT INTO "{table.name}" ({columns}) '
+        f'SELECT {selected} FROM "{table.name}_old"')
+    connection.execute(f'DROP TABLE "{table.name}_old"')
+
+
+def _get_tables(metadata, names, tables):
+    # Tables of `metadata` called `names` that the database holds
+    return [
+        metadata.tables[name] for name in names
+        if tables is None or name in tables
+        ]
+
+
+# Migrations -----------------------------------------------------------------
+
+
+def _create_tables(connection, tables):
+    # Tables that already exist are left alone, so databases created before
+    # schema versions were recorded start at this version.
+    metadata = _get_version_1()
+    metadata.create_all(
+        connection, tables=_get_tables(metadata, metadata.tables, tables))
+
+
+def _create_jobs(connection, tables):
+    # Jobs are only kept in the central database, not in shards.
+    metadata = _get_version_1()
+    Table(
+        'Jobs', metadata,
+        Column('status', String(10), nullable=False),
+        Column('cost', Integer, nullable=False),
+        Column('attempts', Integer, nullable=False),
+        Column('worker', String(100)),
+        Column('lease_id', String(32)),
+        Column('lease_expires', DateTime),
+        Column('queued', DateTime, nullable=False),
+        Column('finished', DateTime),
+        Column('error', Text),
+        Column(
+            'experiment_id', Integer, ForeignKey('Experiments.experiment_id'),
+            primary_key=True),
+        Index('ix_Jobs_status_cost', 'status', 'cost'))
+    metadata.create_all(
+        connection, tables=_get_tables(metadata, ['Jobs'], tables))
+
+
+def _add_analysis_runs(connection, tables):
+    # Runs are only kept in the central database; fits, wherever they are,
+    # gain a run_id in their primary key and existing fits belong to run 0.
+    metadata = _get_version_1(fits_run_id=True)
+    Table(
+        'AnalysisRuns', metadata,
+        Column('run_id', Integer, primary_key=True),
+        Column('param_hash', String(64), nullable=False),
+        Column('parameters', Text, nullable=False),
+        Column('engine_version', String(20), nullable=False),
+        Column('created', DateTime, nullable=False),
+        Column('completed', DateTime),
+        Column(
+            'experiment_id', Integer, ForeignKey('Experiments.experiment_id'),
+            nullable=False),
+        Index(
+            'ix_AnalysisRuns_experiment_id_param_hash',
+            'experiment_id', 'param_hash', unique=True))
+    metadata.create_all(
+        connection, tables=_get_tables(metadata, ['AnalysisRuns'], tables))
+
+    fits = metadata.tables['Fits']
+    if tables is not None and fits.name not in tables:
+        return
+    names = [column['name'] for column in inspect(connection).get_columns(
+        fits.name)]
+    if 'run_id' in names:
+        return
+    if connection.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(connection, fits, names, dict(run_id='0'))
+    else:  # pragma: no cover
+        connection.execute(
+            f'ALTER TABLE `{fits.name}` '
+            'ADD COLUMN run_id INTEGER NOT NULL DEFAULT 0, '
+            'DROP PRIMARY KEY, ADD PRIMARY KEY (idx, experiment_id, run_id)')
+
+
+def _add_experiment_indexes(connection, tables):
+    # Tables created before version 1 was recorded kept their old indexes.
+    metadata = _get_version_1()
+    for table in _get_tables(metadata, metadata.tables, tables):
+        existing = {
+            index['name'] for index in inspect(connection).get_indexes(
+                table.name)
+            }
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+
+
+def _add_database_properties(connection, tables):
+    # Properties are only kept in the central database. A database that
+    # already holds temperatures records the layout they were written in;
+    # otherwise the first connection records the configured one.
+    metadata = MetaData()
+    properties = Table(
+        'DatabaseProperties', metadata,
+        Column('name', String(50), primary_key=True),
+        Column('value', String(100), nullable=False))
+    if tables is not None and properties.name not in tables:
+        return
+    properties.create(connection, checkfirst=True)
+    for table_name, layout in [
+            ('PackedTemperatures', 'packed'), ('Temperatures', 'rows')]:
+        if tables is not None and table_name not in tables:
+            continue
+        quoted = connection.dialect.identifier_preparer.quote(table_name)
+        row = connection.execute(f'SELECT 1 FROM {quoted} LIMIT 1').first()
+        if row is not None:
+            connection.execute(
+                properties.insert(), name='temperature_storage', value=layout)
+            break
+
+
+def _add_merged(connection, tables):
+    # Experiments are only kept in the central database.
+    if tables is not None and 'Experiments' not in tables:
+        return
+    names = [column['name'] for column in inspect(connection).get_columns(
+        'Experiments')]
+    if 'merged' in names:
+        return
+    preparer = connection.dialect.identifier_preparer
+    type_ = DateTime().compile(dialect=connection.dialect)
+    connection.execute(
+        f'ALTER TABLE {preparer.quote("Experiments")} '
+        f'ADD COLUMN merged {type_}')
+
+
+def _create_observation_chunks(connection, tables):
+    # Chunks are listed wherever observations are kept.
+    metadata = _get_version_1()
+    Table(
+        'ObservationChunks', metadata,
+        Column('file_name', String(50), nullable=False),
+        Column('observation_count', Integer, nullable=False),
+        Column('temperature_count', Integer, nullable=False),
+        Column('min_idx', Integer, primary_key=True, autoincrement=False),
+        Column('max_idx', Integer, nullable=False),
+        Column(
+            'experiment_id', Integer, ForeignKey('Experiments.experiment_id'),
+            primary_key=True),
+        Index(
+            'ix_ObservationChunks_experiment_id_min_idx',
+            'experiment_id', 'min_idx'))
+    metadata.create_all(
+        connection, tables=_get_tables(metadata, ['ObservationChunks'], tables))
+
+
+def _drop_fit_observation_key(connection, tables):
+    # The columnar observation store keeps no `Observations` rows, so the
+    # key would reject every fit of its experiments.
+    metadata = _get_version_1(fits_run_id=True, fits_observation_key=False)
+    fits = metadata.tables['Fits']
+    if tables is not None and fits.name not in tables:
+        return
+    inspector = inspect(connection)
+    keys = [
+        key for key in inspector.get_foreign_keys(fits.name)
+        if key['referred_table'] == 'Observations'
+        ]
+    if not keys:
+        return
+    if connection.dialect.name == 'sqlite':
+        names = [column['name'] for column in inspector.get_columns(fits.name)]
+        _rebuild_sqlite_table(connection, fits, names)
+    else:  # pragma: no cover
+        for key in keys:
+            connection.execute(
+                f'ALTER TABLE `{fits.name}` DROP FOREIGN KEY `{key["name"]}`')
+
+
+def _add_fit_summaries(connection, tables):
+    # Fit summaries are kept wherever fits are, one per run, and start from
+    # the stored fits. The fit columns of the experiment summaries, which
+    # mixed every run, are dropped.
+    metadata = _get_version_1(
+        fits_run_id=True, fits_observation_key=False, summary_fits=False)
+    fit_summaries = Table(
+        'FitSummaries', metadata,
+        Column('fit_count', Integer, nullable=False),
+        Column('fit_sample_count', Integer, nullable=False),
+        Column('mddp_mean', Float),
+        Column(
+            'experiment_id', Integer, ForeignKey('Experiments.experiment_id'),
+            primary_key=True),
+        Column('run_id', Integer, primary_key=True, autoincrement=False))
+    if tables is not None and fit_summaries.name not in tables:
+        return
+    inspector = inspect(connection)
+    if not connection.dialect.has_table(connection, fit_summaries.name):
+        fit_summaries.create(connection)
+        preparer = connection.dialect.identifier_preparer
+        # A linear fit spans its degrees of freedom plus two samples.
+        connection.execute(
+            f'INSERT INTO {preparer.quote(fit_summaries.name)} '
+            '(fit_count, fit_sample_count, mddp_mean, experiment_id, run_id) '
+            'SELECT COUNT(*), SUM(nu_chi + 2), AVG(mddp), experiment_id, '
+            f'run_id FROM {preparer.quote("Fits")} '
+            'GROUP BY experiment_id, run_id')
+
+    summaries = metadata.tables['ExperimentSummaries']
+    names = [
+        column['name']
+        for column in inspector.get_columns(summaries.name)
+        ]
+    if 'fit_count' not in names:
+        return
+    if connection.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(
+            connection, summaries,
+            [column.name for column in summaries.columns])
+    else:  # pragma: no cover
+        connection.execute(
+            f'ALTER TABLE `{summaries.name}` DROP COLUMN fit_count, '
+            'DROP COLUMN fit_sample_count, DROP COLUMN mddp_mean')
+
+
+def _add_natural_keys(connection, tables):
+    # Tubes and settings are only kept in the central database. Duplicates
+    # added by concurrent ingests are merged into the first of them before
+    # the unique indexes are created.
+    metadata = MetaData()
+    keys = [
+        ('Tubes', 'tube_id', [
+            'inner_diameter', 'outer_diameter', 'height', 'material', 'mass']),
+        ('Settings', 'setting_id', [
+            'duty', 'pressure', 'temperature', 'time_step']),
+        ]
+    preparer = connection.dialect.identifier_preparer
+    for table_name, id_name, names in keys:
+        if tables is not None and table_name not in tables:
+            continue
+        table = Table(
+            table_name, metadata,
+            Column(id_name, Integer, primary_key=True),
+            *[Column(name, Numeric) for name in names])
+        index_name = f'ix_{table_name}_{"_".join(names)}'
+        existing = {
+            index['name']
+            for index in inspect(connection).get_indexes(table_name)
+            }
+        if index_name in existing:
+            continue
+        key = ', '.join(names)
+        # Each duplicate with the id of the row it is merged into
+        duplicates = connection.execute(
+            f'SELECT duplicate.{id_name}, kept.{id_name} '
+            f'FROM {preparer.quote(table_name)} AS duplicate JOIN ('
+            f'SELECT MIN({id_name}) AS {id_name}, {key} '
+            f'FROM {preparer.quote(table_name)} GROUP BY {key}) AS kept ON '
+            + ' AND '.join(
+                f'duplicate.{name} = kept.{name}' for name in names)
+            + f' WHERE duplicate.{id_name} <> kept.{id_name}').fetchall()
+        for duplicate_id, first_id in duplicates:
+            connection.execute(
+                f'UPDATE {preparer.quote("Experiments")} '
+                f'SET {id_name} = {int(first_id)} '
+                f'WHERE {id_name} = {int(duplicate_id)}')
+            connection.execute(
+                f'DELETE FROM {preparer.quote(table_name)} '
+                f'WHERE {id_name} = {int(duplicate_id)}')
+        Index(
+            index_name, *[table.c[name] for name in names], unique=True
+            ).create(connection)
+
+
+# Migrations in order: the version each brings the schema to, what it does
+# and a function of a connection and the names of the tables the database
+# holds, None for every table.
+MIGRATIONS = [
+    (1, 'Create the tables', _create_tables),
+    (2, 'Create the Jobs table', _create_jobs),
+    (3, 'Key fits by analysis run', _add_analysis_runs),
+    (4, 'Add the experiment-leading indexes', _add_experiment_indexes),
+    (5, 'Record the temperature layout', _add_database_properties),
+    (6, 'Record merged experiments', _add_merged),
+    (7, 'Create the ObservationChunks table', _create_observation_chunks),
+    (8, 'Drop the foreign key of fits to observations',
+     _drop_fit_observation_key),
+    (9, 'Summarize fits by analysis run', _add_fit_summaries),
+    (10, 'Add the natural keys of tubes and settings', _add_natural_keys),
+    ]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(connection):
+    """
+    Get the schema version of a database.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        Connection to the database.
+
+    Returns
+    -------
+    int
+        Largest version applied, zero for an empty database.
+
+    """
+    table = SchemaVersion.__table__
+    if not connection.dialect.has_table(connection, table.name):
+        return 0
+    return connection.execute(
+        table.select().with_only_columns([table.c.version])
+        .order_by(table.c.version.desc()).limit(1)).scalar() or 0
+
+
+def migrate(engine, tables=None):
+    """
+    Bring the schema of a database up to `SCHEMA_VERSION`.
+
+    Migrations newer than the stored version are applied and recorded in
+    one transaction, so running it again is a no-op.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        Engine of the database.
+    tables : list of sqlalchemy.Table, optional
+        Tables the database holds. Defaults to every table.
+
+    Returns
+    -------
+    int
+        Schema version of the database.
+
+    Examples
+    --------
+    >>> migrations.migrate(engine)
+    10
+
+    """
+    names = None
+    if tables is not None:
+        names = {table.name for table in tables} | {SchemaVersion.__tablename__}
+    with engine.begin() as connection:
+        version = get_version(connection)
+        for target, description, apply in MIGRATIONS:
+            if target <= version:
+                continue
+            apply(connection, names)
+            connection.execute(
+                SchemaVersion.__table__.insert(), version=target,
+                description=description, applied=datetime.datetime.utcnow())
+            version = target
+    return version
+
+
+if __name__ == '__main__':
+    from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+    version = ExperimentAccess().setup_schema()
+    print(f'Schema is at version {version}.')
@@ -7,7 +7,9 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     ForeignKeyConstraint,
+    Index,
     Integer,
+    LargeBinary,
     Numeric,
     String,
     Text)
@@ -39,6 +41,14 @@ class Tube(Base):
     # Children relationships
     experiments = relationship('Experiment', back_populates='tube')
 
+    # Tubes are looked up by value, so each is stored once.
+    __table_args__ = (
+        Index(
+            'ix_Tubes_inner_diameter_outer_diameter_height_material_mass',
+            inner_diameter, outer_diameter, height, material, mass,
+            unique=True),
+        )
+
     def __repr__(self):  # noqa: D105
         return (
             f'<Tube(inner_diameter={self.inner_diameter}, '
@@ -64,6 +74,13 @@ class Setting(Base):
     # Children relationships
     experiments = relationship('Experiment', back_populates='setting')
 
+    # Settings are looked up by value, so each is stored once.
+    __table_args__ = (
+        Index(
+            'ix_Settings_duty_pressure_temperature_time_step',
+            duty, pressure, temperature, time_step, unique=True),
+        )
+
     def __repr__(self):  # noqa: D105
         return (
             f'<Setting(duty={self.duty}, '
@@ -88,6 +105,10 @@ class Experiment(Base):
     tube_id = Column(Integer, ForeignKey('Tubes.tube_id'))
     setting_id = Column(Integer, ForeignKey('Settings.setting_id'))
 
+    # When the shard of the experiment was merged into the central database;
+    # its rows are only read from there afterwards.
+    merged = Column(DateTime)
+
     # Parent relationships
     tube = relationship('Tube', back_populates='experiments')
     setting = relationship('Setting', back_populates='experiments')
@@ -95,6 +116,10 @@ class Experiment(Base):
     # Children relationships
     observations = relationship('Observation', back_populates='experiment')
 
+    __table_args__ = (
+        Index('ix_Experiments_datetime', datetime, unique=True),
+        )
+
     def __repr__(self):  # noqa: D105
         return (
             f"<Experiment(author='{self.author}', "
@@ -133,6 +158,10 @@ class Observation(Base):
     # Parent relationship
     experiment = relationship('Experiment', back_populates='observations')
 
+    __table_args__ = (
+        Index('ix_Observations_experiment_id_idx', experiment_id, idx),
+        )
+
     def __repr__(self):  # noqa: D105
         return (
             f'<Observation(cap_man_ok={self.cap_man_ok}, '
@@ -162,6 +191,9 @@ class Temperature(Base):
     __table_args__ = (
         ForeignKeyConstraint(
             [idx, experiment_id], [Observation.idx, Observation.experiment_id]),
+        Index(
+            'ix_Temperatures_experiment_id_idx',
+            experiment_id, idx, thermocouple_num),
         )
 
     def __repr__(self):  # noqa: D105
@@ -172,6 +204,77 @@ class Temperature(Base):
             f'experiment_id={self.experiment_id})>')
 
 
+class PackedTemperature(Base):
+    """
+    Packed temperature object definition.
+
+    Holds every thermocouple reading of an observation in one row: the
+    readings as a little-endian float32 array and the matching thermocouple
+    numbers as a uint8 array.
+    """
+
+    # Metadata
+    __tablename__ = 'PackedTemperatures'
+
+    # Columns
+    thermocouple_nums = Column(LargeBinary, nullable=False)
+    temperatures = Column(LargeBinary, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    # Composite foreign keys
+    idx = Column(Integer, primary_key=True)
+    experiment_id = Column(Integer, primary_key=True)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            [idx, experiment_id], [Observation.idx, Observation.experiment_id]),
+        Index('ix_PackedTemperatures_experiment_id_idx', experiment_id, idx),
+        )
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f'<PackedTemperature(count={self.count}, '
+            f'idx={self.idx}, '
+            f'experiment_id={self.experiment_id})>')
+
+
+class ObservationChunk(Base):
+    """
+    Observation chunk object definition.
+
+    One chunk file of the columnar observation store, with its idx range and
+    counts. Chunks are listed in the transaction that writes them and only
+    listed chunks are read, so the chunks of a rolled back transaction are
+    never seen.
+    """
+
+    # Metadata
+    __tablename__ = 'ObservationChunks'
+
+    # Columns
+    file_name = Column(String(50), nullable=False)
+    observation_count = Column(Integer, nullable=False)
+    temperature_count = Column(Integer, nullable=False)
+    min_idx = Column(Integer, primary_key=True, autoincrement=False)
+    max_idx = Column(Integer, nullable=False)
+
+    # Foreign keys
+    experiment_id = Column(
+        Integer, ForeignKey('Experiments.experiment_id'), primary_key=True)
+
+    __table_args__ = (
+        Index(
+            'ix_ObservationChunks_experiment_id_min_idx', experiment_id,
+            min_idx),
+        )
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f"<ObservationChunk(file_name='{self.file_name}', "
+            f'min_idx={self.min_idx}, max_idx={self.max_idx}, '
+            f'experiment_id={self.experiment_id})>')
+
+
 class Fit(Base):
     """Fit object definition."""
 
@@ -270,13 +373,19 @@ class Fit(Base):
     Ts = Column(Float, nullable=False)
     sig_Ts = Column(Float, nullable=False)
 
-    # Composite foreign keys
+    # Observation of the fit. There is no foreign key to `Observations`,
+    # which the columnar observation store leaves empty.
     idx = Column(Integer, primary_key=True)
     experiment_id = Column(Integer, primary_key=True)
 
+    # Analysis run of the fit; fits added outside of a run belong to run 0.
+    # Runs are kept in the catalog, so there is no foreign key to shards.
+    run_id = Column(
+        Integer, primary_key=True, autoincrement=False, default=0,
+        server_default='0')
+
     __table_args__ = (
-        ForeignKeyConstraint(
-            [idx, experiment_id], [Observation.idx, Observation.experiment_id]),
+        Index('ix_Fits_experiment_id_idx', experiment_id, idx),
         )
 
     def __repr__(self):  # noqa: D105
@@ -290,7 +399,8 @@ class Fit(Base):
             f'chi2={self.chi2}, '
             f'nu={self.nu}, '
             f'experiment_id={self.experiment_id}, '
-            f'idx={self.idx})>')
+            f'idx={self.idx}, '
+            f'run_id={self.run_id})>')
 
     # TODO: Update __repr__ with additional attributes including:
     # nu_chi, mddp, x1s, x1e, x1, m1s, m1e, m1, rhos, rhoe, rho, Bm1, T, D12,
@@ -300,3 +410,189 @@ class Fit(Base):
     # existing nu. The TODO above includes nu so that we make sure we map
     # everything correctly.
     # TODO: also the sigmas as well.
+
+
+class ExperimentSummary(Base):
+    """
+    Experiment summary object definition.
+
+    Aggregates of an experiment's observations, updated whenever rows are
+    added. Means and sums of squared deviations (`*_m2`) are merged chunk by
+    chunk, so the table never has to rescan `Observations`. The fits are
+    summarized per analysis run in `FitSummaries`.
+    """
+
+    # Metadata
+    __tablename__ = 'ExperimentSummaries'
+
+    # Columns
+    observation_count = Column(Integer, nullable=False)
+    temperature_count = Column(Integer, nullable=False)
+    min_idx = Column(Integer)
+    max_idx = Column(Integer)
+    pressure_mean = Column(Float)
+    pressure_m2 = Column(Float)
+    temperature_mean = Column(Float)
+    temperature_m2 = Column(Float)
+    surface_temp_mean = Column(Float)
+    surface_temp_m2 = Column(Float)
+    dew_point_mean = Column(Float)
+    dew_point_m2 = Column(Float)
+
+    # Foreign keys
+    experiment_id = Column(
+        Integer, ForeignKey('Experiments.experiment_id'), primary_key=True)
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f'<ExperimentSummary(observation_count={self.observation_count}, '
+            f'experiment_id={self.experiment_id})>')
+
+
+class FitSummary(Base):
+    """
+    Fit summary object definition.
+
+    Aggregates of the fits of one analysis run of an experiment, updated
+    whenever fits are added. Run 0 holds the fits added outside of a run.
+    """
+
+    # Metadata
+    __tablename__ = 'FitSummaries'
+
+    # Columns
+    fit_count = Column(Integer, nullable=False)
+    fit_sample_count = Column(Integer, nullable=False)
+    mddp_mean = Column(Float)
+
+    # Foreign keys
+    experiment_id = Column(
+        Integer, ForeignKey('Experiments.experiment_id'), primary_key=True)
+
+    # Analysis run of the fits. Runs are kept in the catalog, so there is no
+    # foreign key to shards.
+    run_id = Column(Integer, primary_key=True, autoincrement=False)
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f'<FitSummary(fit_count={self.fit_count}, '
+            f'experiment_id={self.experiment_id}, run_id={self.run_id})>')
+
+
+class SchemaVersion(Base):
+    """
+    Schema version object definition.
+
+    One row per migration applied to the database; the largest version is
+    the version of the schema.
+    """
+
+    # Metadata
+    __tablename__ = 'SchemaVersions'
+
+    # Columns
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(100), nullable=False)
+    applied = Column(DateTime, nullable=False)
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f'<SchemaVersion(version={self.version}, '
+            f"description='{self.description}')>")
+
+
+class DatabaseProperty(Base):
+    """
+    Database property object definition.
+
+    Settings fixed when a database is first used, such as the layout of its
+    temperatures, that every later connection must agree with.
+    """
+
+    # Metadata
+    __tablename__ = 'DatabaseProperties'
+
+    # Columns
+    name = Column(String(50), primary_key=True)
+    value = Column(String(100), nullable=False)
+
+    def __repr__(self):  # noqa: D105
+        return f"<DatabaseProperty(name='{self.name}', value='{self.value}')>"
+
+
+class Job(Base):
+    """
+    Job object definition.
+
+    One analysis of an experiment, claimed by a worker for the length of a
+    lease that it renews while it runs. A job that fails, or whose lease
+    expires, is returned to `pending` until it was claimed the maximum number
+    of times, and is then `failed`.
+    """
+
+    # Metadata
+    __tablename__ = 'Jobs'
+
+    # Columns
+    status = Column(String(10), nullable=False)
+    cost = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    worker = Column(String(100))
+    lease_id = Column(String(32))
+    lease_expires = Column(DateTime)
+    queued = Column(DateTime, nullable=False)
+    finished = Column(DateTime)
+    error = Column(Text)
+
+    # Foreign keys
+    experiment_id = Column(
+        Integer, ForeignKey('Experiments.experiment_id'), primary_key=True)
+
+    # Claims take the cheapest pending job
+    __table_args__ = (
+        Index('ix_Jobs_status_cost', status, cost),
+        )
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f"<Job(experiment_id={self.experiment_id}, status='{self.status}', "
+            f'cost={self.cost}, attempts={self.attempts})>')
+
+
+class AnalysisRun(Base):
+    """
+    Analysis run object definition.
+
+    One analysis of an experiment with a given set of parameters. Runs are
+    identified by a hash of the parameters and the engine version, so an
+    analysis requested again with the same parameters finds the fits of its
+    earlier run.
+    """
+
+    # Metadata
+    __tablename__ = 'AnalysisRuns'
+
+    # Columns
+    run_id = Column(Integer, primary_key=True)
+    param_hash = Column(String(64), nullable=False)
+    parameters = Column(Text, nullable=False)
+    engine_version = Column(String(20), nullable=False)
+    created = Column(DateTime, nullable=False)
+    completed = Column(DateTime)
+
+    # Foreign keys
+    experiment_id = Column(
+        Integer, ForeignKey('Experiments.experiment_id'), nullable=False)
+
+    # One run per experiment and parameter hash
+    __table_args__ = (
+        Index(
+            'ix_AnalysisRuns_experiment_id_param_hash', experiment_id,
+            param_hash, unique=True),
+        )
+
+    def __repr__(self):  # noqa: D105
+        return (
+            f'<AnalysisRun(run_id={self.run_id}, '
+            f'experiment_id={self.experiment_id}, '
+            f"param_hash='{self.param_hash}')>")
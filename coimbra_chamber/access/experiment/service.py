@@ -1,24 +1,47 @@
 """Experiment access service."""
 
 
+from collections import namedtuple
+import dataclasses
+import datetime
 from decimal import Decimal
+import hashlib
+import json
+from pathlib import Path
+import threading
+import uuid
 
 import dacite
 from nptdms import TdmsFile
-from sqlalchemy import and_, create_engine, func
+import numpy as np
+import pandas as pd
+from sqlalchemy import (
+    Float, Numeric, and_, bindparam, case, create_engine, event, func, null,
+    select, type_coerce)
 from sqlalchemy.orm import sessionmaker
 
 from coimbra_chamber.access.experiment.models import (
+    AnalysisRun,
     Base,
+    DatabaseProperty,
     Experiment,
+    ExperimentSummary,
     Fit,
+    FitSummary,
+    Job,
     Observation,
+    ObservationChunk,
+    PackedTemperature,
     Tube,
     Setting,
     Temperature)
+from coimbra_chamber.access.experiment.backends import (
+    ColumnarObservationStore,
+    SQLObservationStore)
 from coimbra_chamber.access.experiment.contracts import (
     DataSpec,
     ExperimentSpec,
+    FitSpec,
     ObservationSpec,
     SettingSpec,
     TemperatureSpec,
@@ -31,10 +54,97 @@ from coimbra_chamber.utility.plot.contracts import (
     Layout,
     Plot)
 import coimbra_chamber.ifx.configuration as config
+import coimbra_chamber.ifx.engines as engines
+import coimbra_chamber.ifx.expressions as expressions
+import coimbra_chamber.ifx.statements as statements
+import coimbra_chamber.access.experiment.migrations as migrations
+
+
+# Binary layout of packed temperatures
+_CHANNEL_DTYPE = np.dtype('u1')
+_TEMPERATURE_DTYPE = np.dtype('<f4')
+
+# Ids of `Tubes` and `Settings` rows by connection string, table and natural
+# key. These tables are small and rarely change, so lookups are cached
+# across instances and the cached table is cleared whenever a row is added.
+_dimension_ids = {}
+_dimension_lock = threading.Lock()
+
+# Ids of experiments merged into the central database, by connection string.
+# Merges are never undone, so only ids not cached yet are looked up.
+_merged_ids = {}
+_merged_lock = threading.Lock()
+
+# Contents of a tdms file, read once per call
+_TdmsData = namedtuple('_TdmsData', ['settings', 'data', 'properties'])
+
+# Tables kept in the shard of each experiment when the database is sharded;
+# the catalog keeps the rest.
+_SHARD_TABLES = [
+    Observation.__table__,
+    Temperature.__table__,
+    PackedTemperature.__table__,
+    ObservationChunk.__table__,
+    Fit.__table__,
+    ExperimentSummary.__table__,
+    FitSummary.__table__,
+    ]
+
+
+def _get_lookup(column, keys):
+    # Select `column` from the first row matching every key
+    table = column.table
+    return select([column]).where(
+        and_(*(table.c[key] == bindparam(key) for key in keys))).limit(1)
+
+
+_TUBE_KEYS = ['inner_diameter', 'outer_diameter', 'height', 'material', 'mass']
+_SETTING_KEYS = ['duty', 'pressure', 'temperature', 'time_step']
+_EXPERIMENT_KEYS = [
+    'author', 'datetime', 'description', 'tube_id', 'setting_id']
+_FIT_KEYS = [
+    'experiment_id' if field.name == 'exp_id' else field.name
+    for field in dataclasses.fields(FitSpec)
+    ]
+
+# Statements of the lookup-or-insert methods, compiled once per dialect and
+# run with bound parameters. Each is paired with the columns its insert sets.
+_STATEMENTS = dict(
+    tube_id=(_get_lookup(Tube.tube_id, _TUBE_KEYS), None),
+    add_tube=(
+        expressions.insert_or_ignore(
+            Tube.__table__, [Tube.__table__.c[key] for key in _TUBE_KEYS]),
+        _TUBE_KEYS),
+    setting_id=(_get_lookup(Setting.setting_id, _SETTING_KEYS), None),
+    add_setting=(
+        expressions.insert_or_ignore(
+            Setting.__table__,
+            [Setting.__table__.c[key] for key in _SETTING_KEYS]),
+        _SETTING_KEYS),
+    experiment_id=(
+        _get_lookup(Experiment.experiment_id, ['datetime']), None),
+    add_experiment=(Experiment.__table__.insert(), _EXPERIMENT_KEYS),
+    fit_exists=(
+        _get_lookup(Fit.idx, ['experiment_id', 'run_id', 'idx']), None),
+    add_fit=(Fit.__table__.insert(), _FIT_KEYS),
+    observation_counts=(
+        select([
+            ExperimentSummary.observation_count,
+            ExperimentSummary.temperature_count,
+            ]).where(
+                ExperimentSummary.experiment_id == bindparam('experiment_id')),
+        None),
+    )
 
 
 class ExperimentAccess(object):
-    """Experiment access."""
+    """
+    Experiment access.
+
+    Instances keep no per-call state: every call opens its own sessions and
+    passes what it reads along, so one instance, and its connection pool,
+    can be shared by the threads of a pool.
+    """
 
     _inner_diameter_prompt = dacite.from_dict(
         Prompt,
@@ -57,11 +167,24 @@ class ExperimentAccess(object):
         dict(messages=["Enter the tube's material: "])
     )
 
+    # Observation columns available as arrays and their dtypes
+    _observation_dtypes = dict(
+        cap_man_ok=np.bool_,
+        dew_point=np.float64,
+        mass=np.float64,
+        optidew_ok=np.bool_,
+        pow_out=np.float64,
+        pow_ref=np.float64,
+        pressure=np.int64,
+        surface_temp=np.float64,
+        ic_temp=np.float64,
+        )
+
     # ------------------------------------------------------------------------
     # Constructors
 
     def __init__(self):
-        """Create the SQLAlchemy engine for the MySQL database."""
+        """Get the shared SQLAlchemy engine for the configured database."""
         # Get database specific connection string.
         database_type = config.get_value('database_type')
         if database_type.lower() == 'mysql':  # pragma: no cover
@@ -69,27 +192,74 @@ class ExperimentAccess(object):
             host = config.get_value('host', 'MySQL-Server')
             user = config.get_value('user', 'MySQL-Server')
             password = config.get_value('password', 'MySQL-Server')
-            conn_string = f'mysql+mysqlconnector://{user}:{password}@{host}/'
+            self._schema = 'chamber'
+            self._server_string = (
+                f'mysql+mysqlconnector://{user}:{password}@{host}/')
+            conn_string = self._server_string + self._schema
+        elif database_type.lower() in ['sqlite', 'sharded']:
+            # Use a durable SQLite database file; when sharded it is the
+            # catalog.
+            path = config.get_value('database_path', 'SQLite')
+            conn_string = f'sqlite:///{path}'
         else:
             # Use in memory database
             conn_string = 'sqlite:///:memory:'
 
-        # Create engine
-        self._engine = create_engine(conn_string, echo=False)
-
-        # Create the schema if it doesn't exist (MySQL only)
-        if database_type.lower() == 'mysql':  # pragma: no cover
-            self._schema = 'chamber'
-            self._engine.execute(
-                f'CREATE DATABASE IF NOT EXISTS `{self._schema}`;')
-            self._engine.execute(f'USE `{self._schema}`;')
-
-        # Create tables if they don't exist
-        Base.metadata.create_all(self._engine)
+        # Engines and their connection pools are shared across instances.
+        # Construction runs no DDL: the schema of a database file or server
+        # is set up once with `setup_schema`, and only in-memory databases
+        # are migrated when their engine is created.
+        self._database_type = database_type.lower()
+        self._conn_string = conn_string
+        on_create = None
+        if conn_string == 'sqlite:///:memory:':
+            on_create = migrations.migrate
+        self._engine = engines.get_engine(conn_string, on_create=on_create)
 
         # Session factory
         self.Session = sessionmaker(bind=self._engine)
 
+        # Keep the observations and fits of each experiment in their own
+        # SQLite file, so ingests of different experiments never contend.
+        self._shard_directory = None
+        if database_type.lower() == 'sharded':
+            self._catalog_path = path
+            self._shard_directory = Path(
+                config.get_value('shard_directory', 'SQLite') or 'shards')
+            self._shard_directory.mkdir(parents=True, exist_ok=True)
+
+        # Rows per executemany batch for bulk inserts
+        self._batch_size = int(config.get_value('batch_size') or 10000)
+
+        # Observations per commit when adding observations; zero adds them
+        # all in one transaction
+        self._commit_size = int(config.get_value('commit_size') or 0)
+
+        # Store thermocouple readings one row per reading (`rows`) or packed
+        # into one row per observation (`packed`)
+        temperature_storage = config.get_value('temperature_storage') or 'rows'
+        self._packed_temperatures = temperature_storage.lower() == 'packed'
+        self._check_temperature_layout()
+
+        # Store observations in the database (`sql`) or in compressed column
+        # files (`columnar`)
+        observation_storage = config.get_value('observation_storage') or 'sql'
+        if observation_storage.lower() == 'columnar':
+            section = 'Columnar'
+            self._observation_store = ColumnarObservationStore(
+                self,
+                config.get_value('observation_store_directory', section)
+                or 'columnar',
+                chunk_size=int(
+                    config.get_value('observation_store_chunk_size', section)
+                    or 65536),
+                compression_level=int(
+                    config.get_value(
+                        'observation_store_compression_level', section)
+                    or 1))
+        else:
+            self._observation_store = SQLObservationStore(self)
+
         # IOUtility
         self._io_util = IOUtility()
 
@@ -110,22 +280,28 @@ class ExperimentAccess(object):
         mvso.access.external.contracts.DataSpec
 
         """
-        self._connect(path)
+        tdms = self._connect(path)
         observations = []
-        for index in self._data.index:
-            observations.append(self._get_observation_specs(index))
+        for index in tdms.data.index:
+            observations.append(self._get_observation_specs(tdms, index))
         data = dict(
-            setting=self._get_setting_specs(),
-            experiment=self._get_experiment_specs(),
+            setting=self._get_setting_specs(tdms),
+            experiment=self._get_experiment_specs(tdms),
             observations=observations,
             )
         return dacite.from_dict(DataSpec, data)
 
-    def add_raw_data(self, data_specs):
+    def add_raw_data(self, data_specs, progress=None, verify=False):
         """
         Add experimental data to the database.
 
         This method does not rewite data that already exists in the databse.
+        The setting, experiment and observations are added in a single
+        transaction, so a failed insert leaves nothing behind. When the
+        `commit_size` setting is positive, observations are instead committed
+        in chunks of that many observations: memory stays flat, a failure only
+        loses the current chunk, and running the ingest again resumes after
+        the last committed observation.
         NOTE: The tube must already exist in the database in order to add the
         experimental data.
 
@@ -133,11 +309,18 @@ class ExperimentAccess(object):
         ----------
         data_specs : list of coimbra_chamber.access.experiment.contracts.DataSpec
             All observations for a given experiment.
+        progress : callable, optional
+            Called as `progress(written, total)` after each chunk of
+            observations is written.
+        verify : bool, default False
+            Count the stored observations and temperatures rather than
+            reading the totals from the experiment summary.
 
         Returns
         -------
         dict of {str: int}
-            Dictionary summarizing the database insert.
+            Dictionary summarizing the database insert, with the number of
+            observations and temperatures stored for the experiment.
 
         See Also
         --------
@@ -163,33 +346,43 @@ class ExperimentAccess(object):
 
         """
         tube_id = data_specs.experiment.tube_id
-        try:
-            # look for the tube using the tube id
-            session = self.Session()
-            tube = session.query(Tube).filter(Tube.tube_id == tube_id).first()
-            session.close()
-            assert tube
-        except AssertionError:
+        if not self._tube_exists(tube_id):
             err_msg = (
                 'You must add your tube to the database: '
                 f'tube_id `{tube_id}` does not exist.')
             print(err_msg)
             # Prompt the user to input the tube data.
             self.add_tube()
-        finally:
-            # The tube is there so we can call the other functions
-            setting_id = self._add_setting(data_specs.setting)
-            experiment_id = self._add_experiment(data_specs.experiment, setting_id)
-            observations_dict = self._add_observations(
-                data_specs.observations, experiment_id)
-            result = dict(
+
+        # The tube is there, so add everything else in a single transaction.
+        session = self.Session()
+        try:
+            setting_id = self._add_setting(data_specs.setting, session)
+            experiment_id = self._add_experiment(
+                data_specs.experiment, setting_id, session)
+            if self._shard_directory:
+                # Observations go to the experiment's shard, so the catalog
+                # is committed on its own.
+                session.commit()
+                session.close()
+                session = self._get_session(experiment_id)
+            self._write_observations(
+                session, data_specs.observations, experiment_id, progress)
+            session.commit()
+            counts = self._get_observation_counts(
+                session, experiment_id, verify)
+            return dict(
                 tube_id=tube_id,
                 setting_id=setting_id,
                 experiment_id=experiment_id,
-                observations=observations_dict['observations'],
-                temperatures=observations_dict['temperatures'])
+                **counts)
+        except:  # pragma: no cover
+            session.rollback()
+            # Ids cached during the transaction may have been rolled back.
+            self._clear_dimension_ids()
+            raise
+        finally:
             session.close()
-            return result
 
     def layout_raw_data(self, data_specs):
         """
@@ -330,147 +523,1004 @@ class ExperimentAccess(object):
         10
 
         """
-        session = self.Session()
+        session = self._get_session(fit_spec.exp_id)
 
         try:
-            # Check if tube exists
-            query = session.query(Fit).filter(
-                and_(
-                    Fit.idx == fit_spec.idx,
-                    Fit.experiment_id == fit_spec.exp_id,
-                    )
-                )
-            fit = query.first()
+            # Check if the fit exists
+            fit = self._execute(
+                session, 'fit_exists', experiment_id=fit_spec.exp_id,
+                run_id=fit_spec.run_id, idx=fit_spec.idx).first()
             # If not, insert it
             if not fit:
-                fit_to_add = Fit(
-                    a=fit_spec.a,
-                    sig_a=fit_spec.sig_a,
-                    b=fit_spec.b,
-                    sig_b=fit_spec.sig_b,
-                    r2=fit_spec.r2,
-                    q=fit_spec.q,
-                    chi2=fit_spec.chi2,
-                    nu_chi=fit_spec.nu_chi,
-                    idx=fit_spec.idx,
-                    experiment_id=fit_spec.exp_id,
-                    mddp=fit_spec.mddp,
-                    sig_mddp=fit_spec.sig_mddp,
-                    x1s=fit_spec.x1s,
-                    sig_x1s=fit_spec.sig_x1s,
-                    x1e=fit_spec.x1e,
-                    sig_x1e=fit_spec.sig_x1e,
-                    x1=fit_spec.x1,
-                    sig_x1=fit_spec.sig_x1,
-                    m1s=fit_spec.m1s,
-                    sig_m1s=fit_spec.sig_m1s,
-                    m1e=fit_spec.m1e,
-                    sig_m1e=fit_spec.sig_m1e,
-                    m1=fit_spec.m1,
-                    sig_m1=fit_spec.sig_m1,
-                    rhos=fit_spec.rhos,
-                    sig_rhos=fit_spec.sig_rhos,
-                    rhoe=fit_spec.rhoe,
-                    sig_rhoe=fit_spec.sig_rhoe,
-                    rho=fit_spec.rho,
-                    sig_rho=fit_spec.sig_rho,
-                    Bm1=fit_spec.Bm1,
-                    sig_Bm1=fit_spec.sig_Bm1,
-                    T=fit_spec.T,
-                    sig_T=fit_spec.sig_T,
-                    D12=fit_spec.D12,
-                    sig_D12=fit_spec.sig_D12,
-                    hfg=fit_spec.hfg,
-                    sig_hfg=fit_spec.sig_hfg,
-                    hu=fit_spec.hu,
-                    sig_hu=fit_spec.sig_hu,
-                    hs=fit_spec.hs,
-                    sig_hs=fit_spec.sig_hs,
-                    cpv=fit_spec.cpv,
-                    sig_cpv=fit_spec.sig_cpv,
-                    he=fit_spec.he,
-                    sig_he=fit_spec.sig_he,
-                    cpl=fit_spec.cpl,
-                    sig_cpl=fit_spec.sig_cpl,
-                    hT=fit_spec.hT,
-                    sig_hT=fit_spec.sig_hT,
-                    qcu=fit_spec.qcu,
-                    sig_qcu=fit_spec.sig_qcu,
-                    Ebe=fit_spec.Ebe,
-                    sig_Ebe=fit_spec.sig_Ebe,
-                    Ebs=fit_spec.Ebs,
-                    sig_Ebs=fit_spec.sig_Ebs,
-                    qrs=fit_spec.qrs,
-                    sig_qrs=fit_spec.sig_qrs,
-                    kv=fit_spec.kv,
-                    sig_kv=fit_spec.sig_kv,
-                    alpha=fit_spec.alpha,
-                    sig_alpha=fit_spec.sig_alpha,
-                    Bh=fit_spec.Bh,
-                    sig_Bh=fit_spec.sig_Bh,
-                    M=fit_spec.M,
-                    sig_M=fit_spec.sig_M,
-                    gamma1=fit_spec.gamma1,
-                    sig_gamma1=fit_spec.sig_gamma1,
-                    gamma2=fit_spec.gamma2,
-                    sig_gamma2=fit_spec.sig_gamma2,
-                    beta=fit_spec.beta,
-                    sig_beta=fit_spec.sig_beta,
-                    Delta_m=fit_spec.Delta_m,
-                    sig_Delta_m=fit_spec.sig_Delta_m,
-                    Delta_T=fit_spec.Delta_T,
-                    sig_Delta_T=fit_spec.sig_Delta_T,
-                    mu=fit_spec.mu,
-                    sig_mu=fit_spec.sig_mu,
-                    nu=fit_spec.nu,
-                    sig_nu=fit_spec.sig_nu,
-                    ShR=fit_spec.ShR,
-                    sig_ShR=fit_spec.sig_ShR,
-                    NuR=fit_spec.NuR,
-                    sig_NuR=fit_spec.sig_NuR,
-                    Le=fit_spec.Le,
-                    sig_Le=fit_spec.sig_Le,
-                    GrR_binary=fit_spec.GrR_binary,
-                    sig_GrR_binary=fit_spec.sig_GrR_binary,
-                    GrR_primary=fit_spec.GrR_primary,
-                    sig_GrR_primary=fit_spec.sig_GrR_primary,
-                    Ts=fit_spec.Ts,
-                    sig_Ts=fit_spec.sig_Ts,
-                )
-                session.add(fit_to_add)
+                self._execute(
+                    session, 'add_fit', **self._get_fit_row(fit_spec))
+                fit_arrays = dict(
+                    mddp=np.array([fit_spec.mddp], dtype=np.float64),
+                    nu_chi=np.array([fit_spec.nu_chi]),
+                    run_id=np.array([fit_spec.run_id]))
+                self._update_fit_summaries(
+                    session, fit_spec.exp_id, fit_arrays)
                 session.commit()
-                return fit_to_add.experiment_id, fit_to_add.idx
+            return fit_spec.exp_id, fit_spec.idx
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def add_fits(self, fit_specs, experiment_id):
+        """
+        Add all fits for an experiment to the database in one transaction.
+
+        This method does not rewite data that already exists in the databse.
+        Existing fits are found with a single query over the idx range of
+        `fit_specs`, and the remaining fits are inserted in bulk with a single
+        commit. If the insert fails, the transaction is rolled back and the
+        error is raised.
+        NOTE: The experiment and observations must already exist in the
+        database in order to add the fits.
+
+        Parameters
+        ----------
+        fit_specs : list of coimbra_chamber.access.experiment.contracts.FitSpec
+            Parameters for each fit.
+        experiment_id : int
+            ExperimentId for all of the fits.
+
+        Returns
+        -------
+        int
+            Number of fits added.
+
+        Examples
+        --------
+        Assuming that you have a list of valid `FitSpec` objects called
+        `fit_specs` for experiment 1, none of which are in the database:
+        >>> access = ExperimentAccess()
+        >>> access.add_fits(fit_specs, 1)
+        21
+
+        """
+        if not fit_specs:
+            return 0
+
+        session = self._get_session(experiment_id)
+
+        try:
+            fits_added = self._insert_fits(session, fit_specs, experiment_id)
+            session.commit()
+            return fits_added
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_observation_arrays(
+            self, experiment_id, idx_range=None, columns=None):
+        """
+        Get the observations of an experiment as NumPy arrays.
+
+        Rows are streamed from the database with `fetchmany` straight into
+        preallocated arrays; no orm objects are created.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId of the observations.
+        idx_range : tuple of (int, int), optional
+            Inclusive range of idx to get. Defaults to every observation.
+        columns : list of str, optional
+            Observation columns to get, plus `temperatures` for the
+            thermocouple readings. Defaults to every column.
+
+        Returns
+        -------
+        dict of {str: numpy.ndarray}
+            One array per requested column, ordered by `idx`, which is always
+            included. Thermocouple readings are returned as `temperatures`, a
+            2-D array with one row per idx and one column per thermocouple
+            number in `thermocouples`; missing readings are NaN.
+
+        Examples
+        --------
+        Assuming experiment 1 has two observations with three thermocouples:
+        >>> access = ExperimentAccess()
+        >>> arrays = access.get_observation_arrays(1, columns=['mass'])
+        >>> arrays['idx']
+        array([0, 1])
+        >>> arrays['mass']
+        array([0.1234567, 0.1222222])
+
+        """
+        if columns is not None:
+            known = set(self._observation_dtypes) | {'idx', 'temperatures'}
+            unknown = [name for name in columns if name not in known]
+            if unknown:
+                raise ValueError(
+                    f'Unknown observation columns: `{", ".join(unknown)}`.')
+        return self._observation_store.get_arrays(
+            experiment_id, idx_range, columns)
+
+    def get_fits(self, columns=None, as_frame=True, **filters):
+        """
+        Get fits, with the settings and tube of their experiments.
+
+        `Fits` is joined to `Experiments`, `Settings` and `Tubes` and every
+        filter is applied in SQL. Only the requested columns are selected and
+        results are built straight from the rows; no orm objects are created.
+
+        Parameters
+        ----------
+        columns : list of str, optional
+            Columns to get from `Fits`, `Experiments`, `Settings` or `Tubes`,
+            searched in that order. Defaults to every column of `Fits`.
+        as_frame : bool, default True
+            Return a DataFrame; otherwise return one array per column.
+        **filters
+            Column name to the value to match. A tuple of (low, high) matches
+            an inclusive range, with None for an open bound, and a list
+            matches any of its values. Without a `run_id` filter only the
+            fits of the latest completed analysis run of each experiment are
+            matched, or those added without a run (`run_id` 0) if it has no
+            completed run. Filter on `run_id` to get the fits of other runs,
+            or a list of them to compare runs.
+
+        Returns
+        -------
+        pandas.DataFrame or dict of {str: numpy.ndarray}
+            Requested columns of every matching fit, ordered by
+            `experiment_id` and `idx`.
+
+        Examples
+        --------
+        Get the mass flux of good fits at one pressure:
+        >>> access = ExperimentAccess()
+        >>> fits = access.get_fits(
+        ...     columns=['experiment_id', 'idx', 'mddp', 'sig_mddp'],
+        ...     pressure=100000, r2=(0.99, None), nu_chi=(100, None))
+
+        Compare the fits of two analysis runs of an experiment:
+        >>> fits = access.get_fits(
+        ...     columns=['run_id', 'idx', 'mddp'], experiment_id=1,
+        ...     run_id=[1, 2])
+
+        """
+        if columns is None:
+            columns = [column.name for column in Fit.__table__.columns]
+
+        # Numeric columns are read as floats rather than Decimals.
+        selected = [
+            self._get_fit_float_column(name).label(name) for name in columns]
+
+        # The sort keys are selected too, to order rows across shards.
+        fit = Fit.__table__
+        selected += [fit.c.experiment_id, fit.c.idx]
+        statement = select(selected).select_from(self._get_fit_join()).where(
+            self._get_fit_conditions(filters)
+            ).order_by(fit.c.experiment_id, fit.c.idx)
+        rows = []
+        for engine in self._get_experiment_engines(filters.get('experiment_id')):
+            with engine.connect() as connection:
+                rows += connection.execute(statement).fetchall()
+        if self._shard_directory:
+            rows.sort(key=lambda row: tuple(row[-2:]))
+
+        arrays = {}
+        for position, name in enumerate(columns):
+            values = np.array([row[position] for row in rows])
+            # SQLite stores unrounded floats; match the column's scale.
+            scale = getattr(self._get_fit_query_column(name).type, 'scale', None)
+            if scale is not None:
+                values = np.round(values.astype(np.float64), scale)
+            arrays[name] = values
+
+        if as_frame:
+            return pd.DataFrame(arrays, columns=columns)
+        return arrays
+
+    def aggregate_fits(self, values=None, by=None, as_frame=True, **filters):
+        """
+        Aggregate fits per setting, tube or any other fit query column.
+
+        Fits are grouped and aggregated with `GROUP BY` in the database, so
+        only one row per group is returned. For each value the result has
+        its mean, extrema and mean uncertainty, along with the
+        inverse-variance weighted mean and its uncertainty. Fits with a zero
+        uncertainty are left out of the weighted mean.
+
+        Parameters
+        ----------
+        values : list of str, optional
+            `Fits` columns to aggregate, each with a `sig_` column. Defaults
+            to `ShR`, `NuR`, `GrR_binary` and `GrR_primary`.
+        by : list of str, optional
+            Columns to group by, as in `get_fits`. Defaults to the setting:
+            `duty`, `pressure` and `temperature`.
+        as_frame : bool, default True
+            Return a DataFrame; otherwise return one array per column.
+        **filters
+            Filters on the fits, as in `get_fits`. Only the fits of the
+            latest completed analysis run of each experiment are aggregated
+            unless `run_id` is given.
+
+        Returns
+        -------
+        pandas.DataFrame or dict of {str: numpy.ndarray}
+            The `by` columns, `count` and, for each value `v`, `v_mean`,
+            `v_min`, `v_max`, `sig_v_mean`, `v_wmean` and `sig_v_wmean`,
+            ordered by the `by` columns.
+
+        Examples
+        --------
+        Correlation table of good fits for each setting:
+        >>> access = ExperimentAccess()
+        >>> table = access.aggregate_fits(r2=(0.99, None))
+
+        Per tube:
+        >>> table = access.aggregate_fits(['ShR'], by=['tube_id'])
+
+        Per analysis run, to compare runs:
+        >>> table = access.aggregate_fits(
+        ...     ['ShR'], by=['run_id'], run_id=[1, 2])
+
+        """
+        if values is None:
+            values = ['ShR', 'NuR', 'GrR_binary', 'GrR_primary']
+        if by is None:
+            by = ['duty', 'pressure', 'temperature']
+
+        # Only sums, extrema and counts are selected, so groups of several
+        # shards can be merged before the means are taken.
+        keys = [self._get_fit_float_column(name) for name in by]
+        scales = [
+            getattr(self._get_fit_query_column(name).type, 'scale', None)
+            for name in by
+            ]
+        selected = [func.count()]
+        for name in values:
+            value = self._get_fit_query_column(name)
+            sigma = self._get_fit_query_column(f'sig_{name}')
+            weight = 1.0 / (sigma * sigma)
+            selected += [
+                func.sum(value), func.min(value), func.max(value),
+                func.sum(sigma), func.sum(value * weight), func.sum(weight),
+                ]
+        statement = select(keys + selected).select_from(
+            self._get_fit_join()).where(
+                self._get_fit_conditions(filters)).group_by(*keys)
+
+        groups = {}
+        for engine in self._get_experiment_engines(filters.get('experiment_id')):
+            with engine.connect() as connection:
+                for row in connection.execute(statement):
+                    # SQLite stores unrounded floats; match the column's scale.
+                    key = tuple(
+                        round(value, scale)
+                        if value is not None and scale is not None else value
+                        for value, scale in zip(row[:len(by)], scales))
+                    groups[key] = self._merge_fit_aggregates(
+                        groups.get(key), row[len(by):])
+
+        arrays = {name: [] for name in by}
+        arrays['count'] = []
+        for name in values:
+            for suffix in ['mean', 'min', 'max']:
+                arrays[f'{name}_{suffix}'] = []
+            arrays[f'sig_{name}_mean'] = []
+            arrays[f'{name}_wmean'] = []
+            arrays[f'sig_{name}_wmean'] = []
+        for key in sorted(groups):
+            count, *sums = groups[key]
+            for name, value in zip(by, key):
+                arrays[name].append(value)
+            arrays['count'].append(count)
+            for position, name in enumerate(values):
+                total, low, high, sigma, weighted, weight = (
+                    sums[6 * position:6 * position + 6])
+                arrays[f'{name}_mean'].append(total / count)
+                arrays[f'{name}_min'].append(low)
+                arrays[f'{name}_max'].append(high)
+                arrays[f'sig_{name}_mean'].append(sigma / count)
+                arrays[f'{name}_wmean'].append(
+                    weighted / weight if weight else None)
+                arrays[f'sig_{name}_wmean'].append(
+                    weight ** -0.5 if weight else None)
+        arrays = {
+            name: np.array(column, dtype=None if name in by else np.float64)
+            for name, column in arrays.items()
+            }
+        arrays['count'] = arrays['count'].astype(np.int64)
+
+        if as_frame:
+            return pd.DataFrame(arrays, columns=list(arrays))
+        return arrays
+
+    def get_experiment_summary(self, experiment_id, run_id=None):
+        """
+        Get the aggregates of an experiment's observations and fits.
+
+        The aggregates are kept up to date as observations and fits are added,
+        so this is a lookup of two rows. The observations of an experiment
+        added before summaries were kept are summarized on the first lookup.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId to summarize.
+        run_id : int, optional
+            Analysis run whose fits to summarize. Defaults to the latest run
+            with fits.
+
+        Returns
+        -------
+        dict or None
+            Observation and temperature counts, the idx range, the mean and
+            standard deviation of `pressure`, `temperature` (mean of the
+            thermocouples), `surface_temp` and `dew_point`, the `run_id` of
+            the fits, the number of fits, their mean `mddp`, and
+            `fit_coverage`, the fraction of observations within a fit. None
+            if nothing was added for the experiment.
+
+        Examples
+        --------
+        >>> access = ExperimentAccess()
+        >>> summary = access.get_experiment_summary(1)
+        >>> summary['observations'], summary['min_idx'], summary['max_idx']
+        (2, 0, 1)
+
+        Fits of an earlier analysis run:
+        >>> access.get_experiment_summary(1, run_id=1)['fits']
+        21
+
+        """
+        session = self._get_session(experiment_id, create=False)
+        try:
+            summary = self._get_summary(session, experiment_id)
+            query = session.query(FitSummary).filter(
+                FitSummary.experiment_id == experiment_id)
+            if run_id is None:
+                query = query.order_by(FitSummary.run_id.desc())
             else:
-                return fit.experiment_id, fit.idx
+                query = query.filter(FitSummary.run_id == run_id)
+            fit_summary = query.first()
+            if summary is None and fit_summary is None:
+                return None
+            if summary is None:
+                summary = ExperimentSummary(
+                    observation_count=0, temperature_count=0)
+            if fit_summary is None:
+                fit_summary = FitSummary(
+                    run_id=run_id, fit_count=0, fit_sample_count=0)
+
+            result = dict(
+                observations=summary.observation_count,
+                temperatures=summary.temperature_count,
+                min_idx=summary.min_idx,
+                max_idx=summary.max_idx,
+                )
+            count = summary.observation_count
+            for name in ['pressure', 'temperature', 'surface_temp', 'dew_point']:
+                m2 = getattr(summary, f'{name}_m2')
+                result[f'{name}_mean'] = getattr(summary, f'{name}_mean')
+                result[f'{name}_std'] = (
+                    (m2 / (count - 1)) ** 0.5 if count > 1 else None)
+            result['run_id'] = fit_summary.run_id
+            result['fits'] = fit_summary.fit_count
+            result['mddp_mean'] = fit_summary.mddp_mean
+            result['fit_coverage'] = (
+                min(fit_summary.fit_sample_count / count, 1.0)
+                if count else 0.0)
+            session.commit()
+            return result
+        finally:
+            session.close()
+
+    def rebuild_experiment_summary(self, experiment_id):
+        """
+        Recompute the summaries of an experiment from its observations and
+        fits.
+
+        Only needed for data added by other means than `ExperimentAccess`;
+        the summary of an experiment added before summaries were kept is
+        built the first time it is looked up or rows are added to it.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId to summarize.
+
+        """
+        session = self._get_session(experiment_id, create=False)
+        try:
+            for model in [ExperimentSummary, FitSummary]:
+                session.query(model).filter(
+                    model.experiment_id == experiment_id).delete()
+            self._update_summary(session, experiment_id)
+            self._update_fit_summaries(
+                session, experiment_id,
+                self._get_stored_fit_arrays(session, experiment_id))
+            session.commit()
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def merge_shards(self, experiment_ids=None, remove=True):
+        """
+        Consolidate experiment shards into the central database.
+
+        Every table of a shard is copied in bulk, with one `INSERT ... SELECT`
+        per table in a single transaction that also marks the experiment as
+        merged. Rows already in the central database are kept. From then on
+        the experiment is only read and written in the central database, so
+        a shard that is kept is never read twice or written again, and
+        experiments that are already merged are skipped.
+
+        Parameters
+        ----------
+        experiment_ids : list of int, optional
+            Experiments to merge. Defaults to every shard.
+        remove : bool, default True
+            Delete each shard once it is merged, along with the shards of
+            experiments merged before.
+
+        Returns
+        -------
+        list of int
+            ExperimentIds that were merged.
+
+        Examples
+        --------
+        >>> access = ExperimentAccess()
+        >>> access.merge_shards()
+        [1, 2, 3]
+
+        """
+        if not self._shard_directory:
+            return []
+        if experiment_ids is None:
+            experiment_ids = self._get_shard_ids()
+        already_merged = self._get_merged_ids(experiment_ids)
+        experiment_table = Experiment.__table__
+        merged = []
+        for experiment_id in experiment_ids:
+            path = self._get_shard_path(experiment_id)
+            if not path.exists():
+                continue
+            if experiment_id in already_merged:
+                if remove:
+                    self._remove_shard(experiment_id)
+                continue
+            # Flush the shard's WAL and close its connections first.
+            engines.dispose_engine(f'sqlite:///{path}')
+            with self._engine.connect() as connection:
+                connection.execute('ATTACH DATABASE ? AS shard', str(path))
+                try:
+                    with connection.begin():
+                        connection.execute(
+                            experiment_table.update().where(
+                                experiment_table.c.experiment_id
+                                == experiment_id).values(
+                                    merged=datetime.datetime.utcnow()))
+                        for table in _SHARD_TABLES:
+                            names = ', '.join(
+                                f'"{column.name}"' for column in table.columns)
+                            keys = ', '.join(
+                                f'"{column.name}"'
+                                for column in table.primary_key.columns)
+                            # The shard's summary covers everything it holds;
+                            # other rows already merged are kept.
+                            conflict = 'DO NOTHING'
+                            if table in (
+                                    ExperimentSummary.__table__,
+                                    FitSummary.__table__):
+                                conflict = 'DO UPDATE SET ' + ', '.join(
+                                    f'"{column.name}" = excluded."{column.name}"'
+                                    for column in table.columns
+                                    if not column.primary_key)
+                            connection.execute(
+                                f'INSERT INTO main."{table.name}" ({names}) '
+                                f'SELECT {names} FROM shard."{table.name}" '
+                                f'WHERE true ON CONFLICT ({keys}) {conflict}')
+                finally:
+                    connection.execute('DETACH DATABASE shard')
+            with _merged_lock:
+                _merged_ids.setdefault(self._conn_string, set()).add(
+                    experiment_id)
+            if remove:
+                self._remove_shard(experiment_id)
+            else:
+                # Close any connections opened while merging.
+                engines.dispose_engine(f'sqlite:///{path}')
+            merged.append(experiment_id)
+        return merged
+
+    def add_jobs(self, experiment_ids=None):
+        """
+        Queue experiments for analysis by workers.
+
+        Experiments that already have a job are skipped. The cost of each job
+        is the number of observations in the experiment summary, so workers
+        claim the smallest experiments first.
+
+        Parameters
+        ----------
+        experiment_ids : list of int, optional
+            Experiments to queue. Defaults to every experiment.
+
+        Returns
+        -------
+        int
+            Number of jobs queued.
+
+        Examples
+        --------
+        >>> access = ExperimentAccess()
+        >>> access.add_jobs()
+        12
+
+        """
+        session = self.Session()
+        try:
+            query = session.query(
+                Experiment.experiment_id, ExperimentSummary.observation_count
+                ).outerjoin(ExperimentSummary).outerjoin(
+                    Job, Job.experiment_id == Experiment.experiment_id
+                ).filter(Job.experiment_id.is_(None))
+            if experiment_ids is not None:
+                query = query.filter(
+                    Experiment.experiment_id.in_(experiment_ids))
+            costs = dict(query.all())
+            # Unmerged experiments keep their summary in their shard, and
+            # experiments added before summaries were kept have none yet.
+            unsummarized = {
+                experiment_id
+                for experiment_id, cost in costs.items() if cost is None
+                }
+            if self._shard_directory:
+                unsummarized |= set(costs) & set(self._get_shard_ids())
+            for experiment_id in sorted(unsummarized):
+                summary = self.get_experiment_summary(experiment_id)
+                costs[experiment_id] = summary['observations'] if summary else 0
+            now = datetime.datetime.utcnow()
+            rows = [
+                dict(
+                    experiment_id=experiment_id, status='pending', cost=cost,
+                    attempts=0, queued=now)
+                for experiment_id, cost in costs.items()
+                ]
+            self._bulk_insert(session, self._get_insert_ignore(Job), rows)
+            session.commit()
+            return len(rows)
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def claim_job(self, worker, lease_seconds=600, max_attempts=3):
+        """
+        Claim the cheapest pending job.
+
+        Running jobs whose lease expired are returned to the queue first, or
+        marked `failed` once they were claimed `max_attempts` times. A job is
+        claimed with a conditional update that only succeeds while it is
+        still pending, so workers sharing the database never claim the same
+        job. Leases are kept in the time of the database server, so the
+        clocks of the workers do not matter.
+
+        Parameters
+        ----------
+        worker : str
+            Name of the worker, for monitoring.
+        lease_seconds : int, default 600
+            Seconds the claim lasts unless renewed with `renew_job`.
+        max_attempts : int, default 3
+            Claims of a job before it is no longer retried.
+
+        Returns
+        -------
+        dict or None
+            `experiment_id`, `lease_id` and `attempts` of the claimed job, or
+            None if no job is pending.
+
+        Examples
+        --------
+        >>> access.claim_job('worker-1')
+        {'experiment_id': 3, 'lease_id': '0f8e...', 'attempts': 1}
+
+        """
+        table = Job.__table__
+        session = self.Session()
+        try:
+            expired = and_(
+                table.c.status == 'running',
+                table.c.lease_expires < expressions.utcnow())
+            session.execute(
+                table.update()
+                .where(and_(expired, table.c.attempts >= max_attempts))
+                .values(status='failed', error='Lease expired.',
+                        finished=expressions.utcnow(), lease_id=None,
+                        lease_expires=None))
+            session.execute(
+                table.update()
+                .where(expired)
+                .values(status='pending', worker=None, lease_id=None,
+                        lease_expires=None))
+            session.commit()
+
+            lease_id = uuid.uuid4().hex
+            while True:
+                job = session.execute(
+                    select([table.c.experiment_id, table.c.attempts])
+                    .where(table.c.status == 'pending')
+                    .order_by(table.c.cost, table.c.experiment_id)
+                    .limit(1)).first()
+                if job is None:
+                    session.commit()
+                    return None
+                # Another worker may claim it first; then try the next one.
+                result = session.execute(
+                    table.update()
+                    .where(and_(
+                        table.c.experiment_id == job.experiment_id,
+                        table.c.status == 'pending'))
+                    .values(
+                        status='running', worker=worker, lease_id=lease_id,
+                        lease_expires=expressions.utcnow(lease_seconds),
+                        attempts=table.c.attempts + 1))
+                session.commit()
+                if result.rowcount == 1:
+                    return dict(
+                        experiment_id=job.experiment_id, lease_id=lease_id,
+                        attempts=job.attempts + 1)
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def renew_job(self, experiment_id, lease_id, lease_seconds=600):
+        """
+        Extend the lease of a claimed job; the heartbeat of a worker.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId of the job.
+        lease_id : str
+            Lease returned by `claim_job`.
+        lease_seconds : int, default 600
+            Seconds from now the lease lasts.
+
+        Returns
+        -------
+        bool
+            False if the lease expired.
+
+        """
+        return self._update_job(
+            experiment_id, lease_id,
+            lease_expires=expressions.utcnow(lease_seconds))
+
+    def check_job(self, experiment_id, lease_id):
+        """
+        Check that a lease is still held.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId of the job.
+        lease_id : str
+            Lease returned by `claim_job`.
+
+        Returns
+        -------
+        bool
+            False if the lease expired.
+
+        """
+        table = Job.__table__
+        session = self.Session()
+        try:
+            return session.execute(
+                select([table.c.experiment_id]).where(
+                    self._get_lease_clause(experiment_id, lease_id))
+                ).first() is not None
+        finally:
+            session.close()
+
+    def finish_job(self, experiment_id, lease_id, error=None, max_attempts=3):
+        """
+        Mark a claimed job as `done`, or as failed with an error.
+
+        A failed job is returned to the queue until it was claimed
+        `max_attempts` times, and is then marked `failed`.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId of the job.
+        lease_id : str
+            Lease returned by `claim_job`.
+        error : str, optional
+            Why the analysis failed.
+        max_attempts : int, default 3
+            Claims of a job before it is no longer retried.
+
+        Returns
+        -------
+        bool
+            False if the lease expired.
+
+        """
+        if error is None:
+            return self._update_job(
+                experiment_id, lease_id, status='done',
+                finished=expressions.utcnow(), lease_expires=None)
+        retry = Job.__table__.c.attempts < max_attempts
+        return self._update_job(
+            experiment_id, lease_id,
+            status=case([(retry, 'pending')], else_='failed'),
+            finished=case([(retry, null())], else_=expressions.utcnow()),
+            error=error, lease_expires=None)
+
+    def requeue_jobs(self, experiment_ids=None):
+        """
+        Return failed jobs to the queue with their attempts reset.
+
+        Parameters
+        ----------
+        experiment_ids : list of int, optional
+            Experiments whose jobs to requeue. Defaults to every failed job.
+
+        Returns
+        -------
+        int
+            Number of jobs requeued.
+
+        Examples
+        --------
+        >>> access.get_job_counts()
+        {'done': 10, 'failed': 2}
+        >>> access.requeue_jobs()
+        2
+
+        """
+        table = Job.__table__
+        where = table.c.status == 'failed'
+        if experiment_ids is not None:
+            where = and_(where, table.c.experiment_id.in_(experiment_ids))
+        session = self.Session()
+        try:
+            result = session.execute(
+                table.update().where(where).values(
+                    status='pending', attempts=0, worker=None, lease_id=None,
+                    lease_expires=None, finished=None, error=None))
+            session.commit()
+            return result.rowcount
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_job_counts(self):
+        """
+        Get the number of jobs by status.
+
+        Returns
+        -------
+        dict of {str: int}
+
+        Examples
+        --------
+        >>> access.get_job_counts()
+        {'done': 10, 'pending': 1, 'running': 1}
+
+        """
+        session = self.Session()
+        try:
+            query = session.query(Job.status, func.count(Job.experiment_id))
+            return dict(query.group_by(Job.status).all())
+        finally:
+            session.close()
+
+    def add_analysis_run(self, experiment_id, parameters, engine_version):
+        """
+        Get the analysis run of an experiment, adding it if it is new.
+
+        Runs are identified by a SHA-256 hash of the parameters and the
+        engine version, so the same analysis requested again finds its
+        earlier run, and analyses with other parameters get runs of their
+        own. Fits of every run count towards the experiment summary.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId of the analysis.
+        parameters : dict
+            Parameters of the analysis; values must be JSON serializable or
+            have a stable `str`.
+        engine_version : str
+            Version of the analysis engine.
+
+        Returns
+        -------
+        dict
+            `run_id`, `param_hash` and `completed`, the time the run finished
+            or None if its fits are not all stored yet.
+
+        Examples
+        --------
+        >>> access = ExperimentAccess()
+        >>> access.add_analysis_run(1, dict(error=0.01, steps=1), '0.0.8')
+        {'run_id': 1, 'param_hash': '3c9d...', 'completed': None}
+
+        """
+        parameters = json.dumps(parameters, sort_keys=True, default=str)
+        param_hash = hashlib.sha256(
+            f'{engine_version}\n{parameters}'.encode()).hexdigest()
+        table = AnalysisRun.__table__
+        session = self.Session()
+        try:
+            # A run added by another process in the meantime is kept.
+            session.execute(
+                self._get_insert_ignore(
+                    AnalysisRun, [table.c.experiment_id, table.c.param_hash]),
+                dict(
+                    experiment_id=experiment_id, param_hash=param_hash,
+                    parameters=parameters, engine_version=engine_version,
+                    created=datetime.datetime.utcnow()))
+            run = session.execute(
+                select([table.c.run_id, table.c.completed]).where(and_(
+                    table.c.experiment_id == experiment_id,
+                    table.c.param_hash == param_hash))).first()
+            session.commit()
+            return dict(
+                run_id=run.run_id, param_hash=param_hash,
+                completed=run.completed)
         except:  # pragma: no cover
             session.rollback()
+            raise
         finally:
             session.close()
 
+    def complete_analysis_run(self, run_id):
+        """
+        Mark an analysis run as complete once all of its fits are stored.
+
+        Parameters
+        ----------
+        run_id : int
+            Id of the run.
+
+        Returns
+        -------
+        bool
+            True if the run exists.
+
+        """
+        table = AnalysisRun.__table__
+        session = self.Session()
+        try:
+            result = session.execute(
+                table.update().where(table.c.run_id == run_id).values(
+                    completed=datetime.datetime.utcnow()))
+            session.commit()
+            return result.rowcount == 1
+        except:  # pragma: no cover
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_analysis_runs(self, experiment_id):
+        """
+        Get the analysis runs of an experiment.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId of the runs.
+
+        Returns
+        -------
+        list of dict
+            `run_id`, `param_hash`, `parameters`, `engine_version`, `created`
+            and `completed` of each run, oldest first.
+
+        Examples
+        --------
+        Compare the fits of two choices of parameters:
+        >>> runs = access.get_analysis_runs(1)
+        >>> [run['parameters']['error'] for run in runs]
+        [0.01, 0.05]
+        >>> fits = access.get_fits(run_id=[run['run_id'] for run in runs])
+
+        """
+        table = AnalysisRun.__table__
+        session = self.Session()
+        try:
+            rows = session.execute(
+                select([
+                    table.c.run_id, table.c.param_hash, table.c.parameters,
+                    table.c.engine_version, table.c.created, table.c.completed,
+                    ]).where(table.c.experiment_id == experiment_id)
+                .order_by(table.c.run_id)).fetchall()
+        finally:
+            session.close()
+        runs = [dict(row) for row in rows]
+        for run in runs:
+            run['parameters'] = json.loads(run['parameters'])
+        return runs
+
+    def setup_schema(self):
+        """
+        Create or upgrade the schema of the database.
+
+        Run once per database, and again after upgrading coimbra_chamber;
+        constructing `ExperimentAccess` does not create tables. The schema
+        (MySQL only), missing tables and pending migrations are created and
+        applied, along with pending migrations of any shards, and the
+        configured temperature layout is recorded if the database has none.
+        Running it on an up to date database does nothing.
+
+        Returns
+        -------
+        int
+            Schema version of the database.
+
+        Examples
+        --------
+        >>> access = ExperimentAccess()
+        >>> access.setup_schema()
+        10
+
+        """
+        if self._database_type == 'mysql':  # pragma: no cover
+            server_engine = create_engine(self._server_string, echo=False)
+            server_engine.execute(
+                f'CREATE DATABASE IF NOT EXISTS `{self._schema}`;')
+            server_engine.dispose()
+        version = migrations.migrate(self._engine)
+        if self._shard_directory:
+            for experiment_id in self._get_shard_ids():
+                migrations.migrate(
+                    self._get_engine(experiment_id), _SHARD_TABLES)
+        self._record_temperature_layout()
+        self._check_temperature_layout()
+        return version
+
     def add_tube(self):
         """Add a tube to the database."""
-        self._get_tube_spec()
-        self._add_tube(self._tube_spec)
+        self._add_tube(self._get_tube_spec())
 
     # ------------------------------------------------------------------------
     # Internal methods: not included in the API
 
-    def _connect(self, path):
+    @staticmethod
+    def _connect(path):
         try:
-            self._tdms_file = TdmsFile(path)
-            self._settings = self._tdms_file.object('Settings').as_dataframe()
-            self._data = self._tdms_file.object('Data').as_dataframe()
-            self._properties = self._tdms_file.object().properties
+            tdms_file = TdmsFile(path)
         except FileNotFoundError as err:
             print(f'File not found: `{err}`')
-
-    def _get_temperature_specs(self, index):
+            raise
+        return _TdmsData(
+            settings=tdms_file.object('Settings').as_dataframe(),
+            data=tdms_file.object('Data').as_dataframe(),
+            properties=tdms_file.object().properties)
+
+    @staticmethod
+    def _get_temperature_specs(tdms, index):
         temperature_specs = []
         # thermocouple_readings is a pd.Series indexed by strings like 'TC0'.
-        thermocouple_readings = self._data.loc[
-            index, self._data.columns.str.contains('TC')]
+        thermocouple_readings = tdms.data.loc[
+            index, tdms.data.columns.str.contains('TC')]
         # Get the idx for all of the temperature readings.
-        idx = int(self._data.loc[index, 'Idx'])
+        idx = int(tdms.data.loc[index, 'Idx'])
         for tc_str, value in thermocouple_readings.items():
             temperature = Decimal(str(round(value, 2)))
             # Thermocouples that are not connected will read above 2500 K.
@@ -486,8 +1536,9 @@ class ExperimentAccess(object):
 
         return temperature_specs
 
-    def _get_observation_specs(self, index):
-        data = self._data
+    @classmethod
+    def _get_observation_specs(cls, tdms, index):
+        data = tdms.data
         observation_data = dict(
             cap_man_ok=True if data.loc[index, 'CapManOk'] else False,
             dew_point=Decimal(str(round(data.loc[index, 'DewPoint'], 2))),
@@ -499,170 +1550,907 @@ class ExperimentAccess(object):
             pressure=int(data.loc[index, 'Pressure']),
             surface_temp=Decimal(str(round(data.loc[index, 'SurfaceTemp'], 2))),
             ic_temp=Decimal(str(round(data.loc[index, 'IC Temp'], 2))),
-            temperatures=self._get_temperature_specs(index))
+            temperatures=cls._get_temperature_specs(tdms, index))
 
         return dacite.from_dict(ObservationSpec, observation_data)
 
-    def _get_experiment_specs(self):
+    @staticmethod
+    def _get_experiment_specs(tdms):
         data = dict(
-            author=self._properties['author'],
-            datetime=self._properties['DateTime'],
-            description=self._properties['description'],
-            tube_id=int(self._settings['TubeID']))
+            author=tdms.properties['author'],
+            datetime=tdms.properties['DateTime'],
+            description=tdms.properties['description'],
+            tube_id=int(tdms.settings['TubeID']))
         return dacite.from_dict(ExperimentSpec, data)
 
-    def _get_setting_specs(self):
+    @staticmethod
+    def _get_setting_specs(tdms):
         data = dict(
-            duty=Decimal(self._settings.DutyCycle[0]),
-            pressure=int(5e3*round(self._data.Pressure.mean()/5e3)),
-            temperature=Decimal(str(5*round(self._data.TC10.mean()/5))),
-            time_step=Decimal(str(self._settings.TimeStep[0])),
+            duty=Decimal(tdms.settings.DutyCycle[0]),
+            pressure=int(5e3*round(tdms.data.Pressure.mean()/5e3)),
+            temperature=Decimal(str(5*round(tdms.data.TC10.mean()/5))),
+            time_step=Decimal(str(tdms.settings.TimeStep[0])),
             )
         return dacite.from_dict(SettingSpec, data)
 
-    def _add_tube(self, tube_spec):
-        session = self.Session()        
+    def _add_tube(self, tube_spec, session=None):
+        if session is None:
+            return self._commit(self._add_tube, tube_spec)
+
+        # Check if tube exists
+        key = self._get_tube_key(tube_spec)
+        tube_id = self._get_dimension_id('Tubes', key)
+        if tube_id:
+            return tube_id
+        params = dict(zip(_TUBE_KEYS, key))
+        tube_id = self._execute(session, 'tube_id', **params).scalar()
+        if tube_id:
+            self._set_dimension_id('Tubes', key, tube_id)
+            return tube_id
+        # If not, insert it; a tube added by another thread in the meantime
+        # is kept.
+        self._execute(session, 'add_tube', **params)
+        self._clear_dimension_ids('Tubes')
+        return self._execute(session, 'tube_id', **params).scalar()
+
+    def _add_setting(self, setting_spec, session=None):
+        if session is None:
+            return self._commit(self._add_setting, setting_spec)
+
+        # Check if the setting exists
+        key = self._get_setting_key(setting_spec)
+        setting_id = self._get_dimension_id('Settings', key)
+        if setting_id:
+            return setting_id
+        params = dict(zip(_SETTING_KEYS, key))
+        setting_id = self._execute(session, 'setting_id', **params).scalar()
+        if setting_id:
+            self._set_dimension_id('Settings', key, setting_id)
+            return setting_id
+        # If not, insert it; a setting added by another thread in the
+        # meantime is kept.
+        self._execute(session, 'add_setting', **params)
+        self._clear_dimension_ids('Settings')
+        return self._execute(session, 'setting_id', **params).scalar()
+
+    def _add_experiment(self, experiment_spec, setting_id, session=None):
+        if session is None:
+            return self._commit(
+                self._add_experiment, experiment_spec, setting_id)
+
+        # Check if the experiment exists
+        experiment_id = self._execute(
+            session, 'experiment_id',
+            datetime=experiment_spec.datetime).scalar()
+        if experiment_id:
+            return experiment_id
+        # If not, insert it
+        result = self._execute(
+            session, 'add_experiment',
+            author=experiment_spec.author,
+            datetime=experiment_spec.datetime,
+            description=experiment_spec.description,
+            tube_id=experiment_spec.tube_id,
+            setting_id=setting_id)
+        return result.inserted_primary_key[0]
+
+    @staticmethod
+    def _execute(session, name, **params):
+        # Run one of `_STATEMENTS` in the transaction of `session`, compiled
+        # for its dialect on first use.
+        statement, column_keys = _STATEMENTS[name]
+        connection = session.connection()
+        compiled = statements.get_compiled(
+            name, statement, connection.dialect, column_keys)
+        return connection.execute(compiled, params)
+
+    @staticmethod
+    def _get_lease_clause(experiment_id, lease_id):
+        # Whether the lease of a job is held and has not expired
+        table = Job.__table__
+        return and_(
+            table.c.experiment_id == experiment_id,
+            table.c.lease_id == lease_id,
+            table.c.status == 'running',
+            table.c.lease_expires >= expressions.utcnow())
+
+    def _update_job(self, experiment_id, lease_id, **values):
+        # Update a job only while the lease is held
+        table = Job.__table__
+        session = self.Session()
         try:
-            # Check if tube exists
-            query = session.query(Tube.tube_id).filter(
-                and_(
-                    Tube.inner_diameter == tube_spec.inner_diameter,
-                    Tube.outer_diameter == tube_spec.outer_diameter,
-                    Tube.height == tube_spec.height,
-                    Tube.material == tube_spec.material,
-                    Tube.mass == tube_spec.mass
-                    )
-                )
-            tube_id = query.first()
-            # If not, insert it
-            if not tube_id:
-                tube_to_add = Tube(
-                    inner_diameter=tube_spec.inner_diameter,
-                    outer_diameter=tube_spec.outer_diameter,
-                    height=tube_spec.height,
-                    material=tube_spec.material,
-                    mass=tube_spec.mass)
-                session.add(tube_to_add)
-                session.commit()
-                return tube_to_add.tube_id
-            else:
-                return tube_id[0]
+            result = session.execute(
+                table.update()
+                .where(self._get_lease_clause(experiment_id, lease_id))
+                .values(**values))
+            session.commit()
+            return result.rowcount == 1
         except:  # pragma: no cover
             session.rollback()
+            raise
         finally:
             session.close()
 
-    def _add_setting(self, setting_spec):
+    def _commit(self, method, *args):
+        # Run `method` in its own session and commit.
         session = self.Session()
-
         try:
-            # Check if the setting exists
-            query = session.query(Setting.setting_id).filter(
-                and_(
-                    Setting.duty == setting_spec.duty,
-                    Setting.pressure == setting_spec.pressure,
-                    Setting.temperature == setting_spec.temperature,
-                    Setting.time_step == setting_spec.time_step
-                    )
-                )
-            setting_id = query.first()
-            # If not, insert it
-            if not setting_id:
-                setting_to_add = Setting(
-                    duty=setting_spec.duty,
-                    pressure=setting_spec.pressure,
-                    temperature=setting_spec.temperature,
-                    time_step=setting_spec.time_step)
-                session.add(setting_to_add)
-                session.commit()
-                return setting_to_add.setting_id
-            else:
-                return setting_id[0]
+            result = method(*args, session=session)
+            session.commit()
+            return result
         except:  # pragma: no cover
             session.rollback()
+            self._clear_dimension_ids()
+            raise
         finally:
             session.close()
 
-    def _add_experiment(self, experiment_spec, setting_id):
+    def _check_temperature_layout(self):
+        # The layout is recorded by `setup_schema` and every later connection
+        # must use it, since the readers only look for temperatures in the
+        # configured layout. It is read once per database and cached with
+        # the engine.
+        layout = 'packed' if self._packed_temperatures else 'rows'
+        recorded = engines.get_property(
+            self._conn_string, 'temperature_storage',
+            self._get_temperature_layout)
+        if recorded is not None and recorded != layout:
+            err_msg = (
+                f'The database stores temperatures as `{recorded}`, but '
+                f'`temperature_storage` is `{layout}`.')
+            raise ValueError(err_msg)
+
+    def _get_temperature_layout(self):
+        table = DatabaseProperty.__table__
+        query = select([table.c.value]).where(
+            table.c.name == 'temperature_storage')
+        with self._engine.connect() as connection:
+            if not connection.dialect.has_table(connection, table.name):
+                # The schema is not set up yet.
+                return None
+            return connection.execute(query).scalar()
+
+    def _record_temperature_layout(self):
+        # Record the configured layout if the database has none yet.
+        layout = 'packed' if self._packed_temperatures else 'rows'
+        table = DatabaseProperty.__table__
+        query = select([table.c.value]).where(
+            table.c.name == 'temperature_storage')
+        with self._engine.begin() as connection:
+            connection.execute(
+                expressions.insert_or_ignore(table),
+                name='temperature_storage', value=layout)
+            recorded = connection.execute(query).scalar()
+        engines.set_property(
+            self._conn_string, 'temperature_storage', recorded)
+
+    def _tube_exists(self, tube_id):
+        with _dimension_lock:
+            tube_ids = _dimension_ids.get(self._conn_string, {}).get('Tubes', {})
+            if tube_id in tube_ids.values():
+                return True
         session = self.Session()
-
         try:
-            # Check if the experiment exists
-            query = session.query(Experiment.experiment_id)
-            query = query.filter(Experiment.datetime == experiment_spec.datetime)
-            experiment_id = query.first()
-            # If not, insert it
-            if not experiment_id:
-                experiment_to_add = Experiment(
-                    author=experiment_spec.author,
-                    datetime=experiment_spec.datetime,
-                    description=experiment_spec.description,
-                    tube_id=experiment_spec.tube_id,
-                    setting_id=setting_id)
-                session.add(experiment_to_add)
-                session.commit()
-                return experiment_to_add.experiment_id
-            else:
-                return experiment_id[0]
-        except:  # pragma: no cover
-            session.rollback()
+            tube = session.query(Tube).filter(Tube.tube_id == tube_id).first()
+            if tube:
+                self._set_dimension_id(
+                    'Tubes', self._get_tube_key(tube), tube.tube_id)
+            return bool(tube)
         finally:
             session.close()
 
-    def _add_observations(self, observations, experiment_id):
-        session = self.Session()
+    def _get_dimension_id(self, table, key):
+        with _dimension_lock:
+            return _dimension_ids.get(self._conn_string, {}).get(
+                table, {}).get(key)
+
+    def _set_dimension_id(self, table, key, id_):
+        with _dimension_lock:
+            tables = _dimension_ids.setdefault(self._conn_string, {})
+            tables.setdefault(table, {})[key] = id_
+
+    def _clear_dimension_ids(self, table=None):
+        with _dimension_lock:
+            if table:
+                _dimension_ids.get(self._conn_string, {}).pop(table, None)
+            else:
+                _dimension_ids.pop(self._conn_string, None)
+
+    @staticmethod
+    def _get_tube_key(tube):
+        return (
+            tube.inner_diameter, tube.outer_diameter, tube.height,
+            tube.material, tube.mass)
+
+    @staticmethod
+    def _get_setting_key(setting):
+        return (
+            setting.duty, setting.pressure, setting.temperature,
+            setting.time_step)
+
+    def _get_engine(self, experiment_id, create=True):
+        # Engine holding the observations and fits of an experiment. Merged
+        # experiments are only read and written in the central database, and
+        # reads of an experiment without a shard fall back to it.
+        if not self._shard_directory or self._get_merged_ids([experiment_id]):
+            return self._engine
+        path = self._get_shard_path(experiment_id)
+        if not create and not path.exists():
+            return self._engine
+        return engines.get_engine(
+            f'sqlite:///{path}', on_create=self._create_shard)
+
+    def _get_session(self, experiment_id, create=True):
+        return self.Session(bind=self._get_engine(experiment_id, create))
+
+    def _get_experiment_engines(self, experiment_id=None):
+        # The central database and the shard of every unmerged experiment,
+        # so each experiment is read from exactly one of them
+        if not self._shard_directory:
+            return [self._engine]
+        experiment_ids = self._get_shard_ids()
+        if isinstance(experiment_id, int):
+            experiment_ids = [experiment_id]
+        elif isinstance(experiment_id, list):
+            experiment_ids = experiment_id
+        merged = self._get_merged_ids(experiment_ids)
+        return [self._engine] + [
+            self._get_engine(id_) for id_ in experiment_ids
+            if id_ not in merged and self._get_shard_path(id_).exists()
+            ]
+
+    def _get_merged_ids(self, experiment_ids):
+        # Ids among `experiment_ids` of experiments merged into the central
+        # database
+        with _merged_lock:
+            merged = set(_merged_ids.get(self._conn_string, ()))
+        unknown = [id_ for id_ in experiment_ids if id_ not in merged]
+        if unknown:
+            table = Experiment.__table__
+            statement = select([table.c.experiment_id]).where(and_(
+                table.c.merged.isnot(None),
+                table.c.experiment_id.in_(unknown)))
+            with self._engine.connect() as connection:
+                found = {id_ for id_, in connection.execute(statement)}
+            if found:
+                with _merged_lock:
+                    _merged_ids.setdefault(
+                        self._conn_string, set()).update(found)
+                merged |= found
+        return merged & set(experiment_ids)
+
+    def _get_shard_path(self, experiment_id):
+        return self._shard_directory / f'experiment_{experiment_id}.db'
+
+    def _get_shard_ids(self):
+        return sorted(
+            int(path.stem.split('_')[-1])
+            for path in self._shard_directory.glob('experiment_*.db'))
+
+    def _create_shard(self, engine):
+        # The catalog is attached to every shard connection, so queries can
+        # join to its tables.
+        catalog_path = self._catalog_path
+
+        def attach_catalog(dbapi_connection, connection_record):
+            dbapi_connection.execute(
+                'ATTACH DATABASE ? AS catalog', (catalog_path,))
+
+        event.listen(engine, 'connect', attach_catalog)
+        migrations.migrate(engine, _SHARD_TABLES)
+
+    def _remove_shard(self, experiment_id):
+        path = self._get_shard_path(experiment_id)
+        engines.dispose_engine(f'sqlite:///{path}')
+        for suffix in ['', '-wal', '-shm']:
+            file_path = Path(f'{path}{suffix}')
+            if file_path.exists():
+                file_path.unlink()
+
+    def _add_observations(
+            self, observations, experiment_id, progress=None, verify=False):
+        session = self._get_session(experiment_id)
 
         try:
-            # Check if the experiment exists
-            query = session.query(Observation.experiment_id)
-            query = query.filter(Observation.experiment_id == experiment_id)
-            returned_experiment_id = query.first()
-            # If not, insert it
-            if not returned_experiment_id:
-                objects = []
-                for observation in observations:
-                    # Construct the observation orm object
-                    this_observation = Observation(
-                        cap_man_ok=observation.cap_man_ok,
-                        dew_point=observation.dew_point,
-                        idx=observation.idx,
-                        mass=observation.mass,
-                        optidew_ok=observation.optidew_ok,
-                        pow_out=observation.pow_out,
-                        pow_ref=observation.pow_ref,
-                        pressure=observation.pressure,
-                        experiment_id=experiment_id,
-                        surface_temp=observation.surface_temp,
-                        ic_temp=observation.ic_temp)
-                    # Append
-                    objects.append(this_observation)
-                    for temperature in observation.temperatures:
-                        # Construct the temperature orm object
-                        this_temperature = Temperature(
-                            thermocouple_num=temperature.thermocouple_num,
-                            temperature=temperature.temperature,
-                            idx=temperature.idx,
-                            experiment_id=experiment_id)
-                        # Append
-                        objects.append(this_temperature)
-                # Perform a bulk insert
-                session.bulk_save_objects(objects)
-                session.commit()
+            self._write_observations(
+                session, observations, experiment_id, progress)
+            session.commit()
+            return self._get_observation_counts(session, experiment_id, verify)
         except:  # pragma: no cover
             session.rollback()
+            raise
         finally:
-            # Observation counts for the experiment
-            query = session.query(func.count(Observation.experiment_id))
-            query = query.filter(Observation.experiment_id == experiment_id)
-            obs_count = query.one()[0]
-            # Temperature counts for the experiment
+            session.close()
+
+    @staticmethod
+    def _get_fit_join():
+        # Fits with the experiment, setting and tube they belong to
+        fit, experiment = Fit.__table__, Experiment.__table__
+        setting, tube = Setting.__table__, Tube.__table__
+        return fit.join(
+            experiment, fit.c.experiment_id == experiment.c.experiment_id
+            ).join(
+            setting, experiment.c.setting_id == setting.c.setting_id
+            ).join(
+            tube, experiment.c.tube_id == tube.c.tube_id)
+
+    def _get_fit_conditions(self, filters):
+        conditions = []
+        for name, value in filters.items():
+            column = self._get_fit_query_column(name)
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    conditions.append(column >= low)
+                if high is not None:
+                    conditions.append(column <= high)
+            elif isinstance(value, list):
+                conditions.append(column.in_(value))
+            else:
+                conditions.append(column == value)
+        if 'run_id' not in filters:
+            conditions.append(Fit.__table__.c.run_id == self._get_latest_run())
+        return and_(*conditions)
+
+    @staticmethod
+    def _get_latest_run():
+        # The latest completed run of the experiment of each fit, or the fits
+        # added without a run if it has none. Shards join to the runs of the
+        # attached catalog.
+        fit, run = Fit.__table__, AnalysisRun.__table__
+        latest = select([run.c.run_id]).where(and_(
+            run.c.experiment_id == fit.c.experiment_id,
+            run.c.completed.isnot(None),
+            )).order_by(run.c.completed.desc(), run.c.run_id.desc()).limit(1)
+        return func.coalesce(latest.as_scalar(), 0)
+
+    def _get_fit_float_column(self, name):
+        # Numeric columns are read as floats rather than Decimals.
+        column = self._get_fit_query_column(name)
+        if isinstance(column.type, Numeric) and column.type.scale:
+            column = type_coerce(column, Float())
+        return column
+
+    @staticmethod
+    def _merge_fit_aggregates(merged, row):
+        # Merge the count, sums and extrema of a group from another shard.
+        if merged is None:
+            return list(row)
+        merged[0] += row[0]
+        for position in range(1, len(row), 6):
+            for offset, merge in enumerate([sum, min, max, sum, sum, sum]):
+                values = [
+                    value for value in
+                    [merged[position + offset], row[position + offset]]
+                    if value is not None
+                    ]
+                merged[position + offset] = merge(values) if values else None
+        return merged
+
+    @staticmethod
+    def _get_fit_query_column(name):
+        for model in [Fit, Experiment, Setting, Tube]:
+            if name in model.__table__.c:
+                return model.__table__.c[name]
+        raise ValueError(f'Unknown fit query column: `{name}`.')
+
+    def _get_sql_observation_arrays(
+            self, experiment_id, idx_range=None, columns=None,
+            connection=None):
+        if connection is None:
+            engine = self._get_engine(experiment_id, create=False)
+            with engine.connect() as connection:
+                return self._get_sql_observation_arrays(
+                    experiment_id, idx_range, columns, connection)
+
+        if columns is None:
+            columns = list(self._observation_dtypes) + ['temperatures']
+        observation_columns = [
+            name for name in columns if name in self._observation_dtypes]
+
+        table = Observation.__table__
+        where = table.c.experiment_id == experiment_id
+        if idx_range:
+            where = and_(where, table.c.idx.between(*idx_range))
+
+        # Size the arrays before reading any rows
+        count = connection.execute(
+            select([func.count()]).select_from(table).where(where)
+            ).scalar()
+        arrays = dict(idx=np.empty(count, dtype=np.int64))
+        for name in observation_columns:
+            arrays[name] = np.empty(
+                count, dtype=self._observation_dtypes[name])
+
+        # Numeric columns are read as floats rather than Decimals.
+        selected = [table.c.idx] + [
+            type_coerce(table.c[name], Float())
+            if self._observation_dtypes[name] is np.float64
+            else table.c[name]
+            for name in observation_columns
+            ]
+        statement = select(selected).where(where).order_by(table.c.idx)
+        result = connection.execution_options(
+            stream_results=True).execute(statement)
+        position = 0
+        while position < count:
+            rows = result.fetchmany(self._batch_size)
+            if not rows:
+                break
+            rows = rows[:count - position]
+            stop = position + len(rows)
+            for name, values in zip(arrays, zip(*rows)):
+                arrays[name][position:stop] = values
+            position = stop
+        result.close()
+        for name in arrays:
+            arrays[name] = arrays[name][:position]
+            # SQLite stores unrounded floats; match the column's scale.
+            scale = getattr(table.c[name].type, 'scale', None)
+            if scale is not None:
+                arrays[name] = np.round(arrays[name], scale)
+
+        if 'temperatures' in columns:
+            idx, thermocouples, temperatures = self._get_temperature_arrays(
+                connection, experiment_id, idx_range)
+            # Align the readings with the observations
+            aligned = np.full((position, len(thermocouples)), np.nan)
+            rows = np.searchsorted(arrays['idx'], idx)
+            found = rows < position
+            found[found] = arrays['idx'][rows[found]] == idx[found]
+            aligned[rows[found]] = temperatures[found]
+            arrays['thermocouples'] = thermocouples
+            arrays['temperatures'] = aligned
+
+        return arrays
+
+    def _get_observation_counts(self, session, experiment_id, verify=False):
+        # Every insert keeps the totals in the summary up to date, so they
+        # are read with a primary key lookup. The stored rows are only
+        # counted to verify them, or for experiments without a summary.
+        if not verify:
+            counts = self._execute(
+                session, 'observation_counts',
+                experiment_id=experiment_id).first()
+            if counts:
+                return dict(observations=counts[0], temperatures=counts[1])
+        return self._observation_store.get_counts(session, experiment_id)
+
+    def _get_sql_observation_counts(self, session, experiment_id):
+        # Observation counts for the experiment
+        query = session.query(func.count(Observation.experiment_id))
+        query = query.filter(Observation.experiment_id == experiment_id)
+        obs_count = query.one()[0]
+        # Temperature counts for the experiment
+        if self._packed_temperatures:
+            query = session.query(
+                func.coalesce(func.sum(PackedTemperature.count), 0))
+            query = query.filter(
+                PackedTemperature.experiment_id == experiment_id)
+        else:
             query = session.query(func.count(Temperature.experiment_id))
             query = query.filter(Temperature.experiment_id == experiment_id)
-            temp_count = query.one()[0]
-
-            session.close()
+        temp_count = int(query.one()[0])
+
+        return dict(observations=obs_count, temperatures=temp_count)
+
+    def _write_observations(
+            self, session, observations, experiment_id, progress=None):
+        total = len(observations)
+        written = 0
+        if self._commit_size:
+            # Chunks are committed in idx order, so every observation up to
+            # the last committed idx is already in the database, whatever the
+            # order of the input.
+            observations = sorted(
+                observations, key=lambda observation: observation.idx)
+            resume_idx = self._get_resume_idx(session, experiment_id)
+            if resume_idx is not None:
+                observations = [
+                    observation for observation in observations
+                    if observation.idx > resume_idx
+                    ]
+                written = total - len(observations)
+                if written and progress:
+                    progress(written, total)
+        chunk_size = self._commit_size or len(observations) or 1
+        for start in range(0, len(observations), chunk_size):
+            chunk = observations[start:start + chunk_size]
+            self._insert_observations(session, chunk, experiment_id)
+            if self._commit_size:
+                session.commit()
+            written += len(chunk)
+            if progress:
+                progress(written, total)
+
+    def _get_resume_idx(self, session, experiment_id):
+        return self._observation_store.get_resume_idx(session, experiment_id)
+
+    @staticmethod
+    def _get_sql_resume_idx(session, experiment_id):
+        query = session.query(func.max(Observation.idx))
+        query = query.filter(Observation.experiment_id == experiment_id)
+        return query.scalar()
+
+    def _insert_observations(self, session, observations, experiment_id):
+        # Only new observations are inserted, so the summary can be updated
+        # with exactly what was added.
+        observations = self._observation_store.add(
+            session, observations, experiment_id)
+        if observations:
+            self._update_summary(
+                session, experiment_id,
+                observation_arrays=self._get_summary_arrays(observations))
+
+    def _insert_sql_observations(self, session, observations, experiment_id):
+        observations = self._get_new_observations(
+            session, observations, experiment_id)
+        if not observations:
+            return observations
+        # Parameter rows are built straight from the specs; no orm objects are
+        # constructed.
+        observation_rows = self._get_observation_rows(
+            observations, experiment_id)
+        if self._packed_temperatures:
+            temperature_model = PackedTemperature
+            temperature_rows = self._get_packed_temperature_rows(
+                observations, experiment_id)
+        else:
+            temperature_model = Temperature
+            temperature_rows = self._get_temperature_rows(
+                observations, experiment_id)
+        # Perform a bulk insert that skips rows that already exist, so an
+        # interrupted ingest can be completed by running it again.
+        self._bulk_insert(
+            session, self._get_insert_ignore(Observation), observation_rows)
+        self._bulk_insert(
+            session, self._get_insert_ignore(temperature_model),
+            temperature_rows)
+        return observations
+
+    def _update_summary(self, session, experiment_id, observation_arrays=None):
+        # Merge the aggregates of newly added observations into the summary.
+        # The observations must already be in the session's transaction.
+        summary = session.query(ExperimentSummary).filter(
+            ExperimentSummary.experiment_id == experiment_id
+            ).with_for_update().first()
+        if summary is None:
+            # Observations stored before summaries were kept are summarized
+            # too.
+            count = self._observation_store.get_counts(
+                session, experiment_id)['observations']
+            added = len(observation_arrays['idx']) if observation_arrays else 0
+            if count > added:
+                observation_arrays = self._get_stored_observation_arrays(
+                    session, experiment_id)
+            summary = ExperimentSummary(
+                experiment_id=experiment_id, observation_count=0,
+                temperature_count=0)
+            session.add(summary)
+
+        if observation_arrays and len(observation_arrays['idx']):
+            count = summary.observation_count
+            for name in ['pressure', 'temperature', 'surface_temp', 'dew_point']:
+                mean, m2 = self._merge_moments(
+                    count, getattr(summary, f'{name}_mean'),
+                    getattr(summary, f'{name}_m2'), observation_arrays[name])
+                setattr(summary, f'{name}_mean', mean)
+                setattr(summary, f'{name}_m2', m2)
+            idx = observation_arrays['idx']
+            summary.min_idx = int(min(
+                idx.min(), summary.min_idx if count else idx.min()))
+            summary.max_idx = int(max(
+                idx.max(), summary.max_idx if count else idx.max()))
+            summary.observation_count = count + len(idx)
+            summary.temperature_count += observation_arrays['temperature_count']
+
+        session.flush()
+
+    def _get_summary(self, session, experiment_id):
+        # The summary of an experiment's observations, built from the stored
+        # observations if they were added before summaries were kept.
+        query = session.query(ExperimentSummary).filter(
+            ExperimentSummary.experiment_id == experiment_id)
+        summary = query.first()
+        if summary is None and self._observation_store.get_counts(
+                session, experiment_id)['observations']:
+            self._update_summary(session, experiment_id)
+            summary = query.first()
+        return summary
+
+    def _update_fit_summaries(self, session, experiment_id, fit_arrays):
+        # Merge the aggregates of newly added fits into the summary of their
+        # run. The fits must already be in the session's transaction.
+        for run_id in np.unique(fit_arrays['run_id']).tolist():
+            in_run = fit_arrays['run_id'] == run_id
+            mddp, nu_chi = fit_arrays['mddp'][in_run], fit_arrays['nu_chi'][in_run]
+            summary = session.query(FitSummary).filter(
+                and_(
+                    FitSummary.experiment_id == experiment_id,
+                    FitSummary.run_id == run_id,
+                    )
+                ).with_for_update().first()
+            if summary is None:
+                # Fits stored before the run was summarized are summarized too.
+                count = session.query(func.count(Fit.experiment_id)).filter(
+                    and_(
+                        Fit.experiment_id == experiment_id,
+                        Fit.run_id == run_id,
+                        )
+                    ).scalar()
+                if count > len(mddp):
+                    stored = self._get_stored_fit_arrays(
+                        session, experiment_id, run_id)
+                    mddp, nu_chi = stored['mddp'], stored['nu_chi']
+                summary = FitSummary(
+                    experiment_id=experiment_id, run_id=run_id, fit_count=0,
+                    fit_sample_count=0)
+                session.add(summary)
+
+            count = summary.fit_count
+            summary.mddp_mean, _ = self._merge_moments(
+                count, summary.mddp_mean, 0.0, mddp)
+            # A linear fit spans its degrees of freedom plus two samples.
+            summary.fit_sample_count += int(np.sum(nu_chi + 2))
+            summary.fit_count = count + len(mddp)
+
+        session.flush()
+
+    def _get_stored_observation_arrays(self, session, experiment_id):
+        # Columns of every stored observation of the experiment that the
+        # summary aggregates, read in the session's transaction
+        observation_arrays = self._observation_store.get_arrays(
+            experiment_id,
+            columns=['pressure', 'surface_temp', 'dew_point', 'temperatures'],
+            connection=session.connection())
+        temperatures = observation_arrays.pop('temperatures')
+        readings = ~np.isnan(temperatures)
+        with np.errstate(invalid='ignore'):
+            observation_arrays['temperature'] = (
+                np.nansum(temperatures, axis=1) / readings.sum(axis=1))
+        observation_arrays['temperature_count'] = int(readings.sum())
+        return observation_arrays
+
+    @staticmethod
+    def _get_stored_fit_arrays(session, experiment_id, run_id=None):
+        # Columns of the stored fits of the experiment, or of one of its
+        # runs, that the fit summaries aggregate
+        table = Fit.__table__
+        where = table.c.experiment_id == experiment_id
+        if run_id is not None:
+            where = and_(where, table.c.run_id == run_id)
+        rows = session.execute(
+            select([
+                type_coerce(table.c.mddp, Float()), table.c.nu_chi,
+                table.c.run_id,
+                ]).where(where)).fetchall()
+        return dict(
+            mddp=np.array([row[0] for row in rows], dtype=np.float64),
+            nu_chi=np.array([row[1] for row in rows], dtype=np.int64),
+            run_id=np.array([row[2] for row in rows], dtype=np.int64))
+
+    @staticmethod
+    def _merge_moments(count, mean, m2, values):
+        # Merge the mean and sum of squared deviations of `values` into those
+        # of `count` earlier values (Chan et al.).
+        values = np.asarray(values, dtype=np.float64)
+        values_mean = values.mean()
+        values_m2 = float(np.sum((values - values_mean) ** 2))
+        if not count:
+            return float(values_mean), values_m2
+        total = count + len(values)
+        delta = values_mean - mean
+        mean = mean + delta * len(values) / total
+        m2 = m2 + values_m2 + delta ** 2 * count * len(values) / total
+        return float(mean), float(m2)
+
+    @staticmethod
+    def _get_summary_arrays(observations):
+        # Columns of the observations that the summary aggregates, rounded to
+        # the scale they are stored with.
+        def column(name):
+            values = np.array(
+                [getattr(obs, name) for obs in observations], dtype=np.float64)
+            scale = getattr(Observation.__table__.c[name].type, 'scale', None)
+            return values if scale is None else np.round(values, scale)
+
+        scale = Temperature.__table__.c.temperature.type.scale
+        temperatures = [
+            [round(float(temp.temperature), scale) for temp in obs.temperatures]
+            for obs in observations
+            ]
+        return dict(
+            idx=np.array([obs.idx for obs in observations]),
+            pressure=column('pressure'),
+            temperature=np.array([
+                np.mean(temps) if temps else np.nan
+                for temps in temperatures
+                ]),
+            surface_temp=column('surface_temp'),
+            dew_point=column('dew_point'),
+            temperature_count=sum(len(temps) for temps in temperatures),
+            )
 
-            return dict(observations=obs_count, temperatures=temp_count)
+    @staticmethod
+    def _get_new_observations(session, observations, experiment_id):
+        if not observations:
+            return observations
+        idxs = [observation.idx for observation in observations]
+        query = session.query(Observation.idx).filter(
+            and_(
+                Observation.experiment_id == experiment_id,
+                Observation.idx.between(min(idxs), max(idxs)),
+                )
+            )
+        existing_idxs = {row.idx for row in query}
+        return [
+            observation for observation in observations
+            if observation.idx not in existing_idxs
+            ]
+
+    def _insert_fits(self, session, fit_specs, experiment_id):
+        # Check which fits already exist
+        idxs = [fit_spec.idx for fit_spec in fit_specs]
+        run_ids = {fit_spec.run_id for fit_spec in fit_specs}
+        query = session.query(Fit.idx, Fit.run_id).filter(
+            and_(
+                Fit.experiment_id == experiment_id,
+                Fit.run_id.in_(run_ids),
+                Fit.idx.between(min(idxs), max(idxs)),
+                )
+            )
+        existing_keys = {(row.idx, row.run_id) for row in query}
+        # Insert the rest
+        rows = [
+            self._get_fit_row(fit_spec, experiment_id)
+            for fit_spec in fit_specs
+            if (fit_spec.idx, fit_spec.run_id) not in existing_keys
+            ]
+        self._bulk_insert(session, Fit.__table__.insert(), rows)
+        if rows:
+            fit_arrays = dict(
+                mddp=np.array([row['mddp'] for row in rows], dtype=np.float64),
+                nu_chi=np.array([row['nu_chi'] for row in rows]),
+                run_id=np.array([row['run_id'] for row in rows]))
+            self._update_fit_summaries(session, experiment_id, fit_arrays)
+        return len(rows)
+
+    def _bulk_insert(self, session, statement, rows):
+        # Send the rows through a single core insert using executemany, one
+        # batch at a time.
+        for start in range(0, len(rows), self._batch_size):
+            session.execute(statement, rows[start:start + self._batch_size])
+
+    @staticmethod
+    def _get_insert_ignore(model, keys=None):
+        # Rows whose primary key, or `keys`, already exists are skipped rather
+        # than raising an integrity error; any other error is raised.
+        return expressions.insert_or_ignore(model.__table__, keys)
+
+    @staticmethod
+    def _get_observation_rows(observations, experiment_id):
+        return [
+            dict(
+                cap_man_ok=obs.cap_man_ok,
+                dew_point=obs.dew_point,
+                idx=obs.idx,
+                mass=obs.mass,
+                optidew_ok=obs.optidew_ok,
+                pow_out=obs.pow_out,
+                pow_ref=obs.pow_ref,
+                pressure=obs.pressure,
+                experiment_id=experiment_id,
+                surface_temp=obs.surface_temp,
+                ic_temp=obs.ic_temp)
+            for obs in observations
+            ]
+
+    @staticmethod
+    def _get_fit_row(fit_spec, experiment_id=None):
+        row = dataclasses.asdict(fit_spec)
+        exp_id = row.pop('exp_id')
+        row['experiment_id'] = exp_id if experiment_id is None else experiment_id
+        return row
+
+    @staticmethod
+    def _get_temperature_rows(observations, experiment_id):
+        return [
+            dict(
+                thermocouple_num=temp.thermocouple_num,
+                temperature=temp.temperature,
+                idx=temp.idx,
+                experiment_id=experiment_id)
+            for obs in observations
+            for temp in obs.temperatures
+            ]
+
+    @staticmethod
+    def _get_packed_temperature_rows(observations, experiment_id):
+        rows = []
+        for obs in observations:
+            temps = obs.temperatures
+            rows.append(
+                dict(
+                    thermocouple_nums=np.array(
+                        [temp.thermocouple_num for temp in temps],
+                        dtype=_CHANNEL_DTYPE).tobytes(),
+                    temperatures=np.array(
+                        [temp.temperature for temp in temps],
+                        dtype=_TEMPERATURE_DTYPE).tobytes(),
+                    count=len(temps),
+                    idx=obs.idx,
+                    experiment_id=experiment_id))
+        return rows
+
+    def _get_temperature_arrays(self, connection, experiment_id, idx_range=None):
+        # Returns the observation idx, the thermocouple numbers, and a 2-D
+        # array of temperatures with one row per idx and one column per
+        # thermocouple. Thermocouples that were not read are NaN. Rows are
+        # streamed with `fetchmany` into arrays sized by a count query.
+        if self._packed_temperatures:
+            table = PackedTemperature.__table__
+            columns = [table.c.idx, table.c.thermocouple_nums, table.c.temperatures]
+        else:
+            table = Temperature.__table__
+            columns = [
+                table.c.idx, table.c.thermocouple_num,
+                type_coerce(table.c.temperature, Float())]
+        where = table.c.experiment_id == experiment_id
+        if idx_range:
+            where = and_(where, table.c.idx.between(*idx_range))
+
+        # Size the arrays before reading any rows; packed rows hold `count`
+        # readings each.
+        if self._packed_temperatures:
+            size = func.coalesce(func.sum(table.c['count']), 0)
+        else:
+            size = func.count()
+        count = connection.execute(
+            select([size]).select_from(table).where(where)).scalar()
+        row_idx = np.empty(count, dtype=np.int64)
+        channels = np.empty(count, dtype=np.int64)
+        values = np.empty(count, dtype=np.float64)
+
+        statement = select(columns).where(where).order_by(table.c.idx)
+        result = connection.execution_options(
+            stream_results=True).execute(statement)
+        position = 0
+        while position < count:
+            rows = result.fetchmany(self._batch_size)
+            if not rows:
+                break
+            if self._packed_temperatures:
+                # Unpack each observation and repeat its idx once per reading
+                for idx, channel_bytes, value_bytes in rows:
+                    channel_row = np.frombuffer(
+                        channel_bytes, dtype=_CHANNEL_DTYPE)
+                    stop = min(position + len(channel_row), count)
+                    row_idx[position:stop] = idx
+                    channels[position:stop] = channel_row[:stop - position]
+                    values[position:stop] = np.frombuffer(
+                        value_bytes, dtype=_TEMPERATURE_DTYPE)[:stop - position]
+                    position = stop
+            else:
+                rows = rows[:count - position]
+                stop = position + len(rows)
+                for array, column in zip(
+                        [row_idx, channels, values], zip(*rows)):
+                    array[position:stop] = column
+                position = stop
+        result.close()
+        row_idx = row_idx[:position]
+        channels = channels[:position]
+        # Packed readings are stored as float32 and SQLite stores unrounded
+        # floats; the rows layout keeps two decimals, so round to that.
+        values = np.round(values[:position], 2)
+
+        # Pivot the readings into one row per idx
+        idx, row_positions = np.unique(row_idx, return_inverse=True)
+        thermocouples, col_positions = np.unique(channels, return_inverse=True)
+        temperatures = np.full((len(idx), len(thermocouples)), np.nan)
+        temperatures[row_positions, col_positions] = values
+
+        return idx, thermocouples.astype(np.int64), temperatures
 
     def _teardown(self):
         """
@@ -674,8 +2462,16 @@ class ExperimentAccess(object):
         """
         # Drop all tables
         Base.metadata.drop_all(self._engine)
-        # Dispose of the engine
-        self._engine.dispose()
+        self._observation_store.teardown()
+        self._clear_dimension_ids()
+        with _merged_lock:
+            _merged_ids.pop(self._conn_string, None)
+        # Delete the shards
+        if self._shard_directory:
+            for experiment_id in self._get_shard_ids():
+                self._remove_shard(experiment_id)
+        # Dispose of the shared engine
+        engines.dispose_engine(self._conn_string)
 
     def _get_tube_spec(self):
         # Inner diameter
@@ -733,4 +2529,4 @@ class ExperimentAccess(object):
             mass=Decimal(mass),
             material=material,
         )
-        self._tube_spec = dacite.from_dict(TubeSpec, data)
+        return dacite.from_dict(TubeSpec, data)
@@ -0,0 +1,183 @@
+"""Write-behind persistence for experiment access."""
+
+import queue
+import threading
+
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+import coimbra_chamber.ifx.configuration as config
+
+
+# Tells the writer thread to stop
+_STOP = object()
+
+
+class ExperimentWriter(object):
+    """
+    Write-behind persistence for fits and observations.
+
+    Batches are queued without waiting on the database. A background thread
+    takes every batch that is waiting, joins those of the same kind and
+    experiment, writes them all in one transaction and commits once. The
+    queue is bounded, so producers block when the database falls behind
+    instead of growing memory without limit.
+
+    Errors raised while writing are reported back to the caller by the next
+    call to `put_fits`, `put_observations`, `flush` or `close`.
+
+    Examples
+    --------
+    >>> with ExperimentWriter() as writer:
+    ...     for fit_specs in batches:
+    ...         writer.put_fits(fit_specs, experiment_id)
+
+    """
+
+    # ------------------------------------------------------------------------
+    # Constructors
+
+    def __init__(self, exp_acc=None, max_batches=None):
+        """
+        Start the writer thread.
+
+        Parameters
+        ----------
+        exp_acc : coimbra_chamber.access.experiment.service.ExperimentAccess
+            Access service used to write. Defaults to a new instance.
+        max_batches : int, optional
+            Number of batches that can wait in the queue. Defaults to the
+            `writer_queue_size` setting.
+
+        """
+        self._exp_acc = exp_acc or ExperimentAccess()
+        if max_batches is None:
+            max_batches = int(config.get_value('writer_queue_size') or 16)
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._errors = []
+        self._thread = threading.Thread(
+            target=self._run, name='ExperimentWriter', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):  # noqa: D105
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):  # noqa: D105
+        # Do not hide an exception that is already on its way out.
+        self.close(raise_errors=exc_type is None)
+
+    # ------------------------------------------------------------------------
+    # Public methods: included in the API
+
+    def put_fits(self, fit_specs, experiment_id):
+        """
+        Queue fits to be added to the database.
+
+        Parameters
+        ----------
+        fit_specs : list of coimbra_chamber.access.experiment.contracts.FitSpec
+            Parameters for each fit.
+        experiment_id : int
+            ExperimentId for all of the fits.
+
+        """
+        self._put('fits', fit_specs, experiment_id)
+
+    def put_observations(self, observations, experiment_id):
+        """
+        Queue observations to be added to the database.
+
+        Parameters
+        ----------
+        observations : list of coimbra_chamber.access.experiment.contracts.ObservationSpec
+            Observations, including their temperatures.
+        experiment_id : int
+            ExperimentId for all of the observations.
+
+        """
+        self._put('observations', observations, experiment_id)
+
+    def flush(self):
+        """Wait until every queued batch is written and raise any error."""
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self, raise_errors=True):
+        """
+        Write every queued batch and stop the writer thread.
+
+        Parameters
+        ----------
+        raise_errors : bool, default True
+            Raise the first error from the writer thread, if any.
+
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if raise_errors:
+            self._raise_errors()
+
+    # ------------------------------------------------------------------------
+    # Internal methods: not included in the API
+
+    def _put(self, kind, specs, experiment_id):
+        self._raise_errors()
+        if specs:
+            self._queue.put((kind, list(specs), experiment_id))
+
+    def _raise_errors(self):
+        if self._errors:
+            error = self._errors.pop(0)
+            self._errors.clear()
+            raise error
+
+    def _run(self):
+        stop = False
+        while not stop:
+            # Block for one batch, then coalesce everything else waiting.
+            batches = [self._queue.get()]
+            while batches[-1] is not _STOP:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batches[-1] is _STOP:
+                stop = True
+            try:
+                self._write([batch for batch in batches if batch is not _STOP])
+            except Exception as err:
+                self._errors.append(err)
+            finally:
+                for _ in batches:
+                    self._queue.task_done()
+
+    def _write(self, batches):
+        # Batches of the same kind and experiment are joined, so each is
+        # written with one existence check and one executemany. Groups keep
+        # the order they were first queued in.
+        groups = {}
+        for kind, specs, experiment_id in batches:
+            groups.setdefault((kind, experiment_id), []).extend(specs)
+
+        # One session per database: a single one unless the database is
+        # sharded by experiment.
+        sessions = {}
+        try:
+            for (kind, experiment_id), specs in groups.items():
+                engine = self._exp_acc._get_engine(experiment_id)
+                if engine not in sessions:
+                    sessions[engine] = self._exp_acc.Session(bind=engine)
+                session = sessions[engine]
+                if kind == 'fits':
+                    self._exp_acc._insert_fits(session, specs, experiment_id)
+                else:
+                    self._exp_acc._insert_observations(
+                        session, specs, experiment_id)
+            for session in sessions.values():
+                session.commit()
+        except Exception:
+            for session in sessions.values():
+                session.rollback()
+            raise
+        finally:
+            for session in sessions.values():
+                session.close()
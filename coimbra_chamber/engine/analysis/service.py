@@ -2,16 +2,20 @@
 
 
 import dacite
+import numpy as np
 import pandas as pd
 from math import log, pi
 
 from CoolProp.CoolProp import PropsSI
 from CoolProp.HumidAirProp import HAPropsSI
 from scipy.stats import chi2
-from uncertainties import ufloat
+from uncertainties import ufloat, unumpy
 
+from coimbra_chamber.__version__ import __version__
 from coimbra_chamber.access.experiment.service import ExperimentAccess
 from coimbra_chamber.access.experiment.contracts import FitSpec
+from coimbra_chamber.access.experiment.writer import ExperimentWriter
+import coimbra_chamber.ifx.configuration as config
 
 from coimbra_chamber.utility.io.contracts import Prompt
 from coimbra_chamber.utility.io.service import IOUtility
@@ -23,8 +27,28 @@ from coimbra_chamber.utility.plot.service import PlotUtility
 class AnalysisEngine(object):
     """Encapsulate all aspects of analysis."""
 
-    def __init__(self, experiment_id):  # noqa: D107
+    # Columns read from the database to rebuild the observations
+    _observation_columns = [
+        'cap_man_ok', 'dew_point', 'ic_temp', 'mass', 'optidew_ok',
+        'pow_ref', 'pressure', 'surface_temp', 'temperatures',
+        ]
+
+    def __init__(self, experiment_id, lease=None):
+        """
+        Create an engine for an experiment.
+
+        Parameters
+        ----------
+        experiment_id : int
+            ExperimentId to analyze.
+        lease : callable, optional
+            Returns False once the lease on the job of the analysis was lost.
+            It is called before fits are stored, and the analysis is aborted
+            with a RuntimeError if it returns False.
+
+        """
         self._experiment_id = experiment_id
+        self._lease = lease
 
         self._exp_acc = ExperimentAccess()
         self._io_util = IOUtility()
@@ -32,9 +56,14 @@ class AnalysisEngine(object):
 
         self._error = 0.01
         self._fits = []
+        self._persisted = 0
+        self._writer = None
+        # Fits handed to the writer at a time
+        self._fit_batch_size = int(config.get_value('fit_batch_size') or 100)
         self._idx = 1
         self._steps = 1
         self._bounds = (None, None)
+        self._run_id = 0
 
         # IR sensor calibration
         self._a = ufloat(-2.34, 0.07)
@@ -65,23 +94,59 @@ class AnalysisEngine(object):
     # ------------------------------------------------------------------------
     # Public methods: included in the API
 
-    def process_fits(self, data):
+    def process_fits(self, data=None):
         """
         Process fits from data.
 
+        Fits are handed to a background writer in batches of
+        `fit_batch_size` as they are found, so the analysis does not wait on
+        database commits. They are stored under an
+        analysis run keyed by the parameters of the analysis; if a run with
+        the same parameters and engine version already completed, its fits
+        are returned without fitting again.
+
         Parameters
         ----------
-        data : comimbra_chamber.access.experiment.contracts.DataSpec.
+        data : comimbra_chamber.access.experiment.contracts.DataSpec, optional
+            Data to fit. If omitted, the observations of the experiment are
+            loaded from the database instead, so an experiment can be
+            reanalyzed without its TDMS file.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Fits of the analysis run.
 
         """
-        self._data = data
-        self._get_observations()
-        self._get_fits()
-        self._persist_fits()
+        run = self._exp_acc.add_analysis_run(
+            self._experiment_id, self._get_parameters(), __version__)
+        self._run_id = run['run_id']
+        if run['completed'] is None:
+            self._data = data
+            if data is None:
+                self._load_observations()
+            else:
+                self._get_observations()
+            with ExperimentWriter(self._exp_acc) as self._writer:
+                try:
+                    self._get_fits()
+                    self._persist_fits()
+                finally:
+                    self._writer = None
+            self._check_lease()
+            self._exp_acc.complete_analysis_run(self._run_id)
+        return self._exp_acc.get_fits(
+            experiment_id=self._experiment_id, run_id=self._run_id)
 
     # ------------------------------------------------------------------------
     # Internal methods: not included in the API
 
+    def _get_parameters(self):
+        # The settings that change the fits of an experiment. `_idx` is not
+        # one of them; it only tracks the progress of the analysis.
+        return dict(
+            error=self._error, steps=self._steps, bounds=list(self._bounds))
+
     def _get_observations(self):
         # Create empty lists to hold data as we iterate through observations.
         dew_point = []
@@ -138,6 +203,38 @@ class AnalysisEngine(object):
 
         self._observations = pd.DataFrame(index=time, data=data)
 
+    def _load_observations(self):
+        # Same frame as `_get_observations`, built from columnar reads of the
+        # database rather than from a DataSpec.
+        arrays = self._exp_acc.get_observation_arrays(
+            self._experiment_id, columns=self._observation_columns)
+
+        # Average temperatures with error propagation; missing readings are
+        # NaN.
+        temperatures = arrays['temperatures']
+        counts = np.sum(~np.isnan(temperatures), axis=1)
+        temp = unumpy.uarray(
+            np.nansum(temperatures, axis=1) / counts, 0.2 / np.sqrt(counts))
+
+        pressure = arrays['pressure']
+        data = dict(
+            Tdp=unumpy.uarray(arrays['dew_point'], 0.2),
+            m=unumpy.uarray(arrays['mass'], 1e-7),
+            Jref=unumpy.uarray(
+                arrays['pow_ref'], np.abs(arrays['pow_ref']) * 0.05),
+            P=unumpy.uarray(pressure, np.trunc(pressure * 0.0015)),
+            Te=temp,
+            Ts=unumpy.uarray(arrays['surface_temp'], 0.5),
+            Tic=unumpy.uarray(arrays['ic_temp'], 0.2),
+            cap_man=arrays['cap_man_ok'].tolist(),
+            optidew=arrays['optidew_ok'].tolist(),
+            )
+
+        # Ensure that time starts at zero
+        time = (arrays['idx'] - arrays['idx'][0]).tolist()
+
+        self._observations = pd.DataFrame(index=time, data=data)
+
     def _layout_observations(self):
         # internal helper logic
         def nominal(ufloat_):
@@ -282,19 +379,34 @@ class AnalysisEngine(object):
                 self._set_local_properties()
                 self._set_nondim_groups()
                 self._fits.append(self._this_fit)
+                unsent = len(self._fits) - self._persisted
+                if self._writer and unsent >= self._fit_batch_size:
+                    self._persist_fits()
                 # Length of the best fit is the degrees of freedom plus 2 for
                 # a linear fit.
                 self._idx += self._this_fit['nu_chi'] + 2
             else:  # _get_best_local_fit returned None
                 self._idx += len(self._sample)
 
+    def _check_lease(self):
+        if self._lease is not None and not self._lease():
+            err_msg = (
+                f'Lost the lease on the job of experiment '
+                f'`{self._experiment_id}`.')
+            raise RuntimeError(err_msg)
+
     def _persist_fits(self):
-        counter = 0
-        for data in self._fits:
-            fit_spec = dacite.from_dict(FitSpec, data)
-            self._exp_acc.add_fit(fit_spec, self._experiment_id)
-            counter += 1
-        return counter
+        self._check_lease()
+        # Only send the fits that have not been sent yet.
+        fit_specs = [
+            dacite.from_dict(FitSpec, data)
+            for data in self._fits[self._persisted:]
+            ]
+        self._persisted = len(self._fits)
+        if self._writer:
+            self._writer.put_fits(fit_specs, self._experiment_id)
+            return len(fit_specs)
+        return self._exp_acc.add_fits(fit_specs, self._experiment_id)
 
     # Properties .............................................................
 
@@ -736,3 +848,4 @@ class AnalysisEngine(object):
         self._this_fit['nu_chi'] = len(x) - 2
         self._this_fit['exp_id'] = self._experiment_id
         self._this_fit['idx'] = self._idx
+        self._this_fit['run_id'] = self._run_id
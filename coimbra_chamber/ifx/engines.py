@@ -0,0 +1,185 @@
+"""Process-wide registry of SQLAlchemy engines and database properties."""
+
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool, StaticPool
+
+import coimbra_chamber.ifx.configuration as config
+
+
+_engines = dict()
+_properties = dict()
+_lock = threading.RLock()
+
+
+def get_engine(conn_string, on_create=None):
+    """
+    Get the engine shared by every caller using a connection string.
+
+    The first call for a connection string creates the engine and its
+    connection pool; later calls return the same engine.
+
+    Parameters
+    ----------
+    conn_string : str
+        SQLAlchemy connection string.
+    on_create : callable, optional
+        Called with the new engine right after it is created, e.g. to create
+        the schema. It is not called when the engine already exists.
+
+    Returns
+    -------
+    sqlalchemy.engine.Engine
+
+    Examples
+    --------
+    >>> import coimbra_chamber.ifx.engines as engines
+    >>> engine = engines.get_engine('sqlite:///:memory:')
+    >>> engine is engines.get_engine('sqlite:///:memory:')
+    True
+
+    """
+    with _lock:
+        engine = _engines.get(conn_string)
+        if engine is None:
+            engine = create_engine(
+                conn_string, echo=False, **_get_pool_options(conn_string))
+            if _is_sqlite_file(conn_string):
+                event.listen(engine, 'connect', _get_sqlite_pragmas())
+            if on_create:
+                on_create(engine)
+            _engines[conn_string] = engine
+        return engine
+
+
+def dispose_engine(conn_string):
+    """
+    Dispose of the shared engine for a connection string.
+
+    Closes all pooled connections and removes the engine and the cached
+    properties of its database from the registry, so the next call to
+    `get_engine` creates a new one.
+
+    Parameters
+    ----------
+    conn_string : str
+        SQLAlchemy connection string.
+
+    """
+    with _lock:
+        _properties.pop(conn_string, None)
+        engine = _engines.pop(conn_string, None)
+        if engine is not None:
+            engine.dispose()
+
+
+def get_property(conn_string, name, load):
+    """
+    Get a property of the database behind a connection string.
+
+    The first call for a connection string and name gets the value from
+    `load`; later calls return the cached value until it is set with
+    `set_property` or the engine is disposed. A value of None is not cached,
+    so a property that is not recorded yet is loaded again next time.
+
+    Parameters
+    ----------
+    conn_string : str
+        SQLAlchemy connection string.
+    name : str
+        Name of the property.
+    load : callable
+        Called without arguments to get the value from the database.
+
+    Returns
+    -------
+    object
+        Value of the property, or None if the database has none.
+
+    Examples
+    --------
+    >>> import coimbra_chamber.ifx.engines as engines
+    >>> engines.get_property('sqlite:///example.db', 'answer', lambda: 42)
+    42
+    >>> engines.get_property('sqlite:///example.db', 'answer', lambda: 0)
+    42
+
+    """
+    with _lock:
+        properties = _properties.setdefault(conn_string, {})
+        if name not in properties:
+            value = load()
+            if value is None:
+                return None
+            properties[name] = value
+        return properties[name]
+
+
+def set_property(conn_string, name, value):
+    """
+    Cache a property of the database behind a connection string.
+
+    Parameters
+    ----------
+    conn_string : str
+        SQLAlchemy connection string.
+    name : str
+        Name of the property.
+    value : object
+        Value of the property as recorded in the database.
+
+    """
+    with _lock:
+        _properties.setdefault(conn_string, {})[name] = value
+
+
+def _get_pool_options(conn_string):
+    if conn_string == 'sqlite:///:memory:':
+        # A single connection holds the whole in-memory database, so every
+        # thread must share it.
+        return dict(
+            poolclass=StaticPool,
+            connect_args=dict(check_same_thread=False))
+
+    options = dict(
+        pool_size=int(config.get_value('pool_size') or 5),
+        max_overflow=int(config.get_value('max_overflow') or 10),
+        pool_recycle=int(config.get_value('pool_recycle') or 3600))
+
+    if _is_sqlite_file(conn_string):
+        # Pool file connections too; a pooled connection is only ever used by
+        # one thread at a time.
+        options.update(
+            poolclass=QueuePool,
+            connect_args=dict(check_same_thread=False))
+
+    return options
+
+
+def _is_sqlite_file(conn_string):
+    return (
+        conn_string.startswith('sqlite:///')
+        and conn_string != 'sqlite:///:memory:')
+
+
+def _get_sqlite_pragmas():
+    section = 'SQLite'
+    pragmas = dict(
+        journal_mode=config.get_value('journal_mode', section) or 'WAL',
+        synchronous=config.get_value('synchronous', section) or 'NORMAL',
+        cache_size=config.get_value('cache_size', section) or -64000,
+        mmap_size=config.get_value('mmap_size', section) or 268435456,
+        temp_store='MEMORY',
+        busy_timeout=config.get_value('busy_timeout', section) or 30000,
+        )
+
+    def set_pragmas(dbapi_connection, connection_record):
+        # Applied to every new connection since most pragmas are not stored
+        # in the database file.
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f'PRAGMA {key} = {value};')
+        cursor.close()
+
+    return set_pragmas
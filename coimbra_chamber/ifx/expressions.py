@@ -0,0 +1,138 @@
+"""SQL expressions that are compiled differently for each database."""
+
+from sqlalchemy import DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.expression import FunctionElement
+
+
+class InsertOrIgnore(Insert):
+    """
+    Insert that skips rows whose key already exists.
+
+    Unlike `INSERT OR IGNORE` and `INSERT IGNORE`, only a conflict on the key
+    is skipped; NOT NULL, foreign key and other violations still raise.
+    """
+
+    def __init__(self, table, keys=None, **kwargs):
+        """
+        Create an insert into a table.
+
+        Parameters
+        ----------
+        table : sqlalchemy.Table
+            Table to insert into.
+        keys : list of sqlalchemy.Column, optional
+            Columns of the primary key or unique index whose conflicts are
+            skipped. Defaults to the primary key.
+
+        """
+        super().__init__(table, **kwargs)
+        if keys is None:
+            keys = table.primary_key.columns
+        self.conflict_keys = [column.name for column in keys]
+
+
+@compiles(InsertOrIgnore, 'sqlite')
+def _compile_sqlite(insert, compiler, **kwargs):
+    keys = ', '.join(compiler.preparer.quote(key) for key in insert.conflict_keys)
+    return (
+        f'{compiler.visit_insert(insert, **kwargs)} '
+        f'ON CONFLICT ({keys}) DO NOTHING')
+
+
+@compiles(InsertOrIgnore, 'mysql')
+def _compile_mysql(insert, compiler, **kwargs):  # pragma: no cover
+    # MySQL has no DO NOTHING; assigning a key column to itself is a no-op.
+    key = compiler.preparer.quote(insert.conflict_keys[0])
+    return (
+        f'{compiler.visit_insert(insert, **kwargs)} '
+        f'ON DUPLICATE KEY UPDATE {key} = {key}')
+
+
+def insert_or_ignore(table, keys=None):
+    """
+    Get an insert into `table` that skips rows whose key already exists.
+
+    Parameters
+    ----------
+    table : sqlalchemy.Table
+        Table to insert into.
+    keys : list of sqlalchemy.Column, optional
+        Columns of the primary key or unique index whose conflicts are
+        skipped. Defaults to the primary key.
+
+    Returns
+    -------
+    InsertOrIgnore
+
+    Examples
+    --------
+    >>> import coimbra_chamber.ifx.expressions as expressions
+    >>> statement = expressions.insert_or_ignore(Observation.__table__)
+    >>> connection.execute(statement, rows)
+
+    """
+    return InsertOrIgnore(table, keys)
+
+
+class UtcNow(FunctionElement):
+    """
+    Current UTC time of the database server, offset by some seconds.
+
+    Compares correctly with `DateTime` columns written by SQLAlchemy, so
+    times kept by several machines are all read from one clock.
+    """
+
+    type = DateTime()
+    name = 'utcnow'
+
+    def __init__(self, seconds=0):
+        """
+        Create the expression.
+
+        Parameters
+        ----------
+        seconds : int, default 0
+            Seconds to add to the current time.
+
+        """
+        super().__init__()
+        self.seconds = int(seconds)
+
+
+@compiles(UtcNow, 'sqlite')
+def _compile_sqlite_utcnow(utcnow, compiler, **kwargs):
+    # SQLAlchemy stores microseconds; strftime only has milliseconds.
+    return (
+        "(strftime('%Y-%m-%d %H:%M:%f', 'now', "
+        f"'{utcnow.seconds:+d} seconds') || '000')")
+
+
+@compiles(UtcNow, 'mysql')
+def _compile_mysql_utcnow(utcnow, compiler, **kwargs):  # pragma: no cover
+    return f'(UTC_TIMESTAMP(6) + INTERVAL {utcnow.seconds} SECOND)'
+
+
+def utcnow(seconds=0):
+    """
+    Get the current UTC time of the database server.
+
+    Parameters
+    ----------
+    seconds : int, default 0
+        Seconds to add to the current time.
+
+    Returns
+    -------
+    UtcNow
+
+    Examples
+    --------
+    Expire a lease ten minutes from now:
+    >>> import coimbra_chamber.ifx.expressions as expressions
+    >>> statement = Job.__table__.update().values(
+    ...     lease_expires=expressions.utcnow(600))
+
+    """
+    return UtcNow(seconds)
@@ -0,0 +1,86 @@
+"""Process-wide cache of compiled SQL statements."""
+
+import threading
+
+
+_statements = dict()
+_stats = dict(hits=0, misses=0)
+_lock = threading.Lock()
+
+
+def get_compiled(name, statement, dialect, column_keys=None):
+    """
+    Get a statement compiled for a dialect, compiling it on first use.
+
+    Statements are cached by name and dialect, so every engine of the same
+    database type shares them. Parameters are bound by name when the
+    compiled statement is executed.
+
+    Parameters
+    ----------
+    name : str
+        Name the statement is cached under.
+    statement : sqlalchemy.sql.expression.ClauseElement
+        Statement with `bindparam` placeholders for its parameters.
+    dialect : sqlalchemy.engine.interfaces.Dialect
+        Dialect to compile for.
+    column_keys : list of str, optional
+        Columns given values by an insert or update.
+
+    Returns
+    -------
+    sqlalchemy.engine.interfaces.Compiled
+
+    Examples
+    --------
+    >>> import coimbra_chamber.ifx.statements as statements
+    >>> statement = select([Tube.tube_id]).where(
+    ...     Tube.mass == bindparam('mass'))
+    >>> compiled = statements.get_compiled(
+    ...     'tube_id', statement, engine.dialect)
+    >>> connection.execute(compiled, mass=Decimal('0.0873')).scalar()
+    1
+
+    """
+    key = (name, dialect.name)
+    with _lock:
+        compiled = _statements.get(key)
+        if compiled is not None:
+            _stats['hits'] += 1
+            return compiled
+        _stats['misses'] += 1
+    compiled = statement.compile(dialect=dialect, column_keys=column_keys)
+    with _lock:
+        return _statements.setdefault(key, compiled)
+
+
+def get_stats():
+    """
+    Get the hit rate of the statement cache.
+
+    Returns
+    -------
+    dict
+        `hits` and `misses` since the cache was last cleared, the number of
+        cached statements (`size`) and `hit_rate`, which is None before the
+        first lookup.
+
+    Examples
+    --------
+    >>> statements.get_stats()
+    {'hits': 998, 'misses': 2, 'size': 2, 'hit_rate': 0.998}
+
+    """
+    with _lock:
+        hits, misses, size = _stats['hits'], _stats['misses'], len(_statements)
+    lookups = hits + misses
+    return dict(
+        hits=hits, misses=misses, size=size,
+        hit_rate=hits / lookups if lookups else None)
+
+
+def clear():
+    """Remove every compiled statement and reset the statistics."""
+    with _lock:
+        _statements.clear()
+        _stats.update(hits=0, misses=0)
@@ -0,0 +1,169 @@
+"""Analysis worker service."""
+
+import os
+import socket
+import threading
+import time
+
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+from coimbra_chamber.engine.analysis.service import AnalysisEngine
+import coimbra_chamber.ifx.configuration as config
+
+
+class AnalysisWorker(object):
+    """
+    Analysis worker.
+
+    Claims queued experiments from the shared database, cheapest first, and
+    analyzes them until the queue is empty. Any number of workers on any
+    number of machines can share one database. While an experiment is
+    analyzed its lease is renewed in the background; if a worker dies its
+    lease expires and the experiment is claimed by another worker. A worker
+    whose lease was lost stops before storing any more fits. Failed
+    experiments are retried up to `max_attempts` times.
+
+    Examples
+    --------
+    On each machine:
+    >>> worker = AnalysisWorker()
+    >>> worker.queue()
+    >>> worker.run()
+    {'done': 6, 'failed': 0}
+
+    Or from the command line:
+
+        $ python -m coimbra_chamber.manager.worker.service
+
+    """
+
+    def __init__(
+            self, name=None, lease_seconds=None, poll_seconds=None,
+            max_attempts=None):
+        """
+        Create a worker.
+
+        Parameters
+        ----------
+        name : str, optional
+            Name recorded on claimed jobs. Defaults to the host and process
+            id.
+        lease_seconds : int, optional
+            Length of a lease. Defaults to the `lease_seconds` setting. The
+            lease is renewed every third of it.
+        poll_seconds : float, optional
+            Seconds to wait for new jobs when the queue is empty. Defaults to
+            the `poll_seconds` setting; zero stops when the queue is empty.
+        max_attempts : int, optional
+            Claims of a job before it is no longer retried. Defaults to the
+            `max_attempts` setting.
+
+        """
+        self._exp_acc = ExperimentAccess()
+        self._name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self._lease_seconds = int(
+            lease_seconds or config.get_value('lease_seconds') or 600)
+        if poll_seconds is None:
+            poll_seconds = float(config.get_value('poll_seconds') or 0)
+        self._poll_seconds = poll_seconds
+        self._max_attempts = int(
+            max_attempts or config.get_value('max_attempts') or 3)
+
+    # ------------------------------------------------------------------------
+    # Public methods: included in the API
+
+    def queue(self, experiment_ids=None):
+        """
+        Queue experiments for analysis.
+
+        See Also
+        --------
+        ExperimentAccess.add_jobs
+
+        """
+        return self._exp_acc.add_jobs(experiment_ids)
+
+    def requeue(self, experiment_ids=None):
+        """
+        Queue failed experiments again.
+
+        See Also
+        --------
+        ExperimentAccess.requeue_jobs
+
+        """
+        return self._exp_acc.requeue_jobs(experiment_ids)
+
+    def run(self, max_jobs=None):
+        """
+        Analyze claimed experiments until the queue is empty.
+
+        Parameters
+        ----------
+        max_jobs : int, optional
+            Stop after this many jobs.
+
+        Returns
+        -------
+        dict of {str: int}
+            Number of jobs this worker finished and failed.
+
+        """
+        counts = dict(done=0, failed=0)
+        while max_jobs is None or sum(counts.values()) < max_jobs:
+            job = self._exp_acc.claim_job(
+                self._name, self._lease_seconds, self._max_attempts)
+            if job is None:
+                if not self._poll_seconds:
+                    break
+                time.sleep(self._poll_seconds)
+                continue
+            error = self._run_job(job)
+            counts['failed' if error else 'done'] += 1
+        return counts
+
+    # ------------------------------------------------------------------------
+    # Internal methods: not included in the API
+
+    def _run_job(self, job):
+        # Analyze the experiment while a heartbeat renews the lease, then
+        # record how it went.
+        stop = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job, stop, lost), daemon=True)
+        heartbeat.start()
+        error = None
+        try:
+            AnalysisEngine(
+                job['experiment_id'],
+                lease=lambda: self._holds_lease(job, lost)).process_fits()
+        except Exception as err:
+            error = f'{type(err).__name__}: {err}'
+            print(f'Experiment {job["experiment_id"]} failed: {error}')
+        finally:
+            stop.set()
+            heartbeat.join()
+        self._exp_acc.finish_job(
+            job['experiment_id'], job['lease_id'], error=error,
+            max_attempts=self._max_attempts)
+        return error
+
+    def _heartbeat(self, job, stop, lost):
+        while not stop.wait(self._lease_seconds / 3):
+            renewed = self._exp_acc.renew_job(
+                job['experiment_id'], job['lease_id'], self._lease_seconds)
+            if not renewed:
+                # The lease expired and the job went back to the queue.
+                lost.set()
+                break
+
+    def _holds_lease(self, job, lost):
+        # The heartbeat may not have noticed an expired lease yet.
+        return not lost.is_set() and self._exp_acc.check_job(
+            job['experiment_id'], job['lease_id'])
+
+
+if __name__ == '__main__':
+    worker = AnalysisWorker()
+    print(f'Queued {worker.queue()} experiments.')
+    print(f'Finished jobs: {worker.run()}')
@@ -0,0 +1,169 @@
+"""Integration test suite for ParquetArchive."""
+
+import dataclasses
+
+import pytest
+
+from coimbra_chamber.access.experiment.archive import ParquetArchive
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+
+pytest.importorskip('pyarrow')
+
+
+# ----------------------------------------------------------------------------
+# ParquetArchive
+
+
+def test_export_and_load(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sharded')
+    monkeypatch.setenv('database_path', str(tmp_path / 'catalog.db'))
+    monkeypatch.setenv('shard_directory', str(tmp_path / 'shards'))
+    source = ExperimentAccess()
+    source.setup_schema()
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    target = ExperimentAccess()
+    target.setup_schema()
+    try:
+        source._add_tube(tube_spec)
+        experiment_id = source.add_raw_data(data_spec)['experiment_id']
+        run = source.add_analysis_run(experiment_id, dict(error=0.01), '1.0')
+        fit_specs = [
+            dataclasses.replace(fit_spec, idx=idx, run_id=run['run_id'])
+            for idx in range(3)
+            ]
+        source.add_fits(fit_specs, experiment_id)
+        # Act ----------------------------------------------------------------
+        exported = ParquetArchive(source).export(tmp_path / 'archive')
+        loaded = ParquetArchive(target).load(tmp_path / 'archive')
+        # Loading again skips the rows that are already there
+        ParquetArchive(target).load(tmp_path / 'archive')
+        # Assert -------------------------------------------------------------
+        assert exported == loaded
+        assert exported == dict(
+            Tubes=1, Settings=1, Experiments=1, AnalysisRuns=1,
+            Observations=2, Temperatures=6, PackedTemperatures=0, Fits=3,
+            ExperimentSummaries=1, FitSummaries=1)
+        assert (
+            tmp_path / 'archive' / 'Observations'
+            / f'experiment_{experiment_id}' / 'part-0.parquet').exists()
+
+        source_arrays = source.get_observation_arrays(experiment_id)
+        target_arrays = target.get_observation_arrays(experiment_id)
+        assert source_arrays.keys() == target_arrays.keys()
+        for name in source_arrays:
+            assert source_arrays[name].tolist() == target_arrays[name].tolist()
+        assert (
+            source.get_fits(experiment_id=experiment_id).equals(
+                target.get_fits(experiment_id=experiment_id)))
+        assert (
+            source.get_analysis_runs(experiment_id)
+            == target.get_analysis_runs(experiment_id))
+        assert (
+            source.get_experiment_summary(experiment_id)
+            == target.get_experiment_summary(experiment_id))
+    finally:
+        source._teardown()
+        target._teardown()
+
+
+def test_load_remaps_ids(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'source.db'))
+    source = ExperimentAccess()
+    source.setup_schema()
+    monkeypatch.setenv('database_path', str(tmp_path / 'target.db'))
+    target = ExperimentAccess()
+    target.setup_schema()
+    try:
+        source._add_tube(tube_spec)
+        experiment_id = source.add_raw_data(data_spec)['experiment_id']
+        run = source.add_analysis_run(experiment_id, dict(error=0.01), '1.0')
+        fit_specs = [
+            dataclasses.replace(fit_spec, idx=idx, run_id=run['run_id'])
+            for idx in range(2)
+            ]
+        source.add_fits(fit_specs, experiment_id)
+        ParquetArchive(source).export(tmp_path / 'archive')
+
+        # The target already holds another tube, setting, experiment and run.
+        other_tube = dataclasses.replace(tube_spec, material='other_material')
+        target._add_tube(other_tube)
+        target._add_tube(tube_spec)
+        other_spec = dataclasses.replace(
+            data_spec,
+            setting=dataclasses.replace(data_spec.setting, pressure=80000),
+            experiment=dataclasses.replace(
+                data_spec.experiment,
+                datetime=data_spec.experiment.datetime.replace(year=2018)))
+        other_id = target.add_raw_data(other_spec)['experiment_id']
+        target.add_analysis_run(other_id, dict(error=0.05), '1.0')
+        # Act ----------------------------------------------------------------
+        ParquetArchive(target).load(tmp_path / 'archive')
+        ParquetArchive(target).load(tmp_path / 'archive')
+        # Assert -------------------------------------------------------------
+        session = target.Session()
+        try:
+            loaded_id = target._execute(
+                session, 'experiment_id',
+                datetime=data_spec.experiment.datetime).scalar()
+        finally:
+            session.close()
+        assert loaded_id not in (None, other_id)
+
+        source_arrays = source.get_observation_arrays(experiment_id)
+        target_arrays = target.get_observation_arrays(loaded_id)
+        for name in source_arrays:
+            assert source_arrays[name].tolist() == target_arrays[name].tolist()
+        # The other experiment is untouched.
+        assert len(target.get_observation_arrays(other_id)['idx']) == 2
+
+        loaded_runs = target.get_analysis_runs(loaded_id)
+        assert len(loaded_runs) == 1
+        assert loaded_runs[0]['parameters'] == dict(error=0.01)
+        assert loaded_runs[0]['run_id'] != run['run_id']
+        fits = target.get_fits(
+            experiment_id=loaded_id, run_id=loaded_runs[0]['run_id'])
+        assert fits['idx'].tolist() == [0, 1]
+        assert set(fits['run_id']) == {loaded_runs[0]['run_id']}
+        assert (
+            dict(
+                source.get_experiment_summary(experiment_id),
+                run_id=loaded_runs[0]['run_id'])
+            == target.get_experiment_summary(loaded_id))
+    finally:
+        source._teardown()
+        target._teardown()
+
+
+def test_load_raises_on_conflicting_experiment(
+        tmp_path, monkeypatch, tube_spec, data_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'source.db'))
+    source = ExperimentAccess()
+    source.setup_schema()
+    monkeypatch.setenv('database_path', str(tmp_path / 'target.db'))
+    target = ExperimentAccess()
+    target.setup_schema()
+    try:
+        source._add_tube(tube_spec)
+        source.add_raw_data(data_spec)
+        ParquetArchive(source).export(tmp_path / 'archive')
+
+        target._add_tube(tube_spec)
+        target.add_raw_data(dataclasses.replace(
+            data_spec,
+            experiment=dataclasses.replace(
+                data_spec.experiment, description='Another description.')))
+        # Act and Assert -----------------------------------------------------
+        with pytest.raises(ValueError, match='differs from it'):
+            ParquetArchive(target).load(tmp_path / 'archive')
+    finally:
+        source._teardown()
+        target._teardown()
@@ -0,0 +1,90 @@
+"""Integration test suite for AsyncExperimentAccess."""
+
+import asyncio
+import dataclasses
+
+import pytest
+
+from coimbra_chamber.access.experiment.async_service import (
+    AsyncExperimentAccess)
+from coimbra_chamber.access.experiment.models import Setting
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+
+
+# ----------------------------------------------------------------------------
+# Fixtures
+
+
+@pytest.fixture('function')
+def sqlite_database(tmp_path, monkeypatch):
+    """Point the access services at a SQLite database file."""
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    ExperimentAccess().setup_schema()
+
+
+# ----------------------------------------------------------------------------
+# AsyncExperimentAccess
+
+
+def test_concurrent_inserts_and_queries(
+        sqlite_database, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    ExperimentAccess()._add_tube(tube_spec)
+    data_specs = [
+        dataclasses.replace(
+            data_spec,
+            experiment=dataclasses.replace(
+                data_spec.experiment,
+                datetime=data_spec.experiment.datetime.replace(minute=minute)))
+        for minute in range(4)
+        ]
+    fit_specs = [dataclasses.replace(fit_spec, idx=idx) for idx in range(10)]
+
+    async def run():
+        async with AsyncExperimentAccess(max_workers=4) as access:
+            # Act ------------------------------------------------------------
+            results = await asyncio.gather(
+                *(access.add_raw_data(spec) for spec in data_specs))
+            experiment_ids = [result['experiment_id'] for result in results]
+            added = await asyncio.gather(
+                *(access.add_fits(fit_specs, experiment_id)
+                  for experiment_id in experiment_ids))
+            arrays, summaries, runs = await asyncio.gather(
+                asyncio.gather(
+                    *(access.get_observation_arrays(experiment_id)
+                      for experiment_id in experiment_ids)),
+                asyncio.gather(
+                    *(access.get_experiment_summary(experiment_id)
+                      for experiment_id in experiment_ids)),
+                asyncio.gather(
+                    *(access.get_analysis_runs(experiment_id)
+                      for experiment_id in experiment_ids)))
+            fits, aggregates = await asyncio.gather(
+                access.get_fits(['a'], experiment_id=experiment_ids),
+                access.aggregate_fits(['a']))
+            session = access._exp_acc.Session()
+            try:
+                settings = session.query(Setting).count()
+            finally:
+                session.close()
+            access._exp_acc._teardown()
+            return (
+                results, added, arrays, summaries, runs, fits, aggregates,
+                settings)
+
+    (results, added, arrays, summaries, runs, fits, aggregates,
+     settings) = asyncio.run(run())
+    # Assert -----------------------------------------------------------------
+    assert [result['observations'] for result in results] == [2, 2, 2, 2]
+    assert len({result['experiment_id'] for result in results}) == 4
+    assert len({result['setting_id'] for result in results}) == 1
+    assert settings == 1
+    assert added == [10, 10, 10, 10]
+    for experiment_arrays in arrays:
+        assert experiment_arrays['idx'].tolist() == [0, 1]
+        assert experiment_arrays['temperatures'].shape == (2, 3)
+    assert [summary['observations'] for summary in summaries] == [2, 2, 2, 2]
+    assert runs == [[], [], [], []]
+    assert len(fits) == 40
+    assert aggregates['count'].tolist() == [40]
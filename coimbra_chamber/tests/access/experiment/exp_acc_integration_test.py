@@ -1,26 +1,36 @@
 """Integration test suite for ChamberAccess."""
 
+from concurrent.futures import ThreadPoolExecutor
 import dataclasses
 import datetime
 from decimal import Decimal
+import sqlite3
 from unittest.mock import MagicMock
 
 import dacite
 import pytest
-from nptdms import TdmsFile
 from pandas import DataFrame
 from pytz import utc
-from sqlalchemy import and_
+from sqlalchemy import MetaData, Table, and_, event, inspect
+from sqlalchemy.exc import IntegrityError
 
 from coimbra_chamber.access.experiment.contracts import TemperatureSpec
 from coimbra_chamber.access.experiment.models import (
+    Base,
     Experiment,
+    ExperimentSummary,
     Fit,
+    FitSummary,
+    Job,
     Observation,
+    SchemaVersion,
     Tube,
     Setting,
     Temperature)
 from coimbra_chamber.access.experiment.service import ExperimentAccess
+import coimbra_chamber.access.experiment.migrations as migrations
+import coimbra_chamber.ifx.engines as engines
+import coimbra_chamber.ifx.statements as statements
 
 from coimbra_chamber.tests.conftest import tdms_path
 
@@ -203,6 +213,249 @@ def test_add_observations_that_already_exist(exp_acc, observation_spec):  # noqa
     assert returned_dict == dict(observations=2, temperatures=6)
 
 
+def test_add_observations_counts_without_scans(exp_acc, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: The tests above already added the observations
+    experiment_id = 1
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement.lower())
+
+    event.listen(exp_acc._engine, 'before_cursor_execute', record)
+    try:
+        # Act ----------------------------------------------------------------
+        counts = exp_acc._add_observations(observation_spec, experiment_id)
+        scans = [statement for statement in executed if 'count(' in statement]
+        verified = exp_acc._add_observations(
+            observation_spec, experiment_id, verify=True)
+    finally:
+        event.remove(exp_acc._engine, 'before_cursor_execute', record)
+    # Assert -----------------------------------------------------------------
+    # The totals come from the summary unless they are verified
+    assert not scans
+    assert any('count(' in statement for statement in executed)
+    assert counts == verified == dict(observations=2, temperatures=6)
+
+
+def test_add_observations_completes_partial_ingest(exp_acc, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # Simulate an ingest that was interrupted after the first observation.
+    experiment_id = 3
+    exp_acc._add_observations(observation_spec[:1], experiment_id)
+    # Act --------------------------------------------------------------------
+    returned_dict = exp_acc._add_observations(observation_spec, experiment_id)
+    # Assert -----------------------------------------------------------------
+    assert returned_dict == dict(observations=2, temperatures=6)
+
+
+def test_insert_ignore_only_skips_existing_keys(
+        exp_acc, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: The test above already added these observations
+    experiment_id = 3
+    rows = exp_acc._get_observation_rows(observation_spec, experiment_id)
+    statement = exp_acc._get_insert_ignore(Observation)
+    session = exp_acc.Session()
+    try:
+        # Act ----------------------------------------------------------------
+        session.execute(statement, rows)
+        # Assert -------------------------------------------------------------
+        count = session.query(Observation).filter(
+            Observation.experiment_id == experiment_id).count()
+        assert count == 2
+        # Rows that break other constraints are not skipped
+        with pytest.raises(IntegrityError):
+            session.execute(statement, [dict(rows[0], idx=2, mass=None)])
+    finally:
+        session.rollback()
+        session.close()
+
+
+def test_add_observations_in_chunks(
+        exp_acc, observation_spec, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('commit_size', '1')
+    access = ExperimentAccess()
+    experiment_id = 6
+    insert_observations = access._insert_observations
+
+    def fail_on_second_chunk(session, observations, experiment_id):
+        if observations[0].idx == 1:
+            raise RuntimeError('insert failed')
+        insert_observations(session, observations, experiment_id)
+
+    monkeypatch.setattr(access, '_insert_observations', fail_on_second_chunk)
+    progress = []
+    # Act --------------------------------------------------------------------
+    with pytest.raises(RuntimeError):
+        access._add_observations(
+            observation_spec, experiment_id,
+            lambda *args: progress.append(args))
+    # Assert -----------------------------------------------------------------
+    # The first chunk was committed before the failure
+    assert access.get_observation_arrays(experiment_id)['idx'].tolist() == [0]
+    assert progress == [(1, 2)]
+    # Act --------------------------------------------------------------------
+    monkeypatch.setattr(access, '_insert_observations', insert_observations)
+    progress.clear()
+    returned_dict = access._add_observations(
+        observation_spec, experiment_id, lambda *args: progress.append(args))
+    # Assert -----------------------------------------------------------------
+    # The ingest resumed after the committed chunk
+    assert returned_dict == dict(observations=2, temperatures=6)
+    assert progress == [(1, 2), (2, 2)]
+
+
+def test_add_unsorted_observations_in_chunks(
+        tmp_path, monkeypatch, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('commit_size', '1')
+    access = ExperimentAccess()
+    access.setup_schema()
+    observations = [
+        dataclasses.replace(
+            observation_spec[0], idx=idx, temperatures=[
+                dataclasses.replace(temperature, idx=idx)
+                for temperature in observation_spec[0].temperatures
+                ])
+        for idx in [2, 0, 1]
+        ]
+    insert_observations = access._insert_observations
+
+    def fail_on_second_chunk(session, observations, experiment_id):
+        if observations[0].idx == 1:
+            raise RuntimeError('insert failed')
+        insert_observations(session, observations, experiment_id)
+
+    try:
+        monkeypatch.setattr(access, '_insert_observations', fail_on_second_chunk)
+        with pytest.raises(RuntimeError):
+            access._add_observations(observations, 1)
+        monkeypatch.setattr(access, '_insert_observations', insert_observations)
+        # Act ----------------------------------------------------------------
+        returned_dict = access._add_observations(observations, 1)
+        # Assert -------------------------------------------------------------
+        # Observation 2 came first but was not written before the failure.
+        assert returned_dict == dict(observations=3, temperatures=9)
+        assert access.get_observation_arrays(1)['idx'].tolist() == [0, 1, 2]
+    finally:
+        access._teardown()
+
+
+@pytest.mark.parametrize('temperature_storage', ['rows', 'packed'])
+def test_get_temperature_arrays(
+        tmp_path, monkeypatch, observation_spec,
+        temperature_storage):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('temperature_storage', temperature_storage)
+    # Stream the readings one row per fetch
+    monkeypatch.setenv('batch_size', '1')
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        returned_dict = access._add_observations(observation_spec, 1)
+        # Act ----------------------------------------------------------------
+        with access._engine.connect() as connection:
+            idx, thermocouples, temperatures = access._get_temperature_arrays(
+                connection, 1)
+        # Assert -------------------------------------------------------------
+        assert returned_dict == dict(observations=2, temperatures=6)
+        assert idx.tolist() == [0, 1]
+        assert thermocouples.tolist() == [0, 1, 2]
+        assert temperatures.tolist() == [
+            [300.0, 300.2, 300.4], [301.0, 301.2, 301.4]]
+    finally:
+        access._teardown()
+
+
+def test_temperature_layout_is_checked_on_connect(
+        tmp_path, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('temperature_storage', 'packed')
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        # Act ----------------------------------------------------------------
+        monkeypatch.setenv('temperature_storage', 'rows')
+        with pytest.raises(ValueError) as err:
+            ExperimentAccess()
+        # Assert -------------------------------------------------------------
+        assert '`packed`' in str(err.value)
+        monkeypatch.setenv('temperature_storage', 'packed')
+        # The recorded layout is cached, so later connections do not query it
+        monkeypatch.setattr(
+            ExperimentAccess, '_get_temperature_layout', MagicMock())
+        assert ExperimentAccess()._packed_temperatures
+        ExperimentAccess._get_temperature_layout.assert_not_called()
+    finally:
+        access._teardown()
+
+
+def test_temperature_layout_is_recorded_by_setup_schema(
+        tmp_path, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('temperature_storage', 'packed')
+    access = ExperimentAccess()
+    migrations.migrate(access._engine)
+    try:
+        # Act ----------------------------------------------------------------
+        ExperimentAccess()
+        recorded_on_connect = access._get_temperature_layout()
+        access.setup_schema()
+        # Assert -------------------------------------------------------------
+        assert recorded_on_connect is None
+        assert access._get_temperature_layout() == 'packed'
+    finally:
+        access._teardown()
+
+
+# get_observation_arrays -----------------------------------------------------
+
+
+def test_get_observation_arrays(exp_acc):  # noqa: D103
+    # NOTE: The tests above already added the observations
+    # NOTE: These tests are intended to be run sequently
+    # Act --------------------------------------------------------------------
+    arrays = exp_acc.get_observation_arrays(1)
+    # Assert -----------------------------------------------------------------
+    assert arrays['idx'].tolist() == [0, 1]
+    assert arrays['cap_man_ok'].tolist() == [True, False]
+    assert arrays['dew_point'].tolist() == [280.12, 280.2]
+    assert arrays['mass'].tolist() == [0.1234567, 0.1222222]
+    assert arrays['pressure'].tolist() == [987654, 987000]
+    assert arrays['ic_temp'].tolist() == [291.0, 291.2]
+    assert arrays['thermocouples'].tolist() == [0, 1, 2]
+    assert arrays['temperatures'].tolist() == [
+        [300.0, 300.2, 300.4], [301.0, 301.2, 301.4]]
+
+
+def test_get_observation_arrays_with_unknown_column(exp_acc):  # noqa: D103
+    # Act --------------------------------------------------------------------
+    with pytest.raises(ValueError) as err:
+        exp_acc.get_observation_arrays(1, columns=['mass', 'bogus'])
+    # Assert -----------------------------------------------------------------
+    assert '`bogus`' in str(err.value)
+
+
+def test_get_observation_arrays_for_idx_range_and_columns(exp_acc):  # noqa: D103
+    # Act --------------------------------------------------------------------
+    arrays = exp_acc.get_observation_arrays(
+        1, idx_range=(1, 10), columns=['mass'])
+    # Assert -----------------------------------------------------------------
+    assert set(arrays) == {'idx', 'mass'}
+    assert arrays['idx'].tolist() == [1]
+    assert arrays['mass'].tolist() == [0.1222222]
+
+
 # add_raw_data ---------------------------------------------------------------
 
 
@@ -238,21 +491,58 @@ def test_add_raw_data(exp_acc, data_spec, tube_id, monkeypatch):  # noqa: D103
         assert result['experiment_id'] == 1
         assert result['observations'] == 2
         assert result['temperatures'] == 6
+    # The setting and tube lookups are cached
+    setting_key = exp_acc._get_setting_key(data_spec.setting)
+    assert exp_acc._get_dimension_id('Settings', setting_key) == 1
+    assert exp_acc._tube_exists(tube_id)
+
+
+def test_add_raw_data_is_one_transaction(
+        exp_acc, data_spec, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    new_datetime = datetime.datetime(2019, 10, 1, 12, 0, 0)
+    experiment_spec = dataclasses.replace(
+        data_spec.experiment, datetime=new_datetime)
+    data_spec = dataclasses.replace(data_spec, experiment=experiment_spec)
+
+    def fail(session, observations, experiment_id):
+        raise RuntimeError('insert failed')
+
+    monkeypatch.setattr(exp_acc, '_insert_observations', fail)
+    # Act --------------------------------------------------------------------
+    with pytest.raises(RuntimeError, match='insert failed'):
+        exp_acc.add_raw_data(data_spec)
+    # Assert -----------------------------------------------------------------
+    # The experiment was rolled back with the observations
+    session = exp_acc.Session()
+    try:
+        query = session.query(Experiment.experiment_id)
+        query = query.filter(Experiment.datetime == new_datetime)
+        assert query.first() is None
+    finally:
+        session.close()
+    # The cached ids were cleared with the rollback
+    setting_key = exp_acc._get_setting_key(data_spec.setting)
+    assert exp_acc._get_dimension_id('Settings', setting_key) is None
 
 # connect --------------------------------------------------------------------
 
 
-@pytest.mark.parametrize('filepath', [tdms_path, 'bad_path'])
-def test_connect(exp_acc, filepath):  # noqa: D103
+def test_connect(exp_acc):  # noqa: D103
     # Act --------------------------------------------------------------------
-    exp_acc._connect(filepath)
+    tdms = exp_acc._connect(tdms_path)
     # Assert -----------------------------------------------------------------
-    if filepath:
-        assert isinstance(exp_acc._tdms_file, TdmsFile)
-        assert isinstance(exp_acc._settings, DataFrame)
-        assert isinstance(exp_acc._data, DataFrame)
-    else:
-        assert not hasattr(exp_acc._tdms_file)
+    assert isinstance(tdms.settings, DataFrame)
+    assert isinstance(tdms.data, DataFrame)
+    assert tdms.properties['author'] == 'RHI'
+    # Nothing is kept on the instance
+    assert not hasattr(exp_acc, '_data')
+
+
+def test_connect_to_missing_file(exp_acc):  # noqa: D103
+    # Act and Assert ---------------------------------------------------------
+    with pytest.raises(FileNotFoundError):
+        exp_acc._connect('bad_path')
 
 
 # get_temperature_spec -------------------------------------------------------
@@ -261,9 +551,9 @@ def test_connect(exp_acc, filepath):  # noqa: D103
 @pytest.mark.parametrize('index', [0, 1, 2])
 def test_get_temperature_spec(exp_acc, index):  # noqa: D103
     # Arrange ----------------------------------------------------------------
-    exp_acc._connect(tdms_path)
+    tdms = exp_acc._connect(tdms_path)
     # Act --------------------------------------------------------------------
-    results = exp_acc._get_temperature_specs(index)
+    results = exp_acc._get_temperature_specs(tdms, index)
     # Assert -----------------------------------------------------------------
     for temp_spec in results:
         assert isinstance(temp_spec, TemperatureSpec)
@@ -339,9 +629,9 @@ def test_get_temperature_spec(exp_acc, index):  # noqa: D103
 @pytest.mark.parametrize('index', [0, 1, 2])
 def test_get_observation_sepc(exp_acc, index):  # noqa: D103
     # Arrange ----------------------------------------------------------------
-    exp_acc._connect(tdms_path)
+    tdms = exp_acc._connect(tdms_path)
     # Act --------------------------------------------------------------------
-    results = exp_acc._get_observation_specs(index)
+    results = exp_acc._get_observation_specs(tdms, index)
     # Assert -----------------------------------------------------------------
     for temp_spec in results.temperatures:
         assert isinstance(temp_spec, TemperatureSpec)
@@ -385,9 +675,9 @@ def test_get_observation_sepc(exp_acc, index):  # noqa: D103
 
 def test_get_experiment_spec(exp_acc):  # noqa: D103
     # Arrange ----------------------------------------------------------------
-    exp_acc._connect(tdms_path)
+    tdms = exp_acc._connect(tdms_path)
     # Act --------------------------------------------------------------------
-    result = exp_acc._get_experiment_specs()
+    result = exp_acc._get_experiment_specs(tdms)
     # Assert -----------------------------------------------------------------
     assert result.author == 'RHI'
     assert result.datetime == datetime.datetime(
@@ -401,9 +691,9 @@ def test_get_experiment_spec(exp_acc):  # noqa: D103
 
 def test_get_setting_spec(exp_acc):  # noqa: D103
     # Arrange ----------------------------------------------------------------
-    exp_acc._connect(tdms_path)
+    tdms = exp_acc._connect(tdms_path)
     # Act --------------------------------------------------------------------
-    result = exp_acc._get_setting_specs()
+    result = exp_acc._get_setting_specs(tdms)
     # Assert -----------------------------------------------------------------
     assert result.duty == Decimal('0.0')
     assert result.pressure == int(1e5)
@@ -572,3 +862,909 @@ def test_add_fit_that_already_exists(exp_acc, fit_spec):  # noqa: D103
     # Assert -----------------------------------------------------------------
     assert new_exp_id == expected_experiment_id
     assert new_idx == expected_idx
+
+
+def test_add_fit_reuses_compiled_statements(exp_acc, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: The tests above already added the fit
+    statements.clear()
+    # Act --------------------------------------------------------------------
+    for _ in range(4):
+        exp_acc.add_fit(fit_spec, 1)
+    # Assert -----------------------------------------------------------------
+    # Only the first lookup compiles the statement
+    assert statements.get_stats() == dict(
+        hits=3, misses=1, size=1, hit_rate=0.75)
+
+
+# add_fits -------------------------------------------------------------------
+
+
+def test_add_fits_skips_fits_that_already_exist(exp_acc, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: The tests above already added the fit with idx == 0
+    # NOTE: These tests are intended to be run sequently
+    experiment_id = 1
+    fit_specs = [
+        dataclasses.replace(fit_spec, idx=idx, a=float(idx))
+        for idx in range(3)
+        ]
+    # Act --------------------------------------------------------------------
+    fits_added = exp_acc.add_fits(fit_specs, experiment_id)
+    # Assert -----------------------------------------------------------------
+    assert fits_added == 2
+    # Now query result -------------------------------------------------------
+    session = exp_acc.Session()
+    try:
+        query = session.query(Fit.idx, Fit.a).filter(
+            Fit.experiment_id == experiment_id).order_by(Fit.idx)
+        result = query.all()
+        session.commit()
+        # The fit with idx == 0 was not rewritten
+        assert result == [(0, 1.0), (1, 1.0), (2, 2.0)]
+    finally:
+        session.close()
+
+
+def test_add_fits_that_already_exist(exp_acc, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: The test above already added these fits
+    # NOTE: These tests are intended to be run sequently
+    fit_specs = [dataclasses.replace(fit_spec, idx=idx) for idx in range(3)]
+    # Act --------------------------------------------------------------------
+    fits_added = exp_acc.add_fits(fit_specs, 1)
+    # Assert -----------------------------------------------------------------
+    assert fits_added == 0
+    assert exp_acc.add_fits([], 1) == 0
+
+
+def test_add_fits_raises_when_the_insert_fails(exp_acc, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    fit_specs = [
+        dataclasses.replace(fit_spec, idx=3),
+        dataclasses.replace(fit_spec, idx=4, a=None),
+        ]
+    # Act --------------------------------------------------------------------
+    with pytest.raises(IntegrityError):
+        exp_acc.add_fits(fit_specs, 1)
+    # Assert -----------------------------------------------------------------
+    # Nothing was added
+    assert exp_acc.get_fits(columns=['idx'], experiment_id=1).idx.tolist() == [
+        0, 1, 2]
+
+
+# get_fits -------------------------------------------------------------------
+
+
+def test_get_fits(exp_acc):  # noqa: D103
+    # NOTE: The tests above already added these fits
+    # NOTE: These tests are intended to be run sequently
+    # Arrange ----------------------------------------------------------------
+    columns = ['experiment_id', 'idx', 'a', 'pressure', 'temperature', 'material']
+    # Act --------------------------------------------------------------------
+    frame = exp_acc.get_fits(
+        columns=columns, pressure=99000, material=['test_material'],
+        a=(1.5, None))
+    arrays = exp_acc.get_fits(
+        columns=['idx', 'temperature'], as_frame=False, experiment_id=1,
+        a=(None, 1.5))
+    # Assert -----------------------------------------------------------------
+    assert frame.columns.tolist() == columns
+    assert frame.values.tolist() == [[1, 2, 2.0, 99000, 290.0, 'test_material']]
+    assert arrays['idx'].tolist() == [0, 1]
+    assert arrays['temperature'].tolist() == [290.0, 290.0]
+    assert exp_acc.get_fits(duty=(1, None)).empty
+    with pytest.raises(ValueError):
+        exp_acc.get_fits(columns=['unknown'])
+
+
+# aggregate_fits -------------------------------------------------------------
+
+
+def test_aggregate_fits(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # Each experiment's fits are in a shard of its own
+    monkeypatch.setenv('database_type', 'sharded')
+    monkeypatch.setenv('database_path', str(tmp_path / 'catalog.db'))
+    monkeypatch.setenv('shard_directory', str(tmp_path / 'shards'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    access._add_tube(tube_spec)
+    fits = [[(1.0, 1.0), (2.0, 1.0)], [(4.0, 2.0)]]
+    for minute, values in enumerate(fits):
+        experiment = dataclasses.replace(
+            data_spec.experiment,
+            datetime=data_spec.experiment.datetime.replace(minute=minute))
+        experiment_id = access.add_raw_data(
+            dataclasses.replace(data_spec, experiment=experiment)
+            )['experiment_id']
+        access.add_fits(
+            [
+                dataclasses.replace(
+                    fit_spec, idx=idx, ShR=value, sig_ShR=sigma)
+                for idx, (value, sigma) in enumerate(values)
+                ],
+            experiment_id)
+    try:
+        # Act ----------------------------------------------------------------
+        by_setting = access.aggregate_fits(['ShR'])
+        by_experiment = access.aggregate_fits(
+            ['ShR'], by=['experiment_id'], as_frame=False)
+        filtered = access.aggregate_fits(['ShR'], ShR=(None, 1.5))
+        # Assert -------------------------------------------------------------
+        assert by_setting.columns.tolist() == [
+            'duty', 'pressure', 'temperature', 'count', 'ShR_mean',
+            'ShR_min', 'ShR_max', 'sig_ShR_mean', 'ShR_wmean',
+            'sig_ShR_wmean']
+        assert by_setting.values[0].tolist() == pytest.approx([
+            0.0, 99000, 290.0, 3, 7 / 3, 1.0, 4.0, 4 / 3, 4 / 2.25, 2 / 3])
+        assert by_experiment['experiment_id'].tolist() == [1, 2]
+        assert by_experiment['count'].tolist() == [2, 1]
+        assert by_experiment['ShR_wmean'].tolist() == [1.5, 4.0]
+        assert filtered['count'].tolist() == [1]
+    finally:
+        access._teardown()
+
+
+# get_experiment_summary -----------------------------------------------------
+
+
+def test_get_experiment_summary(exp_acc):  # noqa: D103
+    # NOTE: The tests above already added the observations and fits
+    # NOTE: These tests are intended to be run sequently
+    # Act --------------------------------------------------------------------
+    summary = exp_acc.get_experiment_summary(1)
+    # Assert -----------------------------------------------------------------
+    assert summary == dict(
+        observations=2,
+        temperatures=6,
+        min_idx=0,
+        max_idx=1,
+        pressure_mean=pytest.approx(987327.0),
+        pressure_std=pytest.approx(462.4478),
+        temperature_mean=pytest.approx(300.7),
+        temperature_std=pytest.approx(0.7071068),
+        surface_temp_mean=pytest.approx(290.1),
+        surface_temp_std=pytest.approx(0.1414214),
+        dew_point_mean=pytest.approx(280.16),
+        dew_point_std=pytest.approx(0.0565685),
+        run_id=0,
+        fits=3,
+        mddp_mean=pytest.approx(9.0),
+        fit_coverage=1.0,
+        )
+    assert exp_acc.get_experiment_summary(999) is None
+
+
+def test_rebuild_experiment_summary(exp_acc):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    expected = exp_acc.get_experiment_summary(1)
+    # Act --------------------------------------------------------------------
+    exp_acc.rebuild_experiment_summary(1)
+    # Assert -----------------------------------------------------------------
+    assert exp_acc.get_experiment_summary(1) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('storage', ['sql', 'columnar'])
+def test_missing_summary_is_rebuilt(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec,
+        storage):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('observation_storage', storage)
+    monkeypatch.setenv('observation_store_directory', str(tmp_path / 'columnar'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        access._add_tube(tube_spec)
+        experiment_id = access.add_raw_data(data_spec)['experiment_id']
+        access.add_fits(
+            [dataclasses.replace(fit_spec, idx=idx) for idx in range(2)],
+            experiment_id)
+        # Data added before summaries were kept has none
+        session = access.Session()
+        session.query(ExperimentSummary).delete()
+        session.query(FitSummary).delete()
+        session.commit()
+        session.close()
+        observation = data_spec.observations[0]
+        observation = dataclasses.replace(
+            observation, idx=2, temperatures=[
+                dataclasses.replace(temperature, idx=2)
+                for temperature in observation.temperatures
+                ])
+        # Act ----------------------------------------------------------------
+        access._add_observations([observation], experiment_id)
+        access.add_fits([dataclasses.replace(fit_spec, idx=2)], experiment_id)
+        # Assert -------------------------------------------------------------
+        summary = access.get_experiment_summary(experiment_id)
+        access.rebuild_experiment_summary(experiment_id)
+        assert summary == pytest.approx(
+            access.get_experiment_summary(experiment_id))
+        assert (summary['observations'], summary['fits']) == (3, 3)
+    finally:
+        access._teardown()
+
+
+def test_missing_summary_is_built_on_lookup(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        access._add_tube(tube_spec)
+        experiment_ids = [
+            access.add_raw_data(dataclasses.replace(
+                data_spec,
+                experiment=dataclasses.replace(
+                    data_spec.experiment,
+                    datetime=data_spec.experiment.datetime.replace(
+                        minute=minute)),
+                observations=data_spec.observations[:count])
+                )['experiment_id']
+            for minute, count in [(0, 2), (1, 1)]
+            ]
+        access.add_fits([fit_spec], experiment_ids[0])
+        # Experiments migrated from before summaries were kept have fit
+        # summaries but no observation summaries.
+        session = access.Session()
+        session.query(ExperimentSummary).delete()
+        session.commit()
+        session.close()
+        # Act ----------------------------------------------------------------
+        queued = access.add_jobs()
+        summary = access.get_experiment_summary(experiment_ids[0])
+        # Assert -------------------------------------------------------------
+        assert queued == 2
+        assert (summary['observations'], summary['fits']) == (2, 1)
+        assert summary['fit_coverage'] > 0.0
+        session = access.Session()
+        try:
+            query = session.query(Job.experiment_id, Job.cost).order_by(
+                Job.experiment_id)
+            assert query.all() == [(experiment_ids[0], 2), (experiment_ids[1], 1)]
+            assert session.query(ExperimentSummary).count() == 2
+        finally:
+            session.close()
+    finally:
+        access._teardown()
+
+
+# analysis runs --------------------------------------------------------------
+
+
+def test_analysis_runs(exp_acc, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: The tests above already added fits with idx 0 to 2 to run 0
+    # NOTE: These tests are intended to be run sequently
+    parameters = dict(error=0.01, steps=1)
+    # Act --------------------------------------------------------------------
+    run = exp_acc.add_analysis_run(1, parameters, '1.0')
+    same_run = exp_acc.add_analysis_run(1, dict(steps=1, error=0.01), '1.0')
+    other_run = exp_acc.add_analysis_run(1, dict(error=0.05, steps=1), '1.0')
+    new_version = exp_acc.add_analysis_run(1, parameters, '1.1')
+    fit_specs = [
+        dataclasses.replace(fit_spec, idx=idx, run_id=run['run_id'])
+        for idx in range(2)
+        ]
+    fits_added = exp_acc.add_fits(fit_specs, 1)
+    completed = exp_acc.complete_analysis_run(run['run_id'])
+    # Assert -----------------------------------------------------------------
+    assert run['completed'] is None
+    assert same_run['run_id'] == run['run_id']
+    assert same_run['param_hash'] == run['param_hash']
+    assert len({run['run_id'], other_run['run_id'], new_version['run_id']}) == 3
+    # Fits of a run do not collide with fits of other runs.
+    assert fits_added == 2
+    assert exp_acc.add_fits(fit_specs, 1) == 0
+    assert completed
+    # Only the latest completed run is matched unless runs are given.
+    fits = exp_acc.get_fits(columns=['idx', 'run_id'], experiment_id=1)
+    assert list(zip(fits.idx, fits.run_id)) == [
+        (0, run['run_id']), (1, run['run_id'])]
+    fits = exp_acc.get_fits(
+        columns=['idx', 'run_id'], experiment_id=1, run_id=[0, run['run_id']])
+    assert list(zip(fits.idx, fits.run_id)) == [
+        (0, 0), (0, run['run_id']), (1, 0), (1, run['run_id']), (2, 0)]
+    assert exp_acc.get_fits(run_id=run['run_id']).idx.tolist() == [0, 1]
+    aggregates = exp_acc.aggregate_fits(
+        ['a'], by=['run_id'], experiment_id=1, run_id=[0, run['run_id']])
+    assert aggregates['count'].tolist() == [3, 2]
+    assert exp_acc.aggregate_fits(['a'], experiment_id=1)['count'].tolist() == [
+        2]
+    runs = exp_acc.get_analysis_runs(1)
+    assert [r['run_id'] for r in runs] == sorted(
+        [run['run_id'], other_run['run_id'], new_version['run_id']])
+    assert runs[0]['parameters'] == parameters
+    assert runs[0]['completed'] is not None
+    assert exp_acc.add_analysis_run(1, parameters, '1.0')['completed']
+    # Fits are summarized per run, the latest by default
+    summary = exp_acc.get_experiment_summary(1)
+    assert (summary['run_id'], summary['fits']) == (run['run_id'], 2)
+    assert exp_acc.get_experiment_summary(1, run_id=0)['fits'] == 3
+    other_summary = exp_acc.get_experiment_summary(
+        1, run_id=other_run['run_id'])
+    assert (other_summary['fits'], other_summary['mddp_mean']) == (0, None)
+
+
+def test_setup_schema_summarizes_fits_by_run(
+        tmp_path, monkeypatch, observation_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    # A database whose summary aggregates the fits of every run
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:8])
+        access.setup_schema()
+    for run_id, count in [(0, 2), (1, 3)]:
+        for idx in range(count):
+            row = access._get_fit_row(
+                dataclasses.replace(fit_spec, idx=idx, run_id=run_id), 1)
+            access._engine.execute(Fit.__table__.insert(), row)
+    try:
+        # Act ----------------------------------------------------------------
+        version = access.setup_schema()
+        # Assert -------------------------------------------------------------
+        assert version == migrations.SCHEMA_VERSION
+        columns = [
+            column['name'] for column in
+            inspect(access._engine).get_columns('ExperimentSummaries')]
+        assert 'fit_count' not in columns
+        summary = access.get_experiment_summary(1)
+        assert (summary['run_id'], summary['fits']) == (1, 3)
+        assert summary['mddp_mean'] == pytest.approx(float(fit_spec.mddp))
+        assert access.get_experiment_summary(1, run_id=0)['fits'] == 2
+    finally:
+        access._teardown()
+
+
+def test_setup_schema_merges_duplicate_settings(
+        tmp_path, monkeypatch, tube_spec, setting_spec,
+        experiment_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    # A database without natural keys, where concurrent ingests added the
+    # same setting twice
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:9])
+        access.setup_schema()
+    access._engine.execute(
+        Tube.__table__.insert(), dataclasses.asdict(tube_spec))
+    row = dict(
+        duty=setting_spec.duty, pressure=setting_spec.pressure,
+        temperature=setting_spec.temperature,
+        time_step=setting_spec.time_step)
+    for setting_id in [1, 2]:
+        access._engine.execute(
+            Setting.__table__.insert(), dict(row, setting_id=setting_id))
+        spec = dataclasses.replace(
+            experiment_spec,
+            datetime=experiment_spec.datetime.replace(minute=setting_id))
+        access._add_experiment(spec, setting_id)
+    try:
+        # Act ----------------------------------------------------------------
+        version = access.setup_schema()
+        # Assert -------------------------------------------------------------
+        assert version == migrations.SCHEMA_VERSION
+        session = access.Session()
+        try:
+            assert session.query(Setting.setting_id).all() == [(1,)]
+            assert session.query(Experiment.setting_id).all() == [(1,), (1,)]
+        finally:
+            session.close()
+        assert access._add_setting(setting_spec) == 1
+    finally:
+        access._teardown()
+
+
+# sqlite database ------------------------------------------------------------
+
+
+def test_sqlite_database_is_durable(tmp_path, monkeypatch, tube_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    try:
+        tube_id = access._add_tube(tube_spec)
+        # Act ----------------------------------------------------------------
+        # Close every connection and start over from the file.
+        engines.dispose_engine(access._conn_string)
+        access = ExperimentAccess()
+        # Assert -------------------------------------------------------------
+        journal_mode = access._engine.execute('PRAGMA journal_mode;').scalar()
+        assert journal_mode == 'wal'
+        session = access.Session()
+        try:
+            query = session.query(Tube.tube_id)
+            query = query.filter(Tube.material == 'test_material')
+            assert query.one() == (tube_id,)
+        finally:
+            session.close()
+    finally:
+        access._teardown()
+
+
+# setup_schema ---------------------------------------------------------------
+
+
+def test_setup_schema(tmp_path, monkeypatch, tube_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    # Construction runs no DDL
+    assert not access._engine.has_table('Tubes')
+    # A database created before schema versions were recorded
+    Base.metadata.create_all(
+        access._engine,
+        tables=[
+            table for table in Base.metadata.sorted_tables
+            if table.name != 'SchemaVersions'
+            ])
+    tube_id = access._add_tube(tube_spec)
+    try:
+        # Act ----------------------------------------------------------------
+        version = access.setup_schema()
+        version_again = access.setup_schema()
+        # Assert -------------------------------------------------------------
+        assert version == version_again == migrations.SCHEMA_VERSION
+        session = access.Session()
+        try:
+            versions = session.query(SchemaVersion.version).all()
+            assert versions == [(version,) for version, _, _
+                                in migrations.MIGRATIONS]
+            assert session.query(Tube.tube_id).all() == [(tube_id,)]
+        finally:
+            session.close()
+    finally:
+        access._teardown()
+
+
+def test_setup_schema_keys_legacy_fits_by_run(
+        tmp_path, monkeypatch, observation_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    # A database whose fits are keyed by experiment and idx only
+    legacy_fits = Table(
+        'Fits', MetaData(),
+        *[column.copy() for column in Fit.__table__.columns
+          if column.name != 'run_id'])
+    Base.metadata.create_all(
+        access._engine,
+        tables=[
+            table for table in Base.metadata.sorted_tables
+            if table.name not in ['Fits', 'AnalysisRuns', 'SchemaVersions']
+            ])
+    legacy_fits.create(access._engine)
+    access._add_observations(observation_spec, 1)
+    row = access._get_fit_row(fit_spec, 1)
+    del row['run_id']
+    access._engine.execute(legacy_fits.insert(), row)
+    try:
+        # Act ----------------------------------------------------------------
+        version = access.setup_schema()
+        run = access.add_analysis_run(1, dict(error=0.01), '1.0')
+        fits_added = access.add_fits(
+            [dataclasses.replace(fit_spec, run_id=run['run_id'])], 1)
+        # Assert -------------------------------------------------------------
+        assert version == migrations.SCHEMA_VERSION
+        primary_key = inspect(access._engine).get_pk_constraint('Fits')
+        assert primary_key['constrained_columns'] == [
+            'idx', 'experiment_id', 'run_id']
+        assert fits_added == 1
+        session = access.Session()
+        try:
+            query = session.query(Fit.run_id, Fit.a).order_by(Fit.run_id)
+            assert query.all() == [
+                (0, fit_spec.a), (run['run_id'], fit_spec.a)]
+        finally:
+            session.close()
+    finally:
+        access._teardown()
+
+
+def test_setup_schema_matches_models(tmp_path, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    try:
+        # Act ----------------------------------------------------------------
+        access.setup_schema()
+        # Assert -------------------------------------------------------------
+        inspector = inspect(access._engine)
+        assert set(inspector.get_table_names()) == set(Base.metadata.tables)
+        for table in Base.metadata.tables.values():
+            columns = inspector.get_columns(table.name)
+            assert [column['name'] for column in columns] == [
+                column.name for column in table.columns]
+            assert [column['nullable'] for column in columns] == [
+                column.nullable for column in table.columns]
+            primary_key = inspector.get_pk_constraint(table.name)
+            assert primary_key['constrained_columns'] == [
+                column.name for column in table.primary_key.columns]
+            indexes = inspector.get_indexes(table.name)
+            assert {index['name'] for index in indexes} == {
+                index.name for index in table.indexes}
+            foreign_keys = inspector.get_foreign_keys(table.name)
+            assert {
+                tuple(key['constrained_columns']) for key in foreign_keys
+                } == {
+                tuple(key.column_keys)
+                for key in table.foreign_key_constraints}
+    finally:
+        access._teardown()
+
+
+def test_setup_schema_adds_experiment_indexes(
+        tmp_path, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    # A database created before the experiment-leading indexes
+    Base.metadata.create_all(
+        access._engine,
+        tables=[
+            table for table in Base.metadata.sorted_tables
+            if table.name != 'SchemaVersions'
+            ])
+    names = [
+        'ix_Observations_experiment_id_idx',
+        'ix_Temperatures_experiment_id_idx',
+        'ix_PackedTemperatures_experiment_id_idx',
+        'ix_Fits_experiment_id_idx',
+        ]
+    for name in names:
+        access._engine.execute(f'DROP INDEX "{name}"')
+    try:
+        # Act ----------------------------------------------------------------
+        access.setup_schema()
+        # Assert -------------------------------------------------------------
+        inspector = inspect(access._engine)
+        for name in names:
+            table_name = name.split('_')[1]
+            assert name in {
+                index['name'] for index in inspector.get_indexes(table_name)}
+    finally:
+        access._teardown()
+
+
+# shared instance ------------------------------------------------------------
+
+
+def test_instance_is_shared_by_threads(
+        tmp_path, monkeypatch, observation_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    experiment_ids = [1, 2, 3, 4]
+    fit_specs = [dataclasses.replace(fit_spec, idx=idx) for idx in range(10)]
+
+    def ingest(experiment_id):
+        counts = access._add_observations(observation_spec, experiment_id)
+        fits_added = access.add_fits(fit_specs, experiment_id)
+        arrays = access.get_observation_arrays(experiment_id)
+        return counts, fits_added, arrays
+
+    try:
+        # Act ----------------------------------------------------------------
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            raw_data = list(pool.map(
+                access.get_raw_data, [tdms_path] * len(experiment_ids)))
+            results = list(pool.map(ingest, experiment_ids))
+        # Assert -------------------------------------------------------------
+        assert all(data == raw_data[0] for data in raw_data)
+        for counts, fits_added, arrays in results:
+            assert counts == dict(observations=2, temperatures=6)
+            assert fits_added == 10
+            assert arrays['idx'].tolist() == [0, 1]
+    finally:
+        access._teardown()
+
+
+def test_concurrent_ingests_share_one_setting(
+        tmp_path, monkeypatch, tube_spec, data_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    access._add_tube(tube_spec)
+    data_specs = [
+        dataclasses.replace(
+            data_spec,
+            experiment=dataclasses.replace(
+                data_spec.experiment,
+                datetime=data_spec.experiment.datetime.replace(minute=minute)))
+        for minute in range(8)
+        ]
+    try:
+        # Act ----------------------------------------------------------------
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(access.add_raw_data, data_specs))
+        # Assert -------------------------------------------------------------
+        assert len({result['setting_id'] for result in results}) == 1
+        session = access.Session()
+        try:
+            assert session.query(Setting).count() == 1
+            assert session.query(Tube).count() == 1
+        finally:
+            session.close()
+    finally:
+        access._teardown()
+
+
+# jobs -----------------------------------------------------------------------
+
+
+def test_jobs(
+        tmp_path, monkeypatch, tube_spec, setting_spec, experiment_spec,
+        observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    access._add_tube(tube_spec)
+    setting_id = access._add_setting(setting_spec)
+    # The first experiment has two observations, the second one
+    experiment_ids = []
+    for minute, observations in enumerate(
+            [observation_spec, observation_spec[:1]]):
+        spec = dataclasses.replace(
+            experiment_spec,
+            datetime=experiment_spec.datetime.replace(minute=minute))
+        experiment_id = access._add_experiment(spec, setting_id)
+        access._add_observations(observations, experiment_id)
+        experiment_ids.append(experiment_id)
+    try:
+        # Act ----------------------------------------------------------------
+        queued = access.add_jobs()
+        queued_again = access.add_jobs()
+        first = access.claim_job('a', lease_seconds=-1)
+        second = access.claim_job('b')
+        third = access.claim_job('c')
+        # Assert -------------------------------------------------------------
+        assert (queued, queued_again) == (2, 0)
+        # The cheapest experiment is claimed first
+        assert first['experiment_id'] == experiment_ids[1]
+        # Its lease already expired, so it went back to the queue
+        assert second == dict(
+            experiment_id=experiment_ids[1], lease_id=second['lease_id'],
+            attempts=2)
+        assert third['experiment_id'] == experiment_ids[0]
+        assert not access.finish_job(
+            first['experiment_id'], first['lease_id'])
+        assert access.renew_job(second['experiment_id'], second['lease_id'])
+        assert access.finish_job(second['experiment_id'], second['lease_id'])
+        # A failed job is retried until it was claimed max_attempts times
+        assert access.finish_job(
+            third['experiment_id'], third['lease_id'], error='failed')
+        fourth = access.claim_job('d')
+        assert fourth['attempts'] == 2
+        assert access.finish_job(
+            fourth['experiment_id'], fourth['lease_id'], error='failed',
+            max_attempts=2)
+        assert access.claim_job('e') is None
+        assert access.get_job_counts() == dict(done=1, failed=1)
+    finally:
+        access._teardown()
+
+
+# sharded database -----------------------------------------------------------
+
+
+def test_sharded_database(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sharded')
+    monkeypatch.setenv('database_path', str(tmp_path / 'catalog.db'))
+    monkeypatch.setenv('shard_directory', str(tmp_path / 'shards'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    fit_specs = [dataclasses.replace(fit_spec, idx=idx) for idx in range(2)]
+
+    def assert_readable(access, experiment_id):
+        arrays = access.get_observation_arrays(experiment_id)
+        assert arrays['idx'].tolist() == [0, 1]
+        assert arrays['temperatures'].shape == (2, 3)
+        fits = access.get_fits(
+            columns=['idx', 'pressure'], experiment_id=experiment_id)
+        assert fits.values.tolist() == [[0, 99000], [1, 99000]]
+        summary = access.get_experiment_summary(experiment_id)
+        assert (summary['observations'], summary['fits']) == (2, 2)
+
+    try:
+        access._add_tube(tube_spec)
+        # Act ----------------------------------------------------------------
+        result = access.add_raw_data(data_spec)
+        experiment_id = result['experiment_id']
+        fits_added = access.add_fits(fit_specs, experiment_id)
+        # Assert -------------------------------------------------------------
+        assert (result['observations'], result['temperatures']) == (2, 6)
+        assert fits_added == 2
+        # The observations are in the shard, not the catalog
+        assert access._get_shard_ids() == [experiment_id]
+        session = access.Session()
+        try:
+            assert session.query(Observation).count() == 0
+        finally:
+            session.close()
+        assert_readable(access, experiment_id)
+        # Act ----------------------------------------------------------------
+        merged = access.merge_shards()
+        # Assert -------------------------------------------------------------
+        assert merged == [experiment_id]
+        assert access._get_shard_ids() == []
+        assert_readable(access, experiment_id)
+    finally:
+        access._teardown()
+
+
+def test_merged_shard_that_is_kept_is_read_once(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sharded')
+    monkeypatch.setenv('database_path', str(tmp_path / 'catalog.db'))
+    monkeypatch.setenv('shard_directory', str(tmp_path / 'shards'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    fit_specs = [dataclasses.replace(fit_spec, idx=idx) for idx in range(3)]
+    try:
+        access._add_tube(tube_spec)
+        experiment_id = access.add_raw_data(data_spec)['experiment_id']
+        access.add_fits(fit_specs[:2], experiment_id)
+        # Act ----------------------------------------------------------------
+        merged = access.merge_shards(remove=False)
+        merged_again = access.merge_shards(remove=False)
+        # Writes after the merge go to the central database
+        access.add_fits(fit_specs[2:], experiment_id)
+        fits = access.get_fits(columns=['idx'], experiment_id=experiment_id)
+        all_fits = access.get_fits(columns=['idx'])
+        aggregates = access.aggregate_fits(['a'])
+        # Assert -------------------------------------------------------------
+        assert merged == [experiment_id]
+        assert merged_again == []
+        assert fits['idx'].tolist() == all_fits['idx'].tolist() == [0, 1, 2]
+        assert aggregates['count'].tolist() == [3]
+        assert access.get_experiment_summary(experiment_id)['fits'] == 3
+        # The kept shard was not written again
+        shard = sqlite3.connect(str(access._get_shard_path(experiment_id)))
+        try:
+            assert shard.execute('SELECT count(*) FROM Fits').fetchone() == (2,)
+        finally:
+            shard.close()
+        # A new instance also reads the experiment from the catalog only
+        assert len(ExperimentAccess().get_fits(columns=['idx'])) == 3
+        # Removing merged shards deletes the kept one
+        assert access.merge_shards() == []
+        assert access._get_shard_ids() == []
+    finally:
+        access._teardown()
+
+
+# columnar observation storage -----------------------------------------------
+
+
+def test_columnar_observation_storage(
+        exp_acc, tmp_path, monkeypatch, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # The summaries live in a database of its own
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('observation_storage', 'columnar')
+    monkeypatch.setenv('observation_store_directory', str(tmp_path / 'columnar'))
+    monkeypatch.setenv('observation_store_chunk_size', '1')
+    access = ExperimentAccess()
+    access.setup_schema()
+    experiment_id = 7
+    exp_acc._add_observations(observation_spec, experiment_id)
+    sql_arrays = exp_acc.get_observation_arrays(experiment_id)
+    # Act --------------------------------------------------------------------
+    returned_dict = access._add_observations(observation_spec, experiment_id)
+    # Adding them again is a no-op
+    returned_again = access._add_observations(
+        observation_spec, experiment_id, verify=True)
+    arrays = access.get_observation_arrays(experiment_id)
+    ranged = access.get_observation_arrays(
+        experiment_id, idx_range=(1, 1), columns=['mass', 'temperatures'])
+    # Assert -----------------------------------------------------------------
+    assert returned_dict == returned_again == dict(observations=2, temperatures=6)
+    assert set(arrays) == set(sql_arrays)
+    for name, values in sql_arrays.items():
+        assert arrays[name].dtype == values.dtype
+        assert arrays[name].tolist() == values.tolist()
+    assert set(ranged) == {'idx', 'mass', 'thermocouples', 'temperatures'}
+    assert ranged['idx'].tolist() == [1]
+    assert ranged['mass'].tolist() == [0.1222222]
+    assert ranged['temperatures'].tolist() == [[301.0, 301.2, 301.4]]
+    session = access.Session()
+    try:
+        assert access._get_resume_idx(session, experiment_id) == 1
+    finally:
+        session.close()
+    access._teardown()
+    assert not (tmp_path / 'columnar').exists()
+
+
+def test_columnar_chunks_follow_the_transaction(
+        tmp_path, monkeypatch, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('observation_storage', 'columnar')
+    monkeypatch.setenv('observation_store_directory', str(tmp_path / 'columnar'))
+    monkeypatch.setenv('observation_store_chunk_size', '1')
+    access = ExperimentAccess()
+    access.setup_schema()
+    directory = tmp_path / 'columnar' / 'experiment_1'
+    try:
+        # Act ----------------------------------------------------------------
+        session = access.Session()
+        try:
+            access._insert_observations(session, observation_spec, 1)
+            written = sorted(directory.iterdir())
+            session.rollback()
+        finally:
+            session.close()
+        rolled_back = sorted(directory.iterdir())
+        # A chunk file left behind by a crash is never listed
+        (directory / 'chunk_partial.chk.tmp').write_bytes(b'\0' * 10)
+        returned_dict = access._add_observations(observation_spec, 1)
+        arrays = access.get_observation_arrays(1)
+        # Assert -------------------------------------------------------------
+        assert len(written) == 2
+        assert rolled_back == []
+        assert returned_dict == dict(observations=2, temperatures=6)
+        assert arrays['idx'].tolist() == [0, 1]
+        assert arrays['temperatures'].shape == (2, 3)
+        assert len(list(directory.glob('*.chk'))) == 2
+    finally:
+        access._teardown()
+
+
+def test_columnar_observation_storage_with_fits(
+        tmp_path, monkeypatch, tube_spec, data_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    monkeypatch.setenv('observation_storage', 'columnar')
+    monkeypatch.setenv('observation_store_directory', str(tmp_path / 'columnar'))
+    access = ExperimentAccess()
+    access.setup_schema()
+
+    # Enforce foreign keys, as MySQL does
+    def enforce_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+    event.listen(access._engine, 'connect', enforce_foreign_keys)
+    access._engine.dispose()
+    try:
+        access._add_tube(tube_spec)
+        experiment_id = access.add_raw_data(data_spec)['experiment_id']
+        # Act ----------------------------------------------------------------
+        fits_added = access.add_fits(
+            [dataclasses.replace(fit_spec, idx=idx) for idx in range(2)],
+            experiment_id)
+        fits = access.get_fits(columns=['idx'], experiment_id=experiment_id)
+        # Assert -------------------------------------------------------------
+        assert fits_added == 2
+        assert fits['idx'].tolist() == [0, 1]
+        assert access.get_experiment_summary(experiment_id)['fits'] == 2
+    finally:
+        event.remove(access._engine, 'connect', enforce_foreign_keys)
+        access._teardown()
@@ -60,16 +60,16 @@ def test_get_tube_spec(monkeypatch):  # noqa: D103
     )
     tube_spec = dacite.from_dict(TubeSpec, data)
     # Act --------------------------------------------------------------------
-    access._get_tube_spec()
+    result = access._get_tube_spec()
     # Assert -----------------------------------------------------------------
-    assert access._tube_spec == tube_spec
+    assert result == tube_spec
 
 
 def test_public_add_tube(tube_spec, monkeypatch):  # noqa: D103
     # Arrange ------------------------------------------------------------
     access = ExperimentAccess()
-    access._tube_spec = tube_spec
     mock_access = MagicMock()
+    mock_access._get_tube_spec.return_value = tube_spec
     monkeypatch.setattr(
         'coimbra_chamber.access.experiment.service.ExperimentAccess'
         '._get_tube_spec',
@@ -81,9 +81,19 @@ def test_public_add_tube(tube_spec, monkeypatch):  # noqa: D103
         mock_access._add_tube
     )
     get_tube_spec_calls = [call()]
-    add_tube_calls = [call(access._tube_spec)]
+    add_tube_calls = [call(tube_spec)]
     # Act ----------------------------------------------------------------
     access.add_tube()
     # Assert -------------------------------------------------------------
     mock_access._get_tube_spec.assert_has_calls(get_tube_spec_calls)
     mock_access._add_tube.assert_has_calls(add_tube_calls)
+
+
+# __init__ -------------------------------------------------------------------
+
+def test_instances_share_engine():  # noqa: D103
+    # Act --------------------------------------------------------------------
+    first = ExperimentAccess()
+    second = ExperimentAccess()
+    # Assert -----------------------------------------------------------------
+    assert first._engine is second._engine
@@ -0,0 +1,113 @@
+"""Integration test suite for ExperimentWriter."""
+
+import dataclasses
+import threading
+
+import pytest
+
+from coimbra_chamber.access.experiment.models import Fit, Observation
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+from coimbra_chamber.access.experiment.writer import ExperimentWriter
+
+
+# ----------------------------------------------------------------------------
+# Fixtures
+
+
+@pytest.fixture('function')
+def access(tmp_path, monkeypatch):
+    """Access service on a fresh SQLite database file."""
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    yield access
+    access._teardown()
+
+
+# ----------------------------------------------------------------------------
+# ExperimentWriter
+
+
+def test_writer_persists_queued_batches(
+        access, observation_spec, fit_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    experiment_id = 1
+    fit_batches = [
+        [dataclasses.replace(fit_spec, idx=idx) for idx in range(start, start + 5)]
+        for start in range(0, 20, 5)
+        ]
+    # Act --------------------------------------------------------------------
+    with ExperimentWriter(access, max_batches=2) as writer:
+        writer.put_observations(observation_spec, experiment_id)
+        for fit_specs in fit_batches:
+            writer.put_fits(fit_specs, experiment_id)
+        writer.put_fits([], experiment_id)
+    # Assert -----------------------------------------------------------------
+    session = access.Session()
+    try:
+        fits = session.query(Fit.idx).filter(
+            Fit.experiment_id == experiment_id).order_by(Fit.idx).all()
+        observations = session.query(Observation.idx).filter(
+            Observation.experiment_id == experiment_id).all()
+        session.commit()
+    finally:
+        session.close()
+    assert [idx for idx, in fits] == list(range(20))
+    assert len(observations) == 2
+
+
+def test_writer_joins_coalesced_fit_batches(
+        access, observation_spec, fit_spec, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    experiment_id = 1
+    released = threading.Event()
+    insert_observations = access._insert_observations
+    insert_fits = access._insert_fits
+    fit_calls = []
+
+    def blocked_insert_observations(session, observations, experiment_id):
+        # Hold the writer so the fit batches wait in the queue together
+        released.wait()
+        return insert_observations(session, observations, experiment_id)
+
+    def counted_insert_fits(session, fit_specs, experiment_id):
+        fit_calls.append(len(fit_specs))
+        return insert_fits(session, fit_specs, experiment_id)
+
+    monkeypatch.setattr(
+        access, '_insert_observations', blocked_insert_observations)
+    monkeypatch.setattr(access, '_insert_fits', counted_insert_fits)
+    # Act --------------------------------------------------------------------
+    with ExperimentWriter(access, max_batches=8) as writer:
+        writer.put_observations(observation_spec, experiment_id)
+        for start in range(0, 20, 5):
+            writer.put_fits(
+                [
+                    dataclasses.replace(fit_spec, idx=idx)
+                    for idx in range(start, start + 5)
+                    ],
+                experiment_id)
+        released.set()
+    # Assert -----------------------------------------------------------------
+    # The four queued batches are inserted in one call
+    assert fit_calls == [20]
+
+
+def test_writer_reports_errors_on_flush(
+        access, fit_spec, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    def fail(session, fit_specs, experiment_id):
+        raise RuntimeError('write failed')
+
+    monkeypatch.setattr(access, '_insert_fits', fail)
+    writer = ExperimentWriter(access)
+    try:
+        writer.put_fits([fit_spec], 1)
+        # Act and Assert -----------------------------------------------------
+        with pytest.raises(RuntimeError, match='write failed'):
+            writer.flush()
+        # The error is only reported once
+        writer.flush()
+    finally:
+        writer.close()
@@ -4,6 +4,7 @@ import dacite
 from pathlib import Path
 import pytest
 
+from coimbra_chamber.__version__ import __version__
 from coimbra_chamber.access.experiment.contracts import (
     FitSpec
 )
@@ -373,3 +374,76 @@ def test_process_fits(anlys_eng, mock_io_util, tube_spec):  # noqa: D103
         assert result_indexes == expected_indexes
     finally:
         session.close()
+
+
+def test_load_observations(anlys_eng):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: test_process_fits already added the raw data for experiment 2
+    anlys_eng._experiment_id = 2
+    anlys_eng._data = anlys_eng._exp_acc.get_raw_data('test_path')
+    anlys_eng._get_observations()
+    expected = anlys_eng._observations
+    # Act --------------------------------------------------------------------
+    anlys_eng._load_observations()
+    # Assert -----------------------------------------------------------------
+    result = anlys_eng._observations
+    assert result.index.tolist() == expected.index.tolist()
+    assert result.columns.tolist() == expected.columns.tolist()
+    for key in ['cap_man', 'optidew']:
+        assert result[key].tolist() == expected[key].tolist()
+    for key in ['Tdp', 'm', 'Jref', 'P', 'Te', 'Ts', 'Tic']:
+        for this_obs, expect_this in zip(result[key], expected[key]):
+            assert this_obs.nominal_value == pytest.approx(
+                float(expect_this.nominal_value))
+            assert this_obs.std_dev == pytest.approx(expect_this.std_dev)
+
+
+def test_process_fits_from_database(anlys_eng, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: test_process_fits already added the raw data for experiment 2 and
+    # completed its analysis run; another engine version starts a new run.
+    monkeypatch.setattr(
+        'coimbra_chamber.engine.analysis.service.__version__', 'reanalysis')
+    anlys_eng._experiment_id = 2
+    expected_indexes = [
+        121, 268, 417, 570, 723, 876, 1033, 1192, 1355, 1514, 1679, 1844,
+        2011, 2178, 2349, 2520, 2693, 2866, 3041, 3216, 3393,
+    ]
+    # Act --------------------------------------------------------------------
+    fits = anlys_eng.process_fits()
+    # Assert -----------------------------------------------------------------
+    assert [fit['idx'] for fit in anlys_eng._fits] == expected_indexes
+    assert fits.idx.tolist() == expected_indexes
+    assert set(fits.run_id) == {anlys_eng._run_id}
+    runs = anlys_eng._exp_acc.get_analysis_runs(2)
+    assert [run['engine_version'] for run in runs] == [__version__, 'reanalysis']
+    assert runs[0]['run_id'] != anlys_eng._run_id
+
+
+def test_process_fits_reuses_completed_run(
+        anlys_eng, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # NOTE: test_process_fits already completed a run for experiment 2
+    anlys_eng._experiment_id = 2
+
+    def fail():
+        raise AssertionError('the fits were computed again')
+
+    monkeypatch.setattr(anlys_eng, '_load_observations', fail)
+    monkeypatch.setattr(anlys_eng, '_get_fits', fail)
+    expected_indexes = [
+        121, 268, 417, 570, 723, 876, 1033, 1192, 1355, 1514, 1679, 1844,
+        2011, 2178, 2349, 2520, 2693, 2866, 3041, 3216, 3393,
+    ]
+    # Act --------------------------------------------------------------------
+    fits = anlys_eng.process_fits()
+    # Assert -----------------------------------------------------------------
+    assert fits.idx.tolist() == expected_indexes
+    assert anlys_eng._run_id == anlys_eng._exp_acc.get_analysis_runs(2)[0][
+        'run_id']
+    # Other parameters get a run of their own.
+    anlys_eng._error = 0.05
+    run = anlys_eng._exp_acc.add_analysis_run(
+        2, anlys_eng._get_parameters(), __version__)
+    assert run['run_id'] != anlys_eng._run_id
+    assert run['completed'] is None
@@ -469,6 +469,17 @@ def test_process_fits(anlys_eng, data_spec, mock_engine, monkeypatch):  # noqa:
     mock_engine.assert_has_calls(expected_calls)
 
 
+def test_get_parameters(anlys_eng):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    expected = anlys_eng._get_parameters()
+    # Act --------------------------------------------------------------------
+    # The progress of an analysis does not change its run
+    anlys_eng._idx = 50
+    # Assert -----------------------------------------------------------------
+    assert anlys_eng._get_parameters() == expected
+    assert expected == dict(error=0.01, steps=1, bounds=[None, None])
+
+
 def test_set_local_exp_state(anlys_eng, sample):  # noqa: D103
     # Arrange ----------------------------------------------------------------
     anlys_eng._this_sample = sample
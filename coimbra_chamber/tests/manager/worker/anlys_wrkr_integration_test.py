@@ -0,0 +1,155 @@
+"""Integration test suite for AnalysisWorker."""
+
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+
+import pytest
+
+from coimbra_chamber.access.experiment.service import ExperimentAccess
+from coimbra_chamber.manager.worker.service import AnalysisWorker
+
+
+# ----------------------------------------------------------------------------
+# Fixtures
+
+
+@pytest.fixture('function')
+def access(
+        tmp_path, monkeypatch, tube_spec, setting_spec, experiment_spec):
+    """Access service on a database file with three experiments."""
+    monkeypatch.setenv('database_type', 'sqlite')
+    monkeypatch.setenv('database_path', str(tmp_path / 'chamber.db'))
+    access = ExperimentAccess()
+    access.setup_schema()
+    access._add_tube(tube_spec)
+    setting_id = access._add_setting(setting_spec)
+    for minute in range(3):
+        spec = dataclasses.replace(
+            experiment_spec,
+            datetime=experiment_spec.datetime.replace(minute=minute))
+        access._add_experiment(spec, setting_id)
+    yield access
+    access._teardown()
+
+
+# ----------------------------------------------------------------------------
+# AnalysisWorker
+
+
+def test_workers_share_the_queue(access, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    analyzed = []
+
+    def process_fits(self, data=None):
+        analyzed.append(self._experiment_id)
+        if self._experiment_id == 2:
+            raise RuntimeError('bad data')
+
+    monkeypatch.setattr(
+        'coimbra_chamber.engine.analysis.service.AnalysisEngine.process_fits',
+        process_fits)
+    first = AnalysisWorker('first', max_attempts=1)
+    second = AnalysisWorker('second', max_attempts=1)
+    # Act --------------------------------------------------------------------
+    queued = first.queue()
+    first_counts = first.run(max_jobs=1)
+    second_counts = second.run()
+    # Assert -----------------------------------------------------------------
+    assert queued == 3
+    assert first_counts == dict(done=1, failed=0)
+    assert second_counts == dict(done=1, failed=1)
+    assert sorted(analyzed) == [1, 2, 3]
+    assert access.get_job_counts() == dict(done=2, failed=1)
+
+
+def test_failed_jobs_are_retried(access, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    analyzed = []
+
+    def process_fits(self, data=None):
+        analyzed.append(self._experiment_id)
+        if self._experiment_id == 2:
+            raise RuntimeError('bad data')
+
+    monkeypatch.setattr(
+        'coimbra_chamber.engine.analysis.service.AnalysisEngine.process_fits',
+        process_fits)
+    worker = AnalysisWorker('worker', max_attempts=2)
+    worker.queue()
+    # Act --------------------------------------------------------------------
+    counts = worker.run()
+    job_counts = access.get_job_counts()
+    requeued = worker.requeue()
+    # Assert -----------------------------------------------------------------
+    assert counts == dict(done=2, failed=2)
+    assert analyzed == [1, 2, 2, 3]
+    assert job_counts == dict(done=2, failed=1)
+    assert requeued == 1
+    assert access.get_job_counts() == dict(done=2, pending=1)
+
+
+def test_claims_take_the_cheapest_job(
+        access, observation_spec):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    # The cost of a job is the number of observations of its experiment
+    access._add_observations(observation_spec, 1)
+    access.add_jobs()
+    # Act --------------------------------------------------------------------
+    claimed = [access.claim_job('worker')['experiment_id'] for _ in range(3)]
+    # Assert -----------------------------------------------------------------
+    assert claimed == [2, 3, 1]
+    assert access.claim_job('worker') is None
+
+
+def test_concurrent_claims_are_unique(access):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    access.add_jobs()
+    # Act --------------------------------------------------------------------
+    with ThreadPoolExecutor(8) as executor:
+        jobs = list(executor.map(
+            lambda number: access.claim_job(f'worker-{number}'), range(8)))
+    # Assert -----------------------------------------------------------------
+    claimed = [job['experiment_id'] for job in jobs if job]
+    assert sorted(claimed) == [1, 2, 3]
+    assert len({job['lease_id'] for job in jobs if job}) == 3
+    assert access.get_job_counts() == dict(running=3)
+
+
+def test_expired_leases(access):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    access.add_jobs([1, 2])
+    # Leases are kept in database time; this one has already expired.
+    expired = access.claim_job('first', lease_seconds=-1, max_attempts=1)
+    # Act --------------------------------------------------------------------
+    checked = access.check_job(expired['experiment_id'], expired['lease_id'])
+    renewed = access.renew_job(expired['experiment_id'], expired['lease_id'])
+    # The expired job is not retried
+    second = access.claim_job('second', max_attempts=1)
+    finished = access.finish_job(
+        expired['experiment_id'], expired['lease_id'])
+    # Assert -----------------------------------------------------------------
+    assert (checked, renewed, finished) == (False, False, False)
+    assert second['experiment_id'] == 2
+    assert access.check_job(second['experiment_id'], second['lease_id'])
+    assert access.get_job_counts() == dict(failed=1, running=1)
+
+
+def test_lost_lease_aborts_the_analysis(access, monkeypatch):  # noqa: D103
+    # Arrange ----------------------------------------------------------------
+    def process_fits(self, data=None):
+        self._persist_fits()
+
+    monkeypatch.setattr(
+        'coimbra_chamber.engine.analysis.service.AnalysisEngine.process_fits',
+        process_fits)
+    monkeypatch.setattr(
+        'coimbra_chamber.access.experiment.service.ExperimentAccess.check_job',
+        lambda self, experiment_id, lease_id: False)
+    worker = AnalysisWorker('worker', max_attempts=1)
+    worker.queue([1])
+    # Act --------------------------------------------------------------------
+    counts = worker.run()
+    # Assert -----------------------------------------------------------------
+    assert counts == dict(done=0, failed=1)
+    # No fits were kept for any analysis run.
+    assert access.get_fits(experiment_id=1, run_id=(1, None)).empty
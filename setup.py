@@ -37,7 +37,7 @@ REQUIRED = [
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['django'],
+    'parquet': ['pyarrow>=3.0.0'],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -71,7 +71,7 @@ setup(
     url=URL,
     packages=find_packages(exclude=['tests', '*.tests', '*.tests.*', 'tests.*']),
     install_requires=REQUIRED,
-    extra_require=EXTRAS,
+    extras_require=EXTRAS,
     include_package_data=True,
     license='LICENSE.txt',
     classifiers=[